@@ -0,0 +1,178 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+synthetic webhook deliveries, registered on a FakeGitHub before use
+"""
+from __future__ import unicode_literals, print_function
+from collections import OrderedDict
+import json
+import random
+from typing import Callable, Dict, List, Text, Tuple
+
+from .fake_github import FakeGitHub
+
+
+__all__ = ['SCENARIOS', 'Delivery']
+
+
+OWNER = u'cosname'
+REPO = u'cosx.org'
+POSTS = u'content/post/'
+
+# (event, payload)
+Delivery = Tuple[Text, Dict]
+
+
+def _api(kind, number):
+    # payloads always carry the real api host, the client is pointed elsewhere
+    return u'https://api.github.com/repos/{}/{}/{}/{}'.format(OWNER, REPO, kind, number)
+
+
+def _article(rng, lines, images_without_alt=1):
+    # type: (random.Random, int, int) -> bytes
+    body = [u'paragraph {} with some words.'.format(i) for i in range(lines)]
+    for _ in range(images_without_alt):
+        body[rng.randrange(lines)] = u'![](figure.png)'
+    meta = [
+        u'---',
+        u'title: "a post"',
+        u'author: someone',
+        u'categories: [statistics]',
+        u'tags: [r]',
+        u'meta_extra: ""',
+        u'---',
+        u''
+    ]
+    return u'\n'.join(meta + body + [u'']).encode('utf-8')
+
+
+def _notebook(size):
+    # type: (int) -> bytes
+    """a notebook whose bulk is base64 image output, like the real ones"""
+    image = u'A' * 76
+    outputs = [{
+        'output_type': 'display_data',
+        'data': {'image/png': [image] * (size // 80)},
+        'metadata': {}
+    }]
+    notebook = {
+        'metadata': {'title': 'a notebook'},
+        'nbformat': 4,
+        'nbformat_minor': 2,
+        'cells': [
+            {'cell_type': 'markdown', 'metadata': {},
+             'source': [u'---\n', u'title: "a notebook"\n', u'author: someone\n', u'---\n']},
+            {'cell_type': 'markdown', 'metadata': {}, 'source': [u'# hello\n', u'![](x.png)']},
+            {'cell_type': 'code', 'metadata': {}, 'execution_count': 1,
+             'source': [u'plot()'], 'outputs': outputs}
+        ]
+    }
+    return json.dumps(notebook).encode('utf-8')
+
+
+def _pull_request_opened(fake, number, author, association):
+    # type: (FakeGitHub, int, Text, Text) -> Delivery
+    return 'pull_request', {
+        'action': 'opened',
+        'number': number,
+        'sender': {'login': author},
+        'repository': {'full_name': OWNER + '/' + REPO},
+        'pull_request': {
+            'url': _api('pulls', number),
+            'number': number,
+            'user': {'login': author},
+            'author_association': association,
+            'base': {'ref': 'master'},
+            'head': {'sha': fake.pulls[(OWNER, REPO, number)]['head']}
+        }
+    }
+
+
+def small_prs(fake, count, start=1):
+    # type: (FakeGitHub, int, int) -> List[Delivery]
+    """one or two short posts per pull request"""
+    rng = random.Random(1)
+    deliveries = []
+    for number in range(start, start + count):
+        files = dict(
+            (u'{}2018-01-{:02d}-post-{}.md'.format(POSTS, i + 1, number), _article(rng, 40))
+            for i in range(rng.randint(1, 2)))
+        fake.add_pull_request(OWNER, REPO, number, u'author{}'.format(number), files)
+        deliveries.append(_pull_request_opened(fake, number, u'author{}'.format(number), u'CONTRIBUTOR'))
+    return deliveries
+
+
+def big_prs(fake, count, start=1001):
+    # type: (FakeGitHub, int, int) -> List[Delivery]
+    """100 posts per pull request, e.g. a bulk migration"""
+    rng = random.Random(2)
+    deliveries = []
+    for number in range(start, start + count):
+        files = dict(
+            (u'{}2018-02-01-bulk-{}-{}.md'.format(POSTS, number, i), _article(rng, 200, 3))
+            for i in range(100))
+        fake.add_pull_request(OWNER, REPO, number, u'editor', files, author_association=u'MEMBER')
+        deliveries.append(_pull_request_opened(fake, number, u'editor', u'MEMBER'))
+    return deliveries
+
+
+def notebooks(fake, count, start=2001):
+    # type: (FakeGitHub, int, int) -> List[Delivery]
+    """a single 1 MB jupyter notebook per pull request"""
+    deliveries = []
+    data = _notebook(1024 * 1024)
+    for number in range(start, start + count):
+        files = {u'{}2018-03-01-notebook-{}.ipynb'.format(POSTS, number): data}
+        fake.add_pull_request(OWNER, REPO, number, u'author{}'.format(number), files)
+        deliveries.append(_pull_request_opened(fake, number, u'author{}'.format(number), u'CONTRIBUTOR'))
+    return deliveries
+
+
+def synchronize(fake, count, start=3001):
+    # type: (FakeGitHub, int, int) -> List[Delivery]
+    """open a pull request, then push one small fix after another"""
+    rng = random.Random(3)
+    deliveries = []
+    number = start
+    name = u'{}2018-04-01-growing-post.md'.format(POSTS)
+    text = _article(rng, 300, 5).decode('utf-8').split('\n')
+    fake.add_pull_request(OWNER, REPO, number, u'writer', {name: u'\n'.join(text).encode('utf-8')})
+    deliveries.append(_pull_request_opened(fake, number, u'writer', u'CONTRIBUTOR'))
+    for _ in range(count - 1):
+        text.insert(rng.randrange(10, len(text)), u'a new sentence ![](more.png)')
+        before, after = fake.push_to_pull_request(
+            OWNER, REPO, number, {name: u'\n'.join(text).encode('utf-8')})
+        event, payload = _pull_request_opened(fake, number, u'writer', u'CONTRIBUTOR')
+        payload.update({'action': 'synchronize', 'before': before, 'after': after})
+        deliveries.append((event, payload))
+    return deliveries
+
+
+def mention_storm(fake, count, start=4001, bot=u'housekeeper-bot'):
+    # type: (FakeGitHub, int, int, Text) -> List[Delivery]
+    """many people mentioning the bot on the same issue"""
+    number = start
+    fake.add_issue(OWNER, REPO, number, u'someone', u'help')
+    deliveries = []
+    for idx in range(count):
+        person = u'person{}'.format(idx)
+        deliveries.append(('issue_comment', {
+            'action': 'created',
+            'sender': {'login': person},
+            'repository': {'full_name': OWNER + '/' + REPO},
+            'issue': {'url': _api('issues', number), 'number': number, 'body': u'help'},
+            'comment': {
+                'body': u'@{} could you have a look?\n\nthanks'.format(bot),
+                'user': {'login': person}
+            }
+        }))
+    return deliveries
+
+
+SCENARIOS = OrderedDict([
+    ('small', small_prs),
+    ('big', big_prs),
+    ('notebook', notebooks),
+    ('synchronize', synchronize),
+    ('mentions', mention_storm),
+]) # type: Dict[Text, Callable[..., List[Delivery]]]
@@ -0,0 +1,599 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+a tiny, in-memory stand-in for the parts of the github rest api
+that `housekeeper.reaction` talks to, with configurable latency.
+the two graphql queries of `housekeeper.graphql` are answered too.
+given a `git_root`, pull requests are also pushed to local bare repos
+there, the remotes of the git backend.
+"""
+from __future__ import unicode_literals, print_function
+import base64
+from collections import Counter, OrderedDict
+import difflib
+from hashlib import sha1
+import itertools
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer # type: ignore
+    from SocketServer import ThreadingMixIn # type: ignore
+    from urlparse import parse_qs, urlparse # type: ignore
+    from urllib import unquote # type: ignore
+
+
+__all__ = ['FakeGitHub', 'blob_sha']
+
+
+# github3 refuses objects with missing keys, so we fill in every key it reads
+USER_KEYS = (
+    'avatar_url', 'events_url', 'followers_url', 'following_url', 'gists_url',
+    'gravatar_id', 'html_url', 'id', 'login', 'organizations_url',
+    'received_events_url', 'repos_url', 'starred_url', 'subscriptions_url',
+    'type', 'url')
+REPO_KEYS = (
+    'archive_url', 'assignees_url', 'blobs_url', 'branches_url',
+    'collaborators_url', 'comments_url', 'commits_url', 'compare_url',
+    'contents_url', 'contributors_url', 'deployments_url', 'description',
+    'downloads_url', 'events_url', 'fork', 'forks_url', 'full_name',
+    'git_commits_url', 'git_refs_url', 'git_tags_url', 'hooks_url', 'html_url',
+    'id', 'issue_comment_url', 'issue_events_url', 'issues_url', 'keys_url',
+    'labels_url', 'languages_url', 'merges_url', 'milestones_url', 'name',
+    'notifications_url', 'owner', 'private', 'pulls_url', 'releases_url',
+    'stargazers_url', 'statuses_url', 'subscribers_url', 'subscription_url',
+    'tags_url', 'teams_url', 'trees_url', 'url')
+PULL_KEYS = (
+    '_links', 'active_lock_reason', 'additions', 'assignee', 'assignees',
+    'author_association', 'base', 'body', 'body_html', 'body_text', 'closed_at',
+    'comments', 'comments_url', 'commits', 'commits_url', 'created_at',
+    'deletions', 'diff_url', 'draft', 'head', 'html_url', 'id', 'issue_url',
+    'locked', 'merge_commit_sha', 'mergeable', 'mergeable_state', 'merged',
+    'merged_at', 'merged_by', 'number', 'patch_url', 'requested_reviewers',
+    'requested_teams', 'review_comment_url', 'review_comments',
+    'review_comments_url', 'state', 'statuses_url', 'title', 'updated_at',
+    'url', 'user')
+ISSUE_KEYS = (
+    'assignee', 'assignees', 'body', 'body_html', 'body_text', 'closed_at',
+    'closed_by', 'comments', 'comments_url', 'created_at', 'events_url',
+    'html_url', 'id', 'labels', 'labels_url', 'locked', 'milestone', 'number',
+    'state', 'title', 'updated_at', 'url', 'user')
+COMMENT_KEYS = (
+    'author_association', 'body', 'body_html', 'body_text', 'created_at',
+    'html_url', 'id', 'issue_url', 'updated_at', 'url', 'user')
+FILE_KEYS = (
+    'additions', 'blob_url', 'changes', 'contents_url', 'deletions',
+    'filename', 'raw_url', 'sha', 'status')
+
+
+def blob_sha(
+    data # type: bytes
+    ):
+    # type: (...) -> Text
+    """the git blob sha of some bytes"""
+    return sha1(b'blob ' + str(len(data)).encode('ascii') + b'\0' + data).hexdigest()
+
+
+def _fill(
+    keys, # type: Tuple[Text, ...]
+    base_url, # type: Text
+    **values # type: Any
+    ):
+    # type: (...) -> Dict[Text, Any]
+    obj = {} # type: Dict[Text, Any]
+    for key in keys:
+        if key.endswith('_url'):
+            obj[key] = u'{}/{}'.format(base_url, key)
+        elif key in ('assignees', 'labels', 'requested_reviewers', 'requested_teams'):
+            obj[key] = []
+        elif key in ('_links',):
+            obj[key] = {}
+        elif key in ('id', 'comments', 'commits', 'additions', 'deletions',
+                     'changes', 'review_comments'):
+            obj[key] = 0
+        else:
+            obj[key] = None
+    obj.update(values)
+    return obj
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    fake = None # type: Optional[FakeGitHub]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like the real api
+
+    def log_message(self, *args):
+        pass
+
+    def _dispatch(self, method):
+        fake = self.server.fake # type: FakeGitHub
+        parsed = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        for route_method, pattern, name, handler in fake.routes:
+            if route_method != method:
+                continue
+            matched = pattern.match(parsed.path)
+            if matched is None:
+                continue
+            if fake.latency:
+                time.sleep(fake.latency)
+            status, headers, data = handler(
+                matched, parse_qs(parsed.query), self.headers, body)
+            if method == 'GET' and status == 200:
+                headers['ETag'] = u'"{}"'.format(sha1(data).hexdigest())
+                if self.headers.get('If-None-Match') == headers['ETag']:
+                    status, data = 304, b''
+            if status == 304:
+                fake.account(method, name + ' (304)', 0)
+            else:
+                fake.account(method, name, len(data))
+            break
+        else:
+            status, headers, data = 404, {}, json.dumps(
+                {'message': 'Not Found'}).encode('utf-8')
+            fake.account(method, 'not-found', len(data))
+        # like github, a conditional hit does not count against the limit
+        headers.update(fake.spend(status != 304))
+        self.send_response(status)
+        headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+
+class FakeGitHub(object):
+    """serve pull requests, files, contents, issues and comments from memory
+
+    every request is counted by endpoint, so benchmarks can report
+    api calls (and bytes) per delivery.
+    """
+
+    def __init__(self,
+        latency=0.0, # type: float
+        host='127.0.0.1', # type: Text
+        port=0, # type: int
+        rate_limit=5000, # type: int
+        git_root=None # type: Optional[Text]
+        ):
+        # type: (...) -> None
+        self.latency = latency
+        self.git_root = git_root
+        self.host = host
+        self.port = port
+        self.rate_limit = rate_limit
+        self.rate_limit_remaining = rate_limit
+        self.rate_limit_reset = time.time() + 3600
+        # github leaves out the text of larger blobs, `isTruncated` then
+        self.graphql_text_limit = 512 * 1024
+
+        self.calls = Counter() # type: Counter
+        self.bytes_sent = Counter() # type: Counter
+        self.blobs = {} # type: Dict[Text, bytes]
+        self.commits = {} # type: Dict[Text, Dict[Text, Text]]
+        self.pulls = {} # type: Dict[Tuple[Text, Text, int], Dict]
+        self.issues = {} # type: Dict[Tuple[Text, Text, int], Dict]
+        self.comments = OrderedDict() # type: Dict[int, Dict]
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._server = None # type: Optional[_Server]
+        self._thread = None # type: Optional[threading.Thread]
+
+        repo_path = r'/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)'
+        self.routes = [
+            ('GET', repo_path + r'/pulls/(?P<number>\d+)$', 'pulls', self._get_pull),
+            ('GET', repo_path + r'/pulls/(?P<number>\d+)/files$', 'pulls/files', self._get_pull_files),
+            ('GET', repo_path + r'/issues/(?P<number>\d+)$', 'issues', self._get_issue),
+            ('GET', repo_path + r'/issues/(?P<number>\d+)/comments$', 'issues/comments', self._get_comments),
+            ('POST', repo_path + r'/issues/(?P<number>\d+)/comments$', 'issues/comments', self._create_comment),
+            ('PATCH', repo_path + r'/issues/comments/(?P<id>\d+)$', 'issues/comments/edit', self._edit_comment),
+            ('GET', repo_path + r'/contents/(?P<path>.+)$', 'contents', self._get_contents),
+            ('GET', repo_path + r'/compare/(?P<base>[^.]+)\.\.\.(?P<head>.+)$', 'compare', self._get_compare),
+            ('POST', r'/graphql$', 'graphql', self._graphql),
+        ] # type: List[Tuple[Text, Any, Text, Callable]]
+        self.routes = [
+            (method, re.compile(pattern), name, handler)
+            for method, pattern, name, handler in self.routes]
+
+    ################################################
+    # lifecycle
+    ################################################
+
+    @property
+    def url(self):
+        # type: () -> Text
+        assert self._server is not None, 'start the server first'
+        return u'http://{}:{}'.format(self.host, self._server.server_address[1])
+
+    def start(self):
+        # type: () -> FakeGitHub
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # type: () -> None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def account(self, method, name, size):
+        with self._lock:
+            self.calls[(method, name)] += 1
+            self.bytes_sent[(method, name)] += size
+
+    def spend(self, counted):
+        # type: (bool) -> Dict[Text, Text]
+        """the rate limit headers of a response"""
+        with self._lock:
+            if counted:
+                self.rate_limit_remaining = max(self.rate_limit_remaining - 1, 0)
+            return {
+                'X-RateLimit-Limit': str(self.rate_limit),
+                'X-RateLimit-Remaining': str(self.rate_limit_remaining),
+                'X-RateLimit-Reset': str(int(self.rate_limit_reset))
+            }
+
+    def reset_counters(self):
+        # type: () -> None
+        with self._lock:
+            self.calls.clear()
+            self.bytes_sent.clear()
+
+    ################################################
+    # fixtures
+    ################################################
+
+    def _user(self, login):
+        return _fill(USER_KEYS, self.url + u'/users/' + login, login=login, type='User')
+
+    def _repo(self, owner, repo):
+        return _fill(
+            REPO_KEYS, u'{}/repos/{}/{}'.format(self.url, owner, repo),
+            owner=self._user(owner), name=repo, full_name=owner + '/' + repo,
+            id=1, fork=False, private=False,
+            url=u'{}/repos/{}/{}'.format(self.url, owner, repo))
+
+    def add_commit(self,
+        files, # type: Dict[Text, bytes]
+        sha=None # type: Optional[Text]
+        ):
+        # type: (...) -> Text
+        """store a tree of files, return its (fake, unless given) commit sha"""
+        tree = {} # type: Dict[Text, Text]
+        for path, data in files.items():
+            blob = blob_sha(data)
+            self.blobs[blob] = data
+            tree[path] = blob
+        commit = sha or sha1(json.dumps(sorted(tree.items())).encode('utf-8')).hexdigest()
+        self.commits[commit] = tree
+        return commit
+
+    def add_pull_request(self,
+        owner, # type: Text
+        repo, # type: Text
+        number, # type: int
+        author, # type: Text
+        files, # type: Dict[Text, bytes]
+        base_files=None, # type: Optional[Dict[Text, bytes]]
+        author_association=u'CONTRIBUTOR' # type: Text
+        ):
+        # type: (...) -> Tuple[Text, Text]
+        """a pull request changing `base_files` into `files`, return (base, head)"""
+        base_tree = base_files or {}
+        head_tree = dict(base_tree, **files)
+        base = head = None
+        if self.git_root:
+            base = self._git_commit(owner, repo, base_tree, None, u'refs/heads/master')
+            head = self._git_commit(
+                owner, repo, head_tree, base, u'refs/pull/{}/head'.format(number))
+        base = self.add_commit(base_tree, base)
+        head = self.add_commit(head_tree, head)
+        api = u'{}/repos/{}/{}/pulls/{}'.format(self.url, owner, repo, number)
+        ref = {
+            'ref': 'master', 'label': owner + ':master', 'sha': base,
+            'user': self._user(owner), 'repo': self._repo(owner, repo)}
+        self.pulls[(owner, repo, number)] = {
+            'json': _fill(
+                PULL_KEYS, api, url=api, number=number, id=number,
+                title=u'pull request {}'.format(number), state='open',
+                user=self._user(author), author_association=author_association,
+                base=ref, head=dict(ref, ref='patch', sha=head),
+                issue_url=u'{}/repos/{}/{}/issues/{}'.format(self.url, owner, repo, number)),
+            'base': base,
+            'head': head
+        }
+        self.add_issue(owner, repo, number, author, u'')
+        return base, head
+
+    def push_to_pull_request(self,
+        owner, # type: Text
+        repo, # type: Text
+        number, # type: int
+        files # type: Dict[Text, bytes]
+        ):
+        # type: (...) -> Tuple[Text, Text]
+        """update files on the head of a pull request, return (before, after)"""
+        pull = self.pulls[(owner, repo, number)]
+        before = pull['head']
+        tree = dict((path, self.blobs[sha]) for path, sha in self.commits[before].items())
+        tree.update(files)
+        after = None
+        if self.git_root:
+            after = self._git_commit(
+                owner, repo, tree, before, u'refs/pull/{}/head'.format(number))
+        pull['head'] = self.add_commit(tree, after)
+        pull['json']['head']['sha'] = pull['head']
+        return before, pull['head']
+
+    def _git_commit(self,
+        owner, # type: Text
+        repo, # type: Text
+        files, # type: Dict[Text, bytes]
+        parent, # type: Optional[Text]
+        ref # type: Text
+        ):
+        # type: (...) -> Text
+        """commit the tree to the bare repo of owner/repo, move `ref` to it"""
+        assert self.git_root is not None, 'no git_root to keep the repos in'
+        git_dir = os.path.join(self.git_root, owner, repo + '.git')
+        if not os.path.isdir(git_dir):
+            subprocess.check_call(['git', 'init', '--bare', '--quiet', git_dir])
+        for data in files.values():
+            # loose objects, written directly, are much faster than a process each
+            sha = blob_sha(data)
+            path = os.path.join(git_dir, 'objects', sha[:2], sha[2:])
+            if not os.path.exists(path):
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'wb') as f:
+                    f.write(zlib.compress(
+                        b'blob ' + str(len(data)).encode('ascii') + b'\0' + data))
+
+        def git(*args, **kwargs):
+            return subprocess.run(
+                ['git', '--git-dir', git_dir] + list(args), check=True,
+                stdout=subprocess.PIPE, input=kwargs.get('input'),
+                env=dict(os.environ, GIT_INDEX_FILE=os.path.join(git_dir, 'fake-index'),
+                         GIT_AUTHOR_NAME='fake', GIT_AUTHOR_EMAIL='fake@example.com',
+                         GIT_COMMITTER_NAME='fake', GIT_COMMITTER_EMAIL='fake@example.com'),
+            ).stdout.decode('ascii').strip()
+        git('read-tree', '--empty')
+        git('update-index', '--index-info', input=u''.join(
+            u'100644 {}\t{}\n'.format(blob_sha(data), path)
+            for path, data in files.items()).encode('utf-8'))
+        tree = git('write-tree')
+        commit = git(*(['commit-tree', tree, '-m', ref] + (['-p', parent] if parent else [])))
+        git('update-ref', ref, commit)
+        return commit
+
+    def add_issue(self,
+        owner, # type: Text
+        repo, # type: Text
+        number, # type: int
+        author, # type: Text
+        body # type: Text
+        ):
+        # type: (...) -> None
+        api = u'{}/repos/{}/{}/issues/{}'.format(self.url, owner, repo, number)
+        self.issues[(owner, repo, number)] = _fill(
+            ISSUE_KEYS, api, url=api, number=number, id=number, body=body,
+            title=u'issue {}'.format(number), state='open', locked=False,
+            user=self._user(author))
+
+    def comments_on(self,
+        owner, # type: Text
+        repo, # type: Text
+        number # type: int
+        ):
+        # type: (...) -> List[Text]
+        """bodies of the comments on an issue, oldest first"""
+        key = [owner, repo, number]
+        return [x['body'] for x in self.comments.values() if x['_issue'] == key]
+
+    ################################################
+    # endpoints
+    ################################################
+
+    def _key(self, matched):
+        return (matched.group('owner'), matched.group('repo'),
+                int(matched.group('number')))
+
+    def _json(self, obj, status=200):
+        if isinstance(obj, dict):
+            obj = dict((k, v) for k, v in obj.items() if not k.startswith('_issue'))
+        elif isinstance(obj, list):
+            obj = [
+                dict((k, v) for k, v in x.items() if not k.startswith('_issue'))
+                for x in obj]
+        return status, {}, json.dumps(obj).encode('utf-8')
+
+    def _not_found(self):
+        return self._json({'message': 'Not Found'}, 404)
+
+    def _get_pull(self, matched, query, headers, body):
+        pull = self.pulls.get(self._key(matched))
+        return self._json(pull['json']) if pull else self._not_found()
+
+    def _get_pull_files(self, matched, query, headers, body):
+        pull = self.pulls.get(self._key(matched))
+        if pull is None:
+            return self._not_found()
+        owner, repo, _ = self._key(matched)
+        return self._json(self._changed_files(
+            owner, repo, pull['base'], pull['head'], with_patch=False))
+
+    def _changed_files(self, owner, repo, base, head, with_patch):
+        old, new = self.commits[base], self.commits[head]
+        files = []
+        for path in sorted(set(old) | set(new)):
+            if old.get(path) == new.get(path):
+                continue
+            status = 'added' if path not in old else (
+                'removed' if path not in new else 'modified')
+            sha = new.get(path) or old[path]
+            contents_url = u'{}/repos/{}/{}/contents/{}?ref={}'.format(
+                self.url, owner, repo, path, head)
+            entry = _fill(
+                FILE_KEYS, contents_url, filename=path, status=status, sha=sha,
+                contents_url=contents_url)
+            if with_patch:
+                before = self.blobs[old[path]].decode('utf-8').splitlines() \
+                    if path in old else []
+                after = self.blobs[new[path]].decode('utf-8').splitlines() \
+                    if path in new else []
+                lines = list(difflib.unified_diff(before, after, lineterm=''))
+                entry['patch'] = u'\n'.join(lines[2:]) # github drops the headers
+            files.append(entry)
+        return files
+
+    def _login(self, headers):
+        # comments belong to whoever authenticates, like on github
+        auth = headers.get('Authorization', '')
+        if auth.startswith('Basic '):
+            return base64.b64decode(auth[len('Basic '):]).decode('utf-8').split(':')[0]
+        return u'anonymous'
+
+    def _get_issue(self, matched, query, headers, body):
+        issue = self.issues.get(self._key(matched))
+        return self._json(issue) if issue else self._not_found()
+
+    def _get_comments(self, matched, query, headers, body):
+        key = list(self._key(matched))
+        return self._json([x for x in self.comments.values() if x['_issue'] == key])
+
+    def _create_comment(self, matched, query, headers, body):
+        owner, repo, number = self._key(matched)
+        comment_id = next(self._ids)
+        api = u'{}/repos/{}/{}/issues/comments/{}'.format(
+            self.url, owner, repo, comment_id)
+        comment = _fill(
+            COMMENT_KEYS, api, url=api, id=comment_id,
+            body=json.loads(body.decode('utf-8'))['body'],
+            user=self._user(self._login(headers)))
+        comment['_issue'] = [owner, repo, number]
+        with self._lock:
+            self.comments[comment_id] = comment
+        return self._json(comment, 201)
+
+    def _edit_comment(self, matched, query, headers, body):
+        comment = self.comments.get(int(matched.group('id')))
+        if comment is None:
+            return self._not_found()
+        comment['body'] = json.loads(body.decode('utf-8'))['body']
+        return self._json(comment)
+
+    def _get_contents(self, matched, query, headers, body):
+        path = unquote(matched.group('path'))
+        ref = query.get('ref', [None])[0]
+        tree = self.commits.get(ref, {}) if ref else {}
+        if path not in tree:
+            return self._not_found()
+        data = self.blobs[tree[path]]
+        if 'raw' in headers.get('Accept', ''):
+            return 200, {'Content-Type': 'application/octet-stream'}, data
+        return self._json({
+            'type': 'file', 'path': path, 'name': path.split('/')[-1],
+            'sha': tree[path], 'size': len(data), 'encoding': 'base64',
+            'content': base64.b64encode(data).decode('ascii')})
+
+    def _get_compare(self, matched, query, headers, body):
+        base, head = matched.group('base'), matched.group('head')
+        if base not in self.commits or head not in self.commits:
+            return self._not_found()
+        owner, repo = matched.group('owner'), matched.group('repo')
+        return self._json({
+            'status': 'ahead',
+            'files': self._changed_files(owner, repo, base, head, with_patch=True)
+        })
+
+    ################################################
+    # graphql
+    ################################################
+
+    def _graphql(self, matched, query, headers, body):
+        request = json.loads(body.decode('utf-8'))
+        text, variables = request['query'], request.get('variables') or {}
+        if 'pullRequest' in text:
+            answer = self._graphql_pull_request(variables)
+        else:
+            answer = {'data': {'repository': self._graphql_blobs(
+                variables, with_text=' text' in text)}}
+        data = json.dumps(answer).encode('utf-8')
+        return 200, {'X-RateLimit-Resource': 'graphql'}, data
+
+    def _graphql_pull_request(self, variables):
+        owner, repo = variables['owner'], variables['name']
+        pull = self.pulls.get((owner, repo, variables['number']))
+        if pull is None:
+            return {
+                'data': {'repository': {'pullRequest': None}},
+                'errors': [{'type': 'NOT_FOUND', 'message': 'no such pull request'}]}
+        change_types = {'added': 'ADDED', 'removed': 'DELETED', 'modified': 'MODIFIED'}
+        files = [
+            {'path': x['filename'], 'changeType': change_types[x['status']]}
+            for x in self._changed_files(
+                owner, repo, pull['base'], pull['head'], with_patch=False)]
+        # the cursor is just the offset
+        start = int(variables.get('after') or 0)
+        page = files[start:start + variables['first']]
+        return {'data': {'repository': {'pullRequest': {
+            'headRefOid': pull['head'],
+            'files': {
+                'pageInfo': {
+                    'hasNextPage': start + len(page) < len(files),
+                    'endCursor': str(start + len(page))},
+                'nodes': page}}}}}
+
+    def _graphql_blobs(self, variables, with_text):
+        repository = {} # type: Dict[Text, Any]
+        for alias, expression in variables.items():
+            if alias in ('owner', 'name'):
+                continue
+            rev, path = expression.split(':', 1)
+            tree = self.commits.get(rev, {})
+            if path not in tree:
+                repository[alias] = None
+                continue
+            data = self.blobs[tree[path]]
+            node = {'oid': tree[path], 'byteSize': len(data)} # type: Dict[Text, Any]
+            if with_text:
+                try:
+                    content = data.decode('utf-8') # type: Optional[Text]
+                except UnicodeDecodeError:
+                    content = None
+                truncated = len(data) > self.graphql_text_limit
+                node.update({
+                    'isBinary': content is None,
+                    'isTruncated': truncated,
+                    'text': None if truncated else content})
+            repository[alias] = node
+        return repository
@@ -0,0 +1,270 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+replay deliveries recorded with `RECORD_PATH` through `Reaction.run`
+
+    python -m benchmarks.replay deliveries.jsonl.gz --speed 10 --output new.json
+    python -m benchmarks.replay deliveries.jsonl.gz --speed 0 --baseline old.json
+
+by default the bot talks to a local fake github seeded from the payloads,
+so only the timing and the control flow are exercised. with `--github`
+it reads from the real api (GITHUB_USER / GITHUB_PASSWORD) but every
+write is captured instead of sent, which makes the produced comments
+comparable between two builds.
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Text
+
+import github3
+import requests
+from requests.adapters import HTTPAdapter
+
+from .fake_github import COMMENT_KEYS, USER_KEYS, FakeGitHub, _fill
+from .run import percentile
+
+
+COMMENT_ID_PATTERN = re.compile(r'/comments/\d+$')
+
+
+def _sent_json(request):
+    # type: (requests.PreparedRequest) -> Dict
+    body = request.body or b'' # type: Any # only json bodies, as bytes or text
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    return json.loads(body) if body else {}
+
+
+class _CapturingAdapter(HTTPAdapter):
+    """send reads to github, answer writes ourselves"""
+
+    def __init__(self, *args, **kwargs):
+        super(_CapturingAdapter, self).__init__(*args, **kwargs)
+        self._ids = iter(range(1, sys.maxsize))
+        self._lock = threading.Lock()
+
+    def send(self, request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return super(_CapturingAdapter, self).send(request, *args, **kwargs)
+        with self._lock:
+            comment_id = next(self._ids)
+        sent = _sent_json(request)
+        response = requests.Response()
+        response.status_code = 201 if request.method == 'POST' else 200
+        response.headers['Content-Type'] = 'application/json'
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf-8'
+        # the only writes we do are creating and editing comments
+        url = re.sub(
+            r'/issues/\d+/comments$', '/issues/comments/{}'.format(comment_id),
+            request.url)
+        response._content = json.dumps(_fill(
+            COMMENT_KEYS, url, url=url, id=comment_id, body=sent.get('body', u''),
+            user=_fill(USER_KEYS, request.url, login=u'replay'))).encode('utf-8')
+        return response
+
+
+class _WriteLog(object):
+    """every non-GET request the bot made, as a response hook"""
+
+    def __init__(self):
+        self.writes = [] # type: List[Dict[Text, Any]]
+        self._lock = threading.Lock()
+
+    def __call__(self, response, *args, **kwargs):
+        request = response.request
+        if request.method in ('GET', 'HEAD'):
+            return
+        path = requests.utils.urlparse(request.url).path
+        with self._lock:
+            self.writes.append({
+                'method': request.method,
+                # comment ids are never the same twice
+                'path': COMMENT_ID_PATTERN.sub('/comments/{id}', path),
+                'body': _sent_json(request).get('body')
+            })
+
+    def take(self):
+        # type: () -> List[Dict[Text, Any]]
+        with self._lock:
+            writes, self.writes = self.writes, []
+        return writes
+
+
+def load_housekeeper(github):
+    # type: (bool) -> Any
+    """import the package without letting the web app touch anything real"""
+    if not github:
+        os.environ['GITHUB_USER'] = u'housekeeper-bot'
+        os.environ['GITHUB_PASSWORD'] = u'replay'
+    os.environ.update({'QUEUE_WORKERS': '0', 'CHECK_CACHE_PATH': '', 'RECORD_PATH': ''})
+    import housekeeper.reaction
+    import housekeeper.recorder
+    return housekeeper
+
+
+def seed(fake, event, payload):
+    # type: (FakeGitHub, Text, Dict) -> None
+    """make up what the payload refers to; the files stay unknown, i.e. empty"""
+    from housekeeper.utils import extract_info_from_url
+    if event == 'pull_request':
+        pull = payload['pull_request']
+        info = extract_info_from_url(pull['url'])
+        key = (info['owner'], info['repo'], info['number'])
+        if key not in fake.pulls:
+            fake.add_pull_request(
+                info['owner'], info['repo'], info['number'],
+                pull['user']['login'], {},
+                author_association=pull.get('author_association', u'NONE'))
+        for sha in (payload.get('before'), payload.get('after')):
+            if sha and sha not in fake.commits:
+                fake.add_commit({}, sha=sha)
+    elif 'issue' in payload:
+        issue = payload['issue']
+        info = extract_info_from_url(issue['url'])
+        key = (info['owner'], info['repo'], info['number'])
+        if key not in fake.issues:
+            fake.add_issue(
+                info['owner'], info['repo'], info['number'],
+                issue.get('user', {}).get('login', u'someone'),
+                issue.get('body') or u'')
+
+
+def replay(
+    records, # type: List[Dict[Text, Any]]
+    reaction, # type: Any
+    write_log, # type: _WriteLog
+    speed, # type: float
+    secret=None, # type: Optional[Text]
+    fake=None # type: Optional[FakeGitHub]
+    ):
+    # type: (...) -> List[Dict[Text, Any]]
+    from housekeeper.utils import verify_signature
+    results = [] # type: List[Dict[Text, Any]]
+    first_received = records[0]['received_at'] if records else 0.0
+    started = time.time()
+    for record in records:
+        headers = record['headers']
+        delivery = headers.get('X-GitHub-Delivery')
+        event = headers.get('X-GitHub-Event')
+        if secret and not verify_signature(
+                secret, record['body'], headers.get('X-Hub-Signature')):
+            results.append({'delivery': delivery, 'event': event, 'status': 'bad signature'})
+            continue
+        payload = json.loads(record['body'].decode('utf-8'))
+        if fake is not None:
+            seed(fake, event, payload)
+
+        if speed > 0:
+            # keep the original gaps between deliveries, `speed` times faster
+            due = started + (record['received_at'] - first_received) / speed
+            if due > time.time():
+                time.sleep(due - time.time())
+
+        begin = time.time()
+        res = reaction.run(event, payload)
+        results.append({
+            'delivery': delivery,
+            'event': event,
+            'action': payload.get('action'),
+            'status': res['status'],
+            'latency': time.time() - begin,
+            'writes': write_log.take()
+        })
+    return results
+
+
+def divergences(results, baseline):
+    # type: (List[Dict[Text, Any]], List[Dict[Text, Any]]) -> List[Text]
+    """deliveries whose writes differ from the baseline run"""
+    before = dict((x['delivery'], x) for x in baseline)
+    found = [] # type: List[Text]
+    for result in results:
+        old = before.get(result['delivery'])
+        if old is None:
+            continue
+        if old.get('status') != result.get('status'):
+            found.append(u'{}: status {} -> {}'.format(
+                result['delivery'], old.get('status'), result.get('status')))
+        elif old.get('writes') != result.get('writes'):
+            found.append(u'{}: {} writes differ'.format(
+                result['delivery'], result['event']))
+    return found
+
+
+def main(argv=None):
+    # type: (Optional[List[Text]]) -> int
+    parser = argparse.ArgumentParser(description='replay recorded webhook deliveries')
+    parser.add_argument('archive', help='a RECORD_PATH archive')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='1 keeps the original timing, 0 replays as fast as possible')
+    parser.add_argument('--secret', default=os.environ.get('GITHUB_SECRET'),
+                        help='verify every signature with this secret first')
+    parser.add_argument('--github', action='store_true',
+                        help='read from the real api, capture the writes')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='latency of the fake github')
+    parser.add_argument('--posts-location', default=os.environ.get(
+        'POSTS_LOCATION', u'content/post/'))
+    parser.add_argument('--output', help='save per delivery results as json')
+    parser.add_argument('--baseline', help='compare the writes with a saved run')
+    args = parser.parse_args(argv)
+
+    housekeeper = load_housekeeper(args.github)
+    logger = logging.getLogger('housekeeper.replay')
+    records = list(housekeeper.recorder.read_archive(args.archive))
+    write_log = _WriteLog()
+
+    fake = None
+    if args.github:
+        user = os.environ['GITHUB_USER']
+        client = github3.login(user, password=os.environ['GITHUB_PASSWORD'])
+        adapter = _CapturingAdapter()
+        client.session.mount('https://', adapter)
+        client.session.mount('http://', adapter)
+    else:
+        user = os.environ['GITHUB_USER']
+        fake = FakeGitHub(latency=args.latency).start()
+        client = housekeeper.clients.ClientRegistry(api_url=fake.url).get(user, u'replay')
+    client.session.hooks['response'].append(write_log)
+
+    try:
+        reaction = housekeeper.reaction.Reaction(user, u'', logger, args.posts_location, client=client)
+        results = replay(records, reaction, write_log, args.speed, args.secret, fake)
+    finally:
+        if fake is not None:
+            fake.stop()
+
+    latencies = [x['latency'] for x in results if 'latency' in x]
+    print(u'{} deliveries, {} errors, {} bad signatures'.format(
+        len(results),
+        sum(1 for x in results if x['status'] == 'error'),
+        sum(1 for x in results if x['status'] == 'bad signature')))
+    print(u'p50 {:.4f}s  p95 {:.4f}s  p99 {:.4f}s  max {:.4f}s'.format(
+        percentile(latencies, 50), percentile(latencies, 95),
+        percentile(latencies, 99), max(latencies) if latencies else 0.0))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = divergences(results, json.load(f))
+        for line in found:
+            print(u'DIVERGENCE ' + line)
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
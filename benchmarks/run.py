@@ -0,0 +1,195 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+drive the webhook with synthetic deliveries against a fake github
+
+    python -m benchmarks.run --scenario small --count 50 --latency 0.05
+    python -m benchmarks.run --output new.json --baseline old.json
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Text
+
+from .corpus import SCENARIOS
+from .fake_github import FakeGitHub
+
+
+BOT = u'housekeeper-bot'
+
+# lower is better for all of them, except throughput
+COMPARED = ('p50', 'p95', 'p99', 'api_calls_per_event', 'api_bytes_per_event')
+
+
+def percentile(values, pct):
+    # type: (List[float], float) -> float
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[idx]
+
+
+def load_app(fake, mode, workdir, backend=u'rest'):
+    # type: (FakeGitHub, Text, Text, Text) -> Any
+    """create the flask app, configured through env vars like in production"""
+    os.environ.update({
+        'GITHUB_USER': BOT,
+        'GITHUB_PASSWORD': 'bench',
+        'GITHUB_SECRET': '',
+        'GITHUB_API_URL': fake.url,
+        'GITHUB_BACKEND': backend,
+        'GIT_MIRROR_DIR': os.path.join(workdir, 'mirrors'),
+        'GIT_MIRROR_URL': os.path.join(workdir, 'remotes', '{owner}', '{repo}.git'),
+        'QUEUE_WORKERS': '0' if mode == 'inline' else '2',
+        'QUEUE_PATH': os.path.join(workdir, 'jobs.sqlite3'),
+        'QUEUE_MAX_DEPTH': '100000',
+        'DEAD_LETTER_PATH': os.path.join(workdir, 'dead_letters.sqlite3'),
+        'DEDUP_PATH': '',
+        'CHECK_CACHE_PATH': os.path.join(workdir, 'check_cache.sqlite3'),
+        'LOG_DIR': os.path.join(workdir, 'housekeeper.log'),
+    })
+    from housekeeper.index import create_app
+    return create_app()
+
+
+def run_scenario(
+    app, # type: Any
+    fake, # type: FakeGitHub
+    name, # type: Text
+    count # type: int
+    ):
+    # type: (...) -> Dict[Text, Any]
+    client = app.test_client()
+    job_queue = app.extensions['housekeeper'].job_queue
+    corpus = SCENARIOS[name](fake, count)
+    fake.reset_counters()
+
+    latencies = [] # type: List[float]
+    failures = 0
+    started = time.time()
+    for event, payload in corpus:
+        begin = time.time()
+        res = client.post(
+            '/webhook',
+            data=json.dumps(payload),
+            content_type='application/json',
+            headers={
+                'X-GitHub-Event': event,
+                'X-GitHub-Delivery': str(uuid.uuid4())
+            })
+        latencies.append(time.time() - begin)
+        if res.status_code >= 400:
+            failures += 1
+    if job_queue is not None:
+        # throughput counts the real work, not only the enqueueing
+        while job_queue.depth():
+            time.sleep(0.01)
+    elapsed = time.time() - started
+
+    calls = sum(fake.calls.values())
+    sent = sum(fake.bytes_sent.values())
+    return {
+        'scenario': name,
+        'events': len(corpus),
+        'failures': failures,
+        'seconds': elapsed,
+        'throughput': len(corpus) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'api_calls_per_event': float(calls) / len(corpus),
+        'api_bytes_per_event': float(sent) / len(corpus),
+        'api_calls': dict(
+            (u'{} {}'.format(*key), value) for key, value in fake.calls.items())
+    }
+
+
+def compare(
+    results, # type: Dict[Text, Dict[Text, Any]]
+    baseline, # type: Dict[Text, Dict[Text, Any]]
+    tolerance # type: float
+    ):
+    # type: (...) -> List[Text]
+    """human readable regressions, empty if none"""
+    regressions = [] # type: List[Text]
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for key in COMPARED:
+            if old[key] and result[key] > old[key] * (1 + tolerance):
+                regressions.append(u'{}: {} {:.4f} -> {:.4f}'.format(
+                    name, key, old[key], result[key]))
+        if result['throughput'] < old['throughput'] * (1 - tolerance):
+            regressions.append(u'{}: throughput {:.2f} -> {:.2f}'.format(
+                name, old['throughput'], result['throughput']))
+    return regressions
+
+
+def report(result):
+    # type: (Dict[Text, Any]) -> None
+    print(u'{scenario:<12} {events:>5} events {throughput:>8.2f}/s  '
+          u'p50 {p50:.4f}s  p95 {p95:.4f}s  p99 {p99:.4f}s  '
+          u'{api_calls_per_event:.1f} calls/event  '
+          u'{api_bytes_per_event:.0f} bytes/event  '
+          u'{failures} failures'.format(**result))
+
+
+def main(argv=None):
+    # type: (Optional[List[Text]]) -> int
+    parser = argparse.ArgumentParser(description='benchmark the housekeeper webhook')
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                        help='may be repeated, all scenarios by default')
+    parser.add_argument('--count', type=int, default=20,
+                        help='deliveries per scenario')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the fake github waits before each response')
+    parser.add_argument('--mode', choices=['inline', 'queued'], default='inline')
+    parser.add_argument('--backend', choices=['rest', 'graphql', 'git'], default='rest',
+                        help='how pull request files and articles are fetched')
+    parser.add_argument('--output', help='save the results as json')
+    parser.add_argument('--baseline', help='compare against saved results')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown before failing')
+    args = parser.parse_args(argv)
+
+    # one server and one app for the whole run, the app reads its env only once
+    workdir = tempfile.mkdtemp(prefix='housekeeper-bench-')
+    fake = FakeGitHub(
+        latency=args.latency,
+        git_root=os.path.join(workdir, 'remotes') if args.backend == 'git' else None).start()
+    results = {} # type: Dict[Text, Dict[Text, Any]]
+    try:
+        app = load_app(fake, args.mode, workdir, args.backend)
+        for name in args.scenario or list(SCENARIOS):
+            results[name] = run_scenario(app, fake, name, args.count)
+            results[name].update({
+                'mode': args.mode, 'backend': args.backend, 'latency': args.latency})
+            report(results[name])
+    finally:
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(u'REGRESSION ' + line)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
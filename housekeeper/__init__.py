@@ -2,4 +2,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
-from .index import app
+
+def __getattr__(name):
+    # `housekeeper.app` is the default app of `housekeeper.index`, created from
+    # the env vars on first access, tools like `python -m housekeeper.audit`
+    # should not even import flask for it
+    if name == 'app':
+        from .index import app
+        return app
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
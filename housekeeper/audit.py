@@ -0,0 +1,227 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+run the article checks over the posts of a local checkout, no github needed
+
+    python -m housekeeper.audit path/to/cosx.org > findings.jsonl
+    python -m housekeeper.audit path/to/cosx.org --format markdown --changed-since origin/master
+    python -m housekeeper.audit path/to/notes --repos-config repos.yml --repo someone/notes
+
+every post is checked in a process pool, results come out in file order
+as soon as they are ready.
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import io
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Text
+
+from . import notebook, rules
+from .repo_config import RepoConfigStore, default_settings, rule_options
+
+
+__all__ = ['audit_file', 'audit', 'list_posts', 'changed_posts']
+
+
+def _posts_dir(root, posts_location):
+    # type: (Text, Text) -> Text
+    return os.path.join(root, *posts_location.strip('/').split('/'))
+
+
+def list_posts(
+    root, # type: Text
+    posts_location # type: Text
+    ):
+    # type: (...) -> List[Text]
+    """every file under the posts location, as repo relative `/` paths"""
+    names = [] # type: List[Text]
+    for dirpath, dirnames, filenames in os.walk(_posts_dir(root, posts_location)):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            relative = os.path.relpath(os.path.join(dirpath, filename), root)
+            names.append(relative.replace(os.sep, '/'))
+    return names
+
+
+def changed_posts(
+    root, # type: Text
+    posts_location, # type: Text
+    rev # type: Text
+    ):
+    # type: (...) -> List[Text]
+    """posts added or modified since `rev`, uncommitted and untracked ones too"""
+    def git(*args):
+        return subprocess.check_output(
+            ('git', '-C', root) + args).decode('utf-8').splitlines()
+    names = set(git(
+        'diff', '--name-only', '--diff-filter=ACMR', rev, '--', posts_location))
+    names.update(git(
+        'ls-files', '--others', '--exclude-standard', '--', posts_location))
+    # still there? a later commit may have removed it again
+    return sorted(
+        x for x in names if os.path.isfile(os.path.join(root, *x.split('/'))))
+
+
+def audit_file(
+    root, # type: Text
+    name, # type: Text
+    posts_location, # type: Text
+    max_bytes, # type: int
+    max_front_matter_bytes=rules.MAX_FRONT_MATTER_BYTES, # type: int
+    options=rules.DEFAULT_OPTIONS # type: rules.Options
+    ):
+    # type: (...) -> Dict[Text, Any]
+    """the findings of a single post, like in the pull request comment"""
+    findings = rules.check_path(name, posts_location, options) or []
+    path = os.path.join(root, *name.split('/'))
+    kind = rules.article_kind(name)
+    if kind == u'notebook':
+        # read in chunks, the outputs are skipped on the way
+        with io.open(path, 'rb') as f:
+            findings += notebook.check_notebook(
+                iter(lambda: f.read(64 * 1024), b''), max_bytes,
+                max_front_matter_bytes, options)
+    elif os.path.getsize(path) > max_bytes:
+        findings.append(rules.file_too_large(max_bytes))
+    else:
+        with io.open(path, 'rb') as f:
+            raw = f.read()
+        try:
+            text = raw.decode('utf-8')
+        except UnicodeDecodeError as e:
+            return {'file': name, 'findings': _dump(findings), 'error': u'{}'.format(e)}
+        content_findings, _ = rules.check_text(
+            text, max_front_matter_bytes, options, rmarkdown=kind == u'rmarkdown')
+        findings += content_findings
+    return {'file': name, 'findings': _dump(findings)}
+
+
+def _dump(findings):
+    # type: (Iterable[rules.Finding]) -> List[Dict[Text, Any]]
+    return [
+        {
+            'rule': x.rule,
+            'line': x.line,
+            'cell': x.cell,
+            'severity': x.severity,
+            'message': x.message.format(line=x.line) if x.line is not None else x.message
+        }
+        for x in findings
+    ]
+
+
+def _audit_one(args):
+    # a top level function, process pools pickle it by name
+    return audit_file(*args)
+
+
+def audit(
+    root, # type: Text
+    names, # type: List[Text]
+    posts_location, # type: Text
+    max_bytes, # type: int
+    jobs=None, # type: Optional[int]
+    max_front_matter_bytes=rules.MAX_FRONT_MATTER_BYTES, # type: int
+    options=rules.DEFAULT_OPTIONS # type: rules.Options
+    ):
+    # type: (...) -> Iterator[Dict[Text, Any]]
+    """audit results of `names`, in the same order"""
+    jobs = jobs or os.cpu_count() or 1
+    work = [
+        (root, name, posts_location, max_bytes, max_front_matter_bytes, options)
+        for name in names]
+    if jobs == 1:
+        for item in work:
+            yield _audit_one(item)
+        return
+    # thousands of small posts: hand them out in batches
+    chunksize = max(1, min(64, len(work) // (jobs * 4)))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for result in executor.map(_audit_one, work, chunksize=chunksize):
+            yield result
+
+
+def _write_jsonl(results, out):
+    # type: (Iterable[Dict[Text, Any]], IO[Text]) -> Dict[Text, int]
+    counts = {'files': 0, 'with_findings': 0}
+    for result in results:
+        counts['files'] += 1
+        counts['with_findings'] += bool(result['findings'] or result.get('error'))
+        out.write(json.dumps(result, ensure_ascii=False) + u'\n')
+    return counts
+
+
+def _write_markdown(results, out):
+    # type: (Iterable[Dict[Text, Any]], IO[Text]) -> Dict[Text, int]
+    counts = {'files': 0, 'with_findings': 0}
+    out.write(u'# 文章检查\n')
+    for result in results:
+        counts['files'] += 1
+        if not result['findings'] and not result.get('error'):
+            continue
+        counts['with_findings'] += 1
+        name = result['file']
+        out.write(u'\n## 文件 `{}` 问题\n'.format(name))
+        if result.get('error'):
+            out.write(u'\n无法读取：{}\n'.format(result['error']))
+        findings = [rules.Finding(x['rule'], None, x['severity'], x['message'], x.get('cell'))
+                    for x in result['findings']]
+        for section, text in rules.render_findings(name, findings).items():
+            out.write(u'\n### {}\n\n{}\n'.format(section, text))
+    out.write(u'\n共检查 {files} 篇，其中 {with_findings} 篇有问题。\n'.format(**counts))
+    return counts
+
+
+def main(argv=None):
+    # type: (Optional[List[Text]]) -> int
+    parser = argparse.ArgumentParser(
+        description='check every post of a local checkout')
+    parser.add_argument('root', nargs='?', default=u'.',
+                        help='the checkout of the website repo')
+    parser.add_argument('--posts-location', default=os.environ.get(
+        'POSTS_LOCATION', u'content/post/'))
+    parser.add_argument('--format', choices=('jsonl', 'markdown'), default='jsonl')
+    parser.add_argument('--output', help='write here instead of stdout')
+    parser.add_argument('--changed-since', metavar='REV',
+                        help='only posts changed since this git revision')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='worker processes, all cpu cores by default')
+    parser.add_argument('--max-article-bytes', type=int, default=int(
+        os.environ.get('ARTICLE_MAX_BYTES', 1000000)))
+    parser.add_argument('--max-front-matter-bytes', type=int, default=int(
+        os.environ.get('FRONT_MATTER_MAX_BYTES', rules.MAX_FRONT_MATTER_BYTES)))
+    parser.add_argument('--repos-config', default=os.environ.get('REPOS_CONFIG_PATH'),
+                        help='the per repository settings, like the web app')
+    parser.add_argument('--repo', metavar='OWNER/REPO',
+                        help='use the settings of this repository')
+    args = parser.parse_args(argv)
+
+    # the repo file (REPOS_CONFIG_FILE) needs github, only the local one counts here
+    settings = RepoConfigStore(
+        default_settings(args.posts_location), path=args.repos_config).get(args.repo)
+    posts_location = settings.posts_location
+
+    if args.changed_since:
+        names = changed_posts(args.root, posts_location, args.changed_since)
+    else:
+        names = list_posts(args.root, posts_location)
+
+    results = audit(
+        args.root, names, posts_location, args.max_article_bytes, args.jobs,
+        args.max_front_matter_bytes, rule_options(settings))
+    write = _write_markdown if args.format == 'markdown' else _write_jsonl
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as out:
+            counts = write(results, out)
+    else:
+        counts = write(results, sys.stdout)
+    sys.stderr.write(u'{files} posts checked, {with_findings} with findings\n'.format(**counts))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
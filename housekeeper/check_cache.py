@@ -0,0 +1,144 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import time
+from typing import Dict, Optional, Text
+
+from .storage import SqliteStore
+
+
+__all__ = ['ArticleCheckCache']
+
+
+class ArticleCheckCache(SqliteStore):
+    """content-addressed cache of article check results
+
+    the key is the git blob sha of the article plus the checker version,
+    so an unchanged post never needs to be downloaded or parsed again.
+    least recently used results are evicted once `max_bytes` is reached,
+    the total size is kept in a row of its own so that a put does not
+    have to add up the whole table.
+    """
+
+    def __init__(self,
+        path, # type: Text
+        max_bytes=50 * 1024 * 1024 # type: int
+        ):
+        # type: (...) -> None
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        super(ArticleCheckCache, self).__init__(path)
+
+    def _init_schema(self):
+        # type: () -> None
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS check_results ('
+            'sha TEXT NOT NULL, '
+            'version TEXT NOT NULL, '
+            'warning TEXT NOT NULL, '
+            'size INTEGER NOT NULL, '
+            'used_at REAL NOT NULL, '
+            'PRIMARY KEY (sha, version))'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS check_results_used_at '
+            'ON check_results (used_at)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS check_results_size ('
+            'id INTEGER PRIMARY KEY CHECK (id = 0), '
+            'total INTEGER NOT NULL)'
+        )
+        # once, for a file written before the total was kept
+        self._conn.execute(
+            'INSERT OR IGNORE INTO check_results_size (id, total) '
+            'SELECT 0, COALESCE(SUM(size), 0) FROM check_results')
+
+    def get(self,
+        sha, # type: Text
+        version # type: Text
+        ):
+        # type: (...) -> Optional[Text]
+        """the cached warning text ('' means no warning), None if unknown"""
+        with self._lock:
+            cur = self._conn.execute(
+                'SELECT warning FROM check_results WHERE sha = ? AND version = ?',
+                (sha, version))
+            row = cur.fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                'UPDATE check_results SET used_at = ? '
+                'WHERE sha = ? AND version = ?',
+                (time.time(), sha, version))
+        return row[0]
+
+    def put(self,
+        sha, # type: Text
+        version, # type: Text
+        warning # type: Text
+        ):
+        # type: (...) -> None
+        """remember the warning text of this blob"""
+        size = len(sha) + len(warning.encode('utf-8'))
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                cur.execute(
+                    'SELECT size FROM check_results WHERE sha = ? AND version = ?',
+                    (sha, version))
+                row = cur.fetchone()
+                replaced = row[0] if row is not None else 0
+                cur.execute(
+                    'INSERT OR REPLACE INTO check_results '
+                    '(sha, version, warning, size, used_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (sha, version, warning, size, time.time()))
+                cur.execute(
+                    'UPDATE check_results_size SET total = total + ? WHERE id = 0',
+                    (size - replaced,))
+                self._evict(cur)
+                cur.execute('COMMIT')
+            except:
+                cur.execute('ROLLBACK')
+                raise
+
+    def _evict(self, cur):
+        # type: (...) -> None
+        cur.execute('SELECT total FROM check_results_size WHERE id = 0')
+        total = cur.fetchone()[0]
+        # drop the least recently used rows until we fit again
+        while total > self.max_bytes:
+            cur.execute(
+                'SELECT sha, version, size FROM check_results '
+                'ORDER BY used_at LIMIT 100')
+            rows = cur.fetchall()
+            if not rows:
+                # nothing left, whatever the total said
+                cur.execute('UPDATE check_results_size SET total = 0 WHERE id = 0')
+                break
+            victims = []
+            freed = 0
+            for sha, version, size in rows:
+                if total - freed <= self.max_bytes:
+                    break
+                victims.append((sha, version))
+                freed += size
+            cur.executemany(
+                'DELETE FROM check_results WHERE sha = ? AND version = ?', victims)
+            total -= freed
+            cur.execute(
+                'UPDATE check_results_size SET total = total - ? WHERE id = 0', (freed,))
+
+    def stats(self):
+        # type: () -> Dict[Text, float]
+        """hit/miss counters of this process"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / total if total else 0.0
+        }
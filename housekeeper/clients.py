@@ -0,0 +1,157 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import threading
+import time
+from typing import Dict, Optional, Text, Tuple
+
+import github3
+
+from .ratelimit import ConditionalAdapter, ConditionalCache, RateLimitBudget
+from .resilience import CircuitBreaker
+
+
+__all__ = ['ClientRegistry', 'default_registry']
+
+
+class ClientRegistry(object):
+    """process-wide pool of authenticated github clients
+
+    one client per credential set, its requests session (and the keep-alive
+    connections inside) is shared by every delivery and every worker thread.
+    the rate limit budget and the etag cache belong to the credentials,
+    they outlive a recreated client. so does the circuit breaker, which
+    is about github itself and shared by all credentials.
+    a forked worker creates its own clients, it must not share sockets.
+    """
+
+    def __init__(self,
+        pool_size=10, # type: int
+        max_age=3600.0, # type: float
+        api_url=None, # type: Optional[Text]
+        rate_limit_reserve=500, # type: int
+        etag_cache_max_bytes=10 * 1024 * 1024, # type: int
+        connect_timeout=4.0, # type: float
+        read_timeout=10.0, # type: float
+        retries=2, # type: int
+        retry_backoff=0.5, # type: float
+        breaker=None # type: Optional[CircuitBreaker]
+        ):
+        # type: (...) -> None
+        self.pool_size = pool_size
+        self.max_age = max_age # seconds, <= 0 to keep clients forever
+        self.api_url = api_url
+        self.rate_limit_reserve = rate_limit_reserve
+        self.etag_cache_max_bytes = etag_cache_max_bytes # 0 to disable
+        # per call, a delivery deadline may cut them shorter
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._clients = {} # type: Dict[Tuple[Text, Text], Tuple[float, github3.github.GitHub]]
+        self._budgets = {} # type: Dict[Tuple[Text, Text], RateLimitBudget]
+        self._caches = {} # type: Dict[Tuple[Text, Text], Optional[ConditionalCache]]
+        self._pid = os.getpid()
+
+    def get(self,
+        user, # type: Text
+        password # type: Text
+        ):
+        # type: (...) -> github3.github.GitHub
+        """return the shared client for these credentials, create if needed"""
+        key = (user, password)
+        now = time.time()
+        with self._lock:
+            if self._pid != os.getpid():
+                # the parent's connections, never close them from here
+                self._clients = {}
+                self._pid = os.getpid()
+            created_at, client = self._clients.get(key, (0.0, None))
+            if client is not None and (
+                    self.max_age <= 0 or now - created_at < self.max_age):
+                self.hits += 1
+                return client
+            self.misses += 1
+            # an expired client may still be in use by another thread,
+            # so we just drop our reference and let it be collected
+            client = self._create(key)
+            self._clients[key] = (now, client)
+            return client
+
+    def budget(self,
+        user, # type: Text
+        password # type: Text
+        ):
+        # type: (...) -> RateLimitBudget
+        """the rate limit budget of these credentials"""
+        with self._lock:
+            return self._budget(user, password)
+
+    def _budget(self, user, password):
+        key = (user, password)
+        if key not in self._budgets:
+            self._budgets[key] = RateLimitBudget(reserve=self.rate_limit_reserve)
+            self._caches[key] = (
+                ConditionalCache(max_bytes=self.etag_cache_max_bytes)
+                if self.etag_cache_max_bytes > 0 else None)
+        return self._budgets[key]
+
+    def _create(self,
+        key # type: Tuple[Text, Text]
+        ):
+        # type: (...) -> github3.github.GitHub
+        user, password = key
+        client = github3.login(user, password) # type: github3.github.GitHub
+        if self.api_url:
+            client.session.base_url = self.api_url.rstrip('/')
+        client.session.default_connect_timeout = self.connect_timeout
+        client.session.default_read_timeout = self.read_timeout
+        # one pool per host is enough, but let every worker own a connection
+        adapter = ConditionalAdapter(
+            self._budget(user, password), self._caches[key],
+            retries=self.retries, retry_backoff=self.retry_backoff,
+            breaker=self.breaker,
+            pool_connections=1, pool_maxsize=self.pool_size, pool_block=False)
+        client.session.mount('https://', adapter)
+        client.session.mount('http://', adapter)
+        return client
+
+    def stats(self):
+        # type: () -> Dict[Text, int]
+        """hit/miss counters, to confirm that clients are reused"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'clients': len(self._clients)
+            }
+
+    def etag_stats(self):
+        # type: () -> Dict[Text, int]
+        """conditional request counters over all credentials"""
+        with self._lock:
+            caches = [x for x in self._caches.values() if x is not None]
+        total = {'hits': 0, 'misses': 0} # type: Dict[Text, int]
+        for cache in caches:
+            stats = cache.stats()
+            total['hits'] += stats['hits']
+            total['misses'] += stats['misses']
+        return total
+
+    def clear(self):
+        # type: () -> None
+        """close and forget every client"""
+        with self._lock:
+            for _, client in self._clients.values():
+                client.session.close()
+            self._clients = {}
+
+
+default_registry = ClientRegistry()
@@ -0,0 +1,162 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+what people can ask the bot for, by mentioning it in an issue or a pr
+
+    @housekeeper-bot recheck
+    @housekeeper-bot lint content/post/2018-01-01-foo.md
+    @housekeeper-bot help
+
+every alias of the bot and every registered command are matched by one
+regex, compiled once, in a single pass over the comment body. the
+handlers themselves live next to the reactions they reuse.
+"""
+from __future__ import unicode_literals, print_function
+from collections import namedtuple, OrderedDict
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Text, Tuple
+
+from .ratelimit import LOW
+
+
+__all__ = [
+    'Command', 'Handler', 'HANDLERS', 'command', 'MentionMatcher',
+    'matcher_for', 'IssueRateLimiter', 'default_limiter'
+]
+
+
+# a bare mention, without a known command after it
+MENTION = u''
+
+# no comment makes us run more than this many commands
+MAX_COMMANDS = 3
+
+Command = namedtuple('Command', ['name', 'args'])
+# `priority` is the rate limit priority, `run(reaction, event, payload,
+# comments, command)` returns the reply, None for none
+Handler = namedtuple('Handler', ['name', 'usage', 'description', 'priority', 'run'])
+
+HANDLERS = OrderedDict() # type: Dict[Text, Handler]
+
+
+def command(
+    name, # type: Text
+    usage=u'', # type: Text
+    description=u'', # type: Text
+    priority=LOW # type: Text
+    ):
+    # type: (...) -> Callable
+    """register a handler for `@bot <name> ...`, `MENTION` for a bare mention"""
+    def decorator(run):
+        HANDLERS[name] = Handler(name, usage or name, description, priority, run)
+        _MATCHERS.clear()
+        return run
+    return decorator
+
+
+class MentionMatcher(object):
+    """find the mentions of any alias, and the command following each"""
+
+    def __init__(self,
+        aliases, # type: Iterable[Text]
+        commands # type: Iterable[Text]
+        ):
+        # type: (...) -> None
+        # longest first, so that `bot-two` is not taken for `bot`
+        def alternatives(names):
+            return u'|'.join(
+                re.escape(x) for x in sorted(set(names), key=len, reverse=True) if x)
+        command_names = alternatives(commands)
+        self.pattern = re.compile(
+            r'(?<![\w@-])@(?:{})(?![\w-])'.format(alternatives(aliases)) +
+            (r'(?:[ \t]+(?P<command>{})(?![\w-])(?P<args>[^\n]*))?'.format(command_names)
+             if command_names else r'(?P<command>)(?P<args>)'),
+            re.IGNORECASE)
+
+    def parse(self,
+        body # type: Optional[Text]
+        ):
+        # type: (...) -> List[Command]
+        """commands in order, duplicates once, mentions in quotes ignored"""
+        body = body or u''
+        found = [] # type: List[Command]
+        for matched in self.pattern.finditer(body):
+            line_start = body.rfind(u'\n', 0, matched.start()) + 1
+            if body[line_start:matched.start()].lstrip().startswith(u'>'):
+                # someone quoting an earlier mention, not talking to us
+                continue
+            found_command = Command(
+                (matched.group('command') or MENTION).lower(),
+                tuple((matched.group('args') or u'').split()))
+            if found_command not in found:
+                found.append(found_command)
+        return found
+
+
+_MATCHERS = {} # type: Dict[Tuple[Text, ...], MentionMatcher]
+
+
+def matcher_for(
+    aliases # type: Iterable[Text]
+    ):
+    # type: (...) -> MentionMatcher
+    """the matcher of these aliases and the registered commands, built once"""
+    key = tuple(sorted(set(x.lower() for x in aliases)))
+    matcher = _MATCHERS.get(key)
+    if matcher is None:
+        matcher = _MATCHERS[key] = MentionMatcher(key, HANDLERS)
+    return matcher
+
+
+class IssueRateLimiter(object):
+    """a token bucket per issue, so that a comment storm costs little
+
+    `burst` commands right away, then one more every `interval` seconds;
+    an interval of 0 never limits. only this process is counted.
+    """
+
+    def __init__(self,
+        burst=5, # type: int
+        interval=60.0, # type: float
+        max_issues=10000 # type: int
+        ):
+        # type: (...) -> None
+        self.burst = burst
+        self.interval = interval
+        self.max_issues = max_issues
+        self.limited = 0
+        self._lock = threading.Lock()
+        # key -> (tokens, last refill), least recently used first
+        self._buckets = OrderedDict() # type: OrderedDict
+
+    def allow(self,
+        key, # type: Tuple
+        now=None # type: Optional[float]
+        ):
+        # type: (...) -> bool
+        """take a token of the issue, False if there is none left"""
+        if self.interval <= 0:
+            return True
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - last) / self.interval)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.limited += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_issues:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def __len__(self):
+        # type: () -> int
+        with self._lock:
+            return len(self._buckets)
+
+
+default_limiter = IssueRateLimiter()
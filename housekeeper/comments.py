@@ -0,0 +1,304 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+from collections import OrderedDict
+import logging
+import re
+import threading
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+import github3
+
+
+__all__ = ['CommentBuffer', 'CommentCoalescer', 'default_coalescer']
+
+
+# (owner, repo, number)
+IssueKey = Tuple[Text, Text, int]
+
+SECTION_PATTERN = re.compile(
+    r'<!-- housekeeper:section (?P<id>[\w-]+) -->\n'
+    r'(?P<text>.*?)\n'
+    r'<!-- housekeeper:end (?P=id) -->',
+    re.DOTALL)
+
+REPLY_SEPARATOR = u'\n\n---\n\n'
+
+
+def split_sections(
+    body # type: Text
+    ):
+    # type: (...) -> Dict[Text, Text]
+    """the named sections of one of our comments, in order"""
+    return OrderedDict(
+        (matched.group('id'), matched.group('text'))
+        for matched in SECTION_PATTERN.finditer(body))
+
+
+def join_sections(
+    sections # type: Dict[Text, Text]
+    ):
+    # type: (...) -> Text
+    return u'\n\n'.join(
+        u'<!-- housekeeper:section {0} -->\n{1}\n<!-- housekeeper:end {0} -->'.format(
+            section_id, text)
+        for section_id, text in sections.items())
+
+
+class CommentBuffer(object):
+    """what the reactions of an event want to say, written at once
+
+    sections go to the single comment the bot keeps on every issue,
+    which is edited in place; a section replaces its older version.
+    replies are for people who talked to us, they become a new comment
+    (an edit would not notify anyone), one per issue and flush.
+    """
+
+    def __init__(self,
+        client, # type: github3.github.GitHub
+        client_user, # type: Text
+        logger, # type: logging.Logger
+        legacy_sections=None # type: Optional[Dict[Text, Text]]
+        ):
+        # type: (...) -> None
+        self.client = client
+        self.client_user = client_user
+        self.logger = logger
+        # comments written before sections existed: section id -> marker
+        self.legacy_sections = legacy_sections or {} # type: Dict[Text, Text]
+
+        self.sections = OrderedDict() # type: Dict[IssueKey, Dict[Text, Text]]
+        self.replies = OrderedDict() # type: Dict[IssueKey, List[Text]]
+        self._found = {} # type: Dict[IssueKey, Optional[Dict[Text, Any]]]
+
+    def set_section(self,
+        key, # type: IssueKey
+        section_id, # type: Text
+        text # type: Text
+        ):
+        # type: (...) -> None
+        self.sections.setdefault(key, OrderedDict())[section_id] = text
+
+    def reply(self,
+        key, # type: IssueKey
+        text # type: Text
+        ):
+        # type: (...) -> None
+        self.replies.setdefault(key, []).append(text)
+
+    def section(self,
+        key, # type: IssueKey
+        section_id # type: Text
+        ):
+        # type: (...) -> Optional[Text]
+        """a section as it is on github now, None if we never wrote it"""
+        found = self._bot_comment(key)
+        if found is None:
+            return None
+        return found['sections'].get(section_id)
+
+    def merge(self,
+        other, # type: CommentBuffer
+        key # type: IssueKey
+        ):
+        # type: (...) -> None
+        """take over what another buffer has not written yet on an issue"""
+        for section_id, text in other.sections.get(key, {}).items():
+            self.set_section(key, section_id, text)
+        for text in other.replies.get(key, []):
+            self.reply(key, text)
+
+    def keys(self):
+        # type: () -> List[IssueKey]
+        return list(OrderedDict.fromkeys(
+            list(self.sections) + list(self.replies)))
+
+    def flush(self,
+        key=None # type: Optional[IssueKey]
+        ):
+        # type: (...) -> None
+        """write everything (of one issue) to github"""
+        for current in ([key] if key is not None else self.keys()):
+            sections = self.sections.pop(current, None)
+            if sections:
+                self._write_sections(current, sections)
+            replies = self.replies.pop(current, None)
+            if replies:
+                self._create(current, REPLY_SEPARATOR.join(replies))
+
+    ################################################
+    # github
+    ################################################
+
+    def _url(self, *parts):
+        # type: (*Any) -> Text
+        return self.client.session.build_url(*[u'{}'.format(x) for x in parts])
+
+    def _bot_comment(self,
+        key # type: IssueKey
+        ):
+        # type: (...) -> Optional[Dict[Text, Any]]
+        """our latest marked comment on the issue, looked up once"""
+        if key in self._found:
+            return self._found[key]
+        owner, repo, number = key
+        url = self._url('repos', owner, repo, 'issues', number, 'comments')
+        params = {'per_page': 100} # type: Optional[Dict[Text, int]]
+        found = None # type: Optional[Dict[Text, Any]]
+        while url:
+            response = self.client.session.get(url, params=params)
+            response.raise_for_status()
+            for comment in response.json():
+                if (comment.get('user') or {}).get('login') != self.client_user:
+                    continue
+                body = comment.get('body') or u''
+                sections = split_sections(body)
+                if not sections:
+                    sections = OrderedDict(
+                        (section_id, body)
+                        for section_id, marker in self.legacy_sections.items()
+                        if marker in body)
+                if sections:
+                    found = {'id': comment['id'], 'body': body, 'sections': sections}
+            url = response.links.get('next', {}).get('url')
+            params = None # the next link carries them already
+        self._found[key] = found
+        return found
+
+    def _write_sections(self,
+        key, # type: IssueKey
+        sections # type: Dict[Text, Text]
+        ):
+        # type: (...) -> None
+        # the coalescer holds the issue lock while we flush; a lookup
+        # of `section()` happened before that
+        looked_before = key in self._found
+        found = self._bot_comment(key)
+        if found is not None and self._edit(key, found, sections):
+            return
+        if found is not None or looked_before:
+            # ours was deleted, or another worker may have created
+            # one since we found none: look again
+            self._found.pop(key, None)
+            found = self._bot_comment(key)
+            if found is not None and self._edit(key, found, sections):
+                return
+        merged = OrderedDict(sections)
+        body = join_sections(merged)
+        created = self._create(key, body)
+        self._found[key] = {'id': created['id'], 'body': body, 'sections': merged}
+
+    def _edit(self,
+        key, # type: IssueKey
+        found, # type: Dict[Text, Any]
+        sections # type: Dict[Text, Text]
+        ):
+        # type: (...) -> bool
+        """merge the sections into our comment, False if it is gone"""
+        merged = OrderedDict(found['sections'])
+        merged.update(sections)
+        body = join_sections(merged)
+        if body == found['body']:
+            self.logger.info(u'our comment on {}/{}#{} is up to date'.format(*key))
+            return True
+        owner, repo, _ = key
+        response = self.client.session.patch(
+            self._url('repos', owner, repo, 'issues', 'comments', found['id']),
+            json={'body': body})
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        found.update({'body': body, 'sections': merged})
+        self.logger.info(u'we updated our comment on {}/{}#{}'.format(*key))
+        return True
+
+    def _create(self,
+        key, # type: IssueKey
+        body # type: Text
+        ):
+        # type: (...) -> Dict[Text, Any]
+        owner, repo, number = key
+        response = self.client.session.post(
+            self._url('repos', owner, repo, 'issues', number, 'comments'),
+            json={'body': body})
+        response.raise_for_status()
+        self.logger.info(u'we created a comment on {}/{}#{}'.format(*key))
+        return response.json()
+
+
+class CommentCoalescer(object):
+    """flush comment buffers, optionally `debounce` seconds after the last event
+
+    events arriving close together on the same issue (a burst of pushes,
+    a mention storm) then end up in one write. with no debounce the buffer
+    is flushed right away, in the thread of the event, so errors reach it.
+    """
+
+    def __init__(self,
+        debounce=0.0, # type: float
+        logger=None # type: Optional[logging.Logger]
+        ):
+        # type: (...) -> None
+        self.debounce = debounce
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._pending = {} # type: Dict[IssueKey, CommentBuffer]
+        self._timers = {} # type: Dict[IssueKey, threading.Timer]
+        # two workers must not both create "the" comment of an issue
+        self._issue_locks = {} # type: Dict[IssueKey, threading.Lock]
+
+    def _issue_lock(self, key):
+        # type: (IssueKey) -> threading.Lock
+        with self._lock:
+            return self._issue_locks.setdefault(key, threading.Lock())
+
+    def submit(self,
+        buffer # type: CommentBuffer
+        ):
+        # type: (...) -> None
+        if self.debounce <= 0:
+            for key in buffer.keys():
+                with self._issue_lock(key):
+                    buffer.flush(key)
+            return
+        with self._lock:
+            for key in buffer.keys():
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = CommentBuffer(
+                        buffer.client, buffer.client_user, buffer.logger,
+                        buffer.legacy_sections)
+                pending.merge(buffer, key)
+                if key in self._timers:
+                    self._timers[key].cancel()
+                timer = threading.Timer(self.debounce, self._fire, (key,))
+                timer.daemon = True
+                self._timers[key] = timer
+                timer.start()
+
+    def _fire(self, key):
+        # type: (IssueKey) -> None
+        with self._lock:
+            self._timers.pop(key, None)
+            pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        try:
+            with self._issue_lock(key):
+                pending.flush(key)
+        except:
+            self.logger.exception(u'cannot write comments on {}/{}#{}'.format(*key))
+
+    def flush_all(self):
+        # type: () -> None
+        """write everything that is still waiting, e.g. before exiting"""
+        with self._lock:
+            keys = list(self._pending)
+            for key in keys:
+                self._timers.pop(key).cancel()
+        for key in keys:
+            self._fire(key)
+
+
+default_coalescer = CommentCoalescer()
@@ -0,0 +1,284 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+every setting of the web app, read from the environment and checked once
+"""
+from __future__ import unicode_literals, print_function
+import os
+from typing import Any, Callable, Dict, List, Mapping, Optional, Text, Tuple
+
+
+__all__ = ['Config', 'ConfigError']
+
+
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ConfigError(ValueError):
+    """missing or malformed settings, all of them in one message"""
+
+
+def _flag(value):
+    # type: (Text) -> bool
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise ValueError(u'not a boolean: {!r}'.format(value))
+
+
+def _text(value):
+    # type: (Text) -> Text
+    return value
+
+
+def _names(value):
+    # type: (Text) -> Tuple[Text, ...]
+    return tuple(x.strip() for x in value.split(',') if x.strip())
+
+
+# attribute, env var, parser, default; a default of `REQUIRED` must be set
+REQUIRED = object()
+FIELDS = [
+    ('user', 'GITHUB_USER', _text, REQUIRED),
+    ('password', 'GITHUB_PASSWORD', _text, REQUIRED),
+    ('secret_key', 'GITHUB_SECRET', _text, None), # maybe not enabled
+    ('posts_location', 'POSTS_LOCATION', _text, u'content/post/'),
+    # per repository settings, see repo_config
+    ('repos_config_path', 'REPOS_CONFIG_PATH', _text, None),
+    ('repos_config_file', 'REPOS_CONFIG_FILE', _text, None), # e.g. .github/housekeeper.yml
+    ('repos_config_ttl', 'REPOS_CONFIG_TTL', float, 300.0),
+
+    ('queue_path', 'QUEUE_PATH', _text, os.path.join(PARENT_DIR, 'jobs.sqlite3')),
+    ('queue_max_depth', 'QUEUE_MAX_DEPTH', int, 1000),
+    ('queue_workers', 'QUEUE_WORKERS', int, 2), # 0 to run inline
+    ('queue_max_attempts', 'QUEUE_MAX_ATTEMPTS', int, 3),
+    ('queue_retry_delay', 'QUEUE_RETRY_DELAY', float, 30.0),
+    ('queue_lease_seconds', 'QUEUE_LEASE_SECONDS', float, 300.0),
+    ('queue_dead_ttl', 'QUEUE_DEAD_TTL', float, 7 * 86400.0), # 0 to keep them forever
+    # deliveries that failed for good, see dead_letters
+    ('dead_letter_path', 'DEAD_LETTER_PATH', _text,
+     os.path.join(PARENT_DIR, 'dead_letters.sqlite3')), # disabled if empty
+    # seconds a delivery may take, github calls included (0 for no limit)
+    ('delivery_deadline', 'DELIVERY_DEADLINE', float, 60.0),
+
+    ('dedup_ttl', 'DEDUP_TTL', float, 86400.0),
+    ('dedup_max_entries', 'DEDUP_MAX_ENTRIES', int, 10000),
+    ('dedup_path', 'DEDUP_PATH', _text, None), # memory only if empty
+
+    ('article_fetch_workers', 'ARTICLE_FETCH_WORKERS', int, 4),
+    ('article_max_bytes', 'ARTICLE_MAX_BYTES', int, 1000000),
+    ('front_matter_max_bytes', 'FRONT_MATTER_MAX_BYTES', int, 64 * 1024),
+
+    ('check_cache_path', 'CHECK_CACHE_PATH', _text,
+     os.path.join(PARENT_DIR, 'check_cache.sqlite3')), # disabled if empty
+    ('check_cache_max_bytes', 'CHECK_CACHE_MAX_BYTES', int, 50 * 1024 * 1024),
+
+    ('github_api_url', 'GITHUB_API_URL', _text, None),
+    ('github_pool_size', 'GITHUB_POOL_SIZE', int, 10),
+    ('github_connection_max_age', 'GITHUB_CONNECTION_MAX_AGE', float, 3600.0),
+    ('github_rate_limit_reserve', 'GITHUB_RATE_LIMIT_RESERVE', int, 500),
+    ('github_etag_cache_max_bytes', 'GITHUB_ETAG_CACHE_MAX_BYTES', int, 10 * 1024 * 1024),
+    ('github_connect_timeout', 'GITHUB_CONNECT_TIMEOUT', float, 4.0),
+    ('github_read_timeout', 'GITHUB_READ_TIMEOUT', float, 10.0),
+    # reads sent again after a 5xx or a connection error, with jittered backoff
+    ('github_retries', 'GITHUB_RETRIES', int, 2),
+    ('github_retry_backoff', 'GITHUB_RETRY_BACKOFF', float, 0.5),
+    # failing calls in a row before greetings and chit-chat are skipped (0 for never)
+    ('breaker_failures', 'BREAKER_FAILURES', int, 5),
+    ('breaker_reset_seconds', 'BREAKER_RESET_SECONDS', float, 30.0),
+    # how pull request files and articles are fetched, rest is the fallback
+    ('github_backend', 'GITHUB_BACKEND', _text, u'rest'), # or 'graphql', 'git'
+    # bare mirrors of the repos for the git backend, fetched from the url
+    ('git_mirror_dir', 'GIT_MIRROR_DIR', _text, os.path.join(PARENT_DIR, 'mirrors')),
+    ('git_mirror_url', 'GIT_MIRROR_URL', _text, u'https://github.com/{owner}/{repo}.git'),
+    ('git_mirror_timeout', 'GIT_MIRROR_TIMEOUT', float, 300.0),
+
+    ('record_path', 'RECORD_PATH', _text, None), # disabled if empty
+
+    # github never sends more than 25 MB
+    ('webhook_max_bytes', 'WEBHOOK_MAX_BYTES', int, 25 * 1024 * 1024),
+    # keep only the payload fields the reactions read
+    ('webhook_project_payload', 'WEBHOOK_PROJECT_PAYLOAD', _flag, False),
+
+    ('comment_debounce', 'COMMENT_DEBOUNCE', float, 0.0),
+
+    # other names people mention the bot by, comma separated
+    ('bot_aliases', 'BOT_ALIASES', _names, ()),
+    # commands per issue: a burst, then one per interval (0 for no limit)
+    ('command_burst', 'COMMAND_BURST', int, 5),
+    ('command_interval', 'COMMAND_INTERVAL', float, 60.0),
+
+    ('log_dir', 'LOG_DIR', _text, os.path.join(PARENT_DIR, 'access_and_errors.log')),
+    ('log_max_bytes', 'LOG_MAX_BYTES', int, 10 * 1024 * 1024),
+    ('log_backup_count', 'LOG_BACKUP_COUNT', int, 10),
+    ('log_format', 'LOG_FORMAT', _text, u'text'), # or 'json'
+    ('log_queue_size', 'LOG_QUEUE_SIZE', int, 10000),
+    ('log_level', 'LOG_LEVEL', _text, None), # flask's own level if empty
+
+    # log the spans of runs taking at least this long
+    ('trace_min_seconds', 'TRACE_MIN_SECONDS', float, 1.0),
+    # cProfile a fraction of the requests, or those asking with a signed header
+    ('profile_sample_rate', 'PROFILE_SAMPLE_RATE', float, 0.0),
+    ('profile_secret', 'PROFILE_SECRET', _text, None),
+    ('profile_dir', 'PROFILE_DIR', _text, os.path.join(PARENT_DIR, 'profiles')),
+    ('profile_max_files', 'PROFILE_MAX_FILES', int, 50),
+] # type: List[Tuple[Text, Text, Callable[[Text], Any], Any]]
+
+# the class level value of the declared settings below
+_DECLARED = None # type: Any
+
+# must not be negative
+NON_NEGATIVE = (
+    'repos_config_ttl', 'queue_max_depth', 'queue_workers', 'queue_max_attempts',
+    'queue_retry_delay', 'queue_lease_seconds', 'queue_dead_ttl', 'delivery_deadline',
+    'dedup_ttl', 'dedup_max_entries', 'article_max_bytes', 'front_matter_max_bytes',
+    'check_cache_max_bytes', 'github_rate_limit_reserve', 'github_etag_cache_max_bytes',
+    'github_retries', 'github_retry_backoff', 'breaker_failures', 'breaker_reset_seconds',
+    'git_mirror_timeout', 'webhook_max_bytes', 'comment_debounce', 'command_interval',
+    'log_max_bytes', 'log_backup_count', 'log_queue_size', 'trace_min_seconds',
+    'profile_max_files')
+# must be at least one
+POSITIVE = ('article_fetch_workers', 'github_pool_size', 'command_burst')
+# must be more than zero
+NOT_ZERO = ('github_connect_timeout', 'github_read_timeout')
+
+
+class Config(object):
+    """the settings, as attributes named like the lowercase FIELDS"""
+
+    # declared for the type checker only, __init__ sets every one of them
+    user = _DECLARED # type: Text
+    password = _DECLARED # type: Text
+    secret_key = _DECLARED # type: Optional[Text]
+    posts_location = _DECLARED # type: Text
+    repos_config_path = _DECLARED # type: Optional[Text]
+    repos_config_file = _DECLARED # type: Optional[Text]
+    repos_config_ttl = _DECLARED # type: float
+    queue_path = _DECLARED # type: Text
+    queue_max_depth = _DECLARED # type: int
+    queue_workers = _DECLARED # type: int
+    queue_max_attempts = _DECLARED # type: int
+    queue_retry_delay = _DECLARED # type: float
+    queue_lease_seconds = _DECLARED # type: float
+    queue_dead_ttl = _DECLARED # type: float
+    dead_letter_path = _DECLARED # type: Text
+    delivery_deadline = _DECLARED # type: float
+    dedup_ttl = _DECLARED # type: float
+    dedup_max_entries = _DECLARED # type: int
+    dedup_path = _DECLARED # type: Optional[Text]
+    article_fetch_workers = _DECLARED # type: int
+    article_max_bytes = _DECLARED # type: int
+    front_matter_max_bytes = _DECLARED # type: int
+    check_cache_path = _DECLARED # type: Text
+    check_cache_max_bytes = _DECLARED # type: int
+    github_api_url = _DECLARED # type: Optional[Text]
+    github_pool_size = _DECLARED # type: int
+    github_connection_max_age = _DECLARED # type: float
+    github_rate_limit_reserve = _DECLARED # type: int
+    github_etag_cache_max_bytes = _DECLARED # type: int
+    github_connect_timeout = _DECLARED # type: float
+    github_read_timeout = _DECLARED # type: float
+    github_retries = _DECLARED # type: int
+    github_retry_backoff = _DECLARED # type: float
+    breaker_failures = _DECLARED # type: int
+    breaker_reset_seconds = _DECLARED # type: float
+    github_backend = _DECLARED # type: Text
+    git_mirror_dir = _DECLARED # type: Text
+    git_mirror_url = _DECLARED # type: Text
+    git_mirror_timeout = _DECLARED # type: float
+    record_path = _DECLARED # type: Optional[Text]
+    webhook_max_bytes = _DECLARED # type: int
+    webhook_project_payload = _DECLARED # type: bool
+    comment_debounce = _DECLARED # type: float
+    bot_aliases = _DECLARED # type: Tuple[Text, ...]
+    command_burst = _DECLARED # type: int
+    command_interval = _DECLARED # type: float
+    log_dir = _DECLARED # type: Text
+    log_max_bytes = _DECLARED # type: int
+    log_backup_count = _DECLARED # type: int
+    log_format = _DECLARED # type: Text
+    log_queue_size = _DECLARED # type: int
+    log_level = _DECLARED # type: Optional[Text]
+    trace_min_seconds = _DECLARED # type: float
+    profile_sample_rate = _DECLARED # type: float
+    profile_secret = _DECLARED # type: Optional[Text]
+    profile_dir = _DECLARED # type: Text
+    profile_max_files = _DECLARED # type: int
+
+    def __init__(self, **values):
+        # type: (**Any) -> None
+        errors = [] # type: List[Text]
+        for name, env_name, _, default in FIELDS:
+            value = values.pop(name, default)
+            if value is REQUIRED:
+                errors.append(u'`{}` is not set'.format(env_name))
+            setattr(self, name, value)
+        if values:
+            errors.append(u'unknown settings {}'.format(sorted(values)))
+        if errors:
+            raise ConfigError(u'; '.join(errors))
+        self.validate()
+
+    def validate(self):
+        # type: () -> None
+        errors = [] # type: List[Text]
+        for name in ('user', 'password'):
+            if not getattr(self, name):
+                errors.append(u'{} must not be empty'.format(name))
+        for name in NON_NEGATIVE:
+            if getattr(self, name) < 0:
+                errors.append(u'{} must not be negative'.format(name))
+        for name in POSITIVE:
+            if getattr(self, name) < 1:
+                errors.append(u'{} must be at least 1'.format(name))
+        for name in NOT_ZERO:
+            if getattr(self, name) <= 0:
+                errors.append(u'{} must be more than 0'.format(name))
+        if (self.queue_workers and self.queue_lease_seconds
+                and self.delivery_deadline > self.queue_lease_seconds):
+            # the job would be leased to another worker while still running
+            errors.append(u'delivery_deadline must not exceed queue_lease_seconds')
+        if not 0 <= self.profile_sample_rate <= 1:
+            errors.append(u'profile_sample_rate must be between 0 and 1')
+        if self.github_backend not in ('rest', 'graphql', 'git'):
+            errors.append(u'github_backend must be "rest", "graphql" or "git"')
+        if self.github_backend == 'git' and not self.git_mirror_dir:
+            errors.append(u'git_mirror_dir must not be empty for the git backend')
+        if self.log_format not in ('text', 'json'):
+            errors.append(u'log_format must be "text" or "json"')
+        if errors:
+            raise ConfigError(u'; '.join(errors))
+
+    @classmethod
+    def from_env(cls,
+        environ=None, # type: Optional[Mapping[Text, Text]]
+        dotenv_path=None, # type: Optional[Text]
+        **overrides # type: Any
+        ):
+        # type: (...) -> Config
+        """read the environment (and the .env file) once"""
+        if environ is None:
+            from dotenv import load_dotenv, find_dotenv
+            load_dotenv(dotenv_path or find_dotenv())
+            environ = os.environ
+        values = {} # type: Dict[Text, Any]
+        errors = [] # type: List[Text]
+        for name, env_name, parse, default in FIELDS:
+            raw = environ.get(env_name)
+            if raw is None or (raw == '' and parse is not _text):
+                continue
+            try:
+                values[name] = parse(raw)
+            except ValueError:
+                errors.append(u'`{}` is malformed: {!r}'.format(env_name, raw))
+        if errors:
+            raise ConfigError(u'; '.join(errors))
+        values.update(overrides)
+        return cls(**values)
+
+    def as_dict(self, secrets=False):
+        # type: (bool) -> Dict[Text, Any]
+        return dict(
+            (name, getattr(self, name)) for name, _, _, _ in FIELDS
+            if secrets or name not in ('password', 'secret_key', 'profile_secret'))
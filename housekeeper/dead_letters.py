@@ -0,0 +1,178 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+deliveries that failed for good, parked to be run again by hand
+
+an inline delivery lands here when its reaction fails or is deferred
+(github does not redeliver after our 503), a queued one when its job has
+used up `QUEUE_MAX_ATTEMPTS`. once github is fine again:
+
+    python -m housekeeper.dead_letters list
+    python -m housekeeper.dead_letters rerun [ID ...]
+    python -m housekeeper.dead_letters drop ID ...
+
+`rerun` runs the reactions right away, in this process, with the
+settings of the web app (`.env`); those that succeed are removed.
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+from collections import namedtuple
+import json
+import sys
+import time
+from typing import Dict, List, Optional, Text
+
+from .storage import SqliteStore
+
+
+__all__ = ['DeadLetter', 'DeadLetterStore']
+
+
+DeadLetter = namedtuple(
+    'DeadLetter', ['id', 'event', 'delivery', 'payload', 'error', 'attempts', 'failed_at'])
+
+
+class DeadLetterStore(SqliteStore):
+    """a sqlite file of failed deliveries, one row per delivery"""
+
+    def _init_schema(self):
+        # type: () -> None
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS dead_letters ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'event TEXT NOT NULL, '
+            'delivery TEXT UNIQUE, '
+            'payload TEXT NOT NULL, '
+            'error TEXT, '
+            'attempts INTEGER NOT NULL, '
+            'failed_at REAL NOT NULL)'
+        )
+
+    def park(self,
+        event, # type: Text
+        payload, # type: Dict
+        delivery=None, # type: Optional[Text]
+        error=None, # type: Optional[Text]
+        attempts=1 # type: int
+        ):
+        # type: (...) -> None
+        """keep a failed delivery; failing again adds to its attempts"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO dead_letters '
+                '(event, delivery, payload, error, attempts, failed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (delivery) DO UPDATE SET error = excluded.error, '
+                'attempts = attempts + excluded.attempts, failed_at = excluded.failed_at',
+                (event, delivery, json.dumps(payload), error, attempts, time.time()))
+
+    def discard(self,
+        delivery # type: Text
+        ):
+        # type: (...) -> None
+        """the delivery went through after all, e.g. redelivered by github"""
+        with self._lock:
+            # nearly every delivery was never parked, a read is cheaper than a write
+            cur = self._conn.execute(
+                'SELECT 1 FROM dead_letters WHERE delivery = ?', (delivery,))
+            if cur.fetchone() is not None:
+                self._conn.execute('DELETE FROM dead_letters WHERE delivery = ?', (delivery,))
+
+    def failed_again(self,
+        letter_id, # type: int
+        error=None # type: Optional[Text]
+        ):
+        # type: (...) -> None
+        with self._lock:
+            self._conn.execute(
+                'UPDATE dead_letters SET error = ?, attempts = attempts + 1, '
+                'failed_at = ? WHERE id = ?', (error, time.time(), letter_id))
+
+    def remove(self,
+        letter_id # type: int
+        ):
+        # type: (...) -> None
+        with self._lock:
+            self._conn.execute('DELETE FROM dead_letters WHERE id = ?', (letter_id,))
+
+    def letters(self,
+        ids=None # type: Optional[List[int]]
+        ):
+        # type: (...) -> List[DeadLetter]
+        """the oldest failures first, all of them or those of `ids`"""
+        query = 'SELECT id, event, delivery, payload, error, attempts, failed_at FROM dead_letters'
+        params = () # type: tuple
+        if ids:
+            query += ' WHERE id IN ({})'.format(', '.join('?' * len(ids)))
+            params = tuple(ids)
+        with self._lock:
+            rows = self._conn.execute(query + ' ORDER BY failed_at, id', params).fetchall()
+        return [
+            DeadLetter(row[0], row[1], row[2], json.loads(row[3]), row[4], row[5], row[6])
+            for row in rows]
+
+    def __len__(self):
+        # type: () -> int
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM dead_letters').fetchone()[0]
+
+
+def main(argv=None):
+    # type: (Optional[List[Text]]) -> int
+    parser = argparse.ArgumentParser(
+        description='list, run again or drop the deliveries that failed')
+    parser.add_argument('action', choices=('list', 'rerun', 'drop'))
+    parser.add_argument('ids', nargs='*', type=int,
+                        help='only these letters, all of them by default (but for drop)')
+    args = parser.parse_args(argv)
+    if args.action == 'drop' and not args.ids:
+        parser.error('tell which letters to drop')
+
+    from .config import Config
+    # no workers: they would claim jobs of the web app and die with us
+    config = Config.from_env(queue_workers=0)
+    if not config.dead_letter_path:
+        sys.stderr.write(u'DEAD_LETTER_PATH is empty, nothing is kept\n')
+        return 1
+    state = None
+    if args.action == 'rerun':
+        from .index import create_app
+        from .logging_helpers import log_context
+        state = create_app(config).extensions['housekeeper']
+        store = state.dead_letters
+    else:
+        # only the file is needed, not the app
+        store = DeadLetterStore(config.dead_letter_path)
+
+    letters = store.letters(args.ids)
+    failed = 0
+    for letter in letters:
+        if args.action == 'list':
+            print(u'{}\t{}\t{}\t{} attempts\t{}\t{}'.format(
+                letter.id, letter.event, letter.delivery or u'-', letter.attempts,
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(letter.failed_at)),
+                letter.error or u''))
+        elif args.action == 'drop':
+            store.remove(letter.id)
+        else:
+            assert state is not None
+            with log_context(
+                    delivery=letter.delivery or u'letter-{}'.format(letter.id),
+                    event=letter.event, url=u'<dead letter {}>'.format(letter.id)):
+                res = state.make_reaction(letter.payload).run(letter.event, letter.payload)
+            if res['status'] == 'ok':
+                store.remove(letter.id)
+            else:
+                failed += 1
+                store.failed_again(letter.id, res.get('error') or res['data'])
+            print(u'{}\t{}\t{}'.format(letter.id, letter.event, res['status']))
+    if state is not None:
+        # debounced comments are not to wait for a timer of a process about to exit
+        state.coalescer.flush_all()
+    if args.action != 'list':
+        sys.stderr.write(u'{} letters, {} still failing\n'.format(len(letters), failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
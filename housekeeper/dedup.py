@@ -0,0 +1,148 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+from collections import OrderedDict
+import threading
+import time
+from typing import Dict, Optional, Text
+
+from .storage import SqliteStore
+
+
+__all__ = ['DeliveryDeduplicator']
+
+
+class _SeenDeliveries(SqliteStore):
+    """the persistent half of DeliveryDeduplicator, shared between processes"""
+
+    def __init__(self,
+        path, # type: Text
+        ttl, # type: float
+        max_entries # type: int
+        ):
+        # type: (...) -> None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._claims = 0
+        super(_SeenDeliveries, self).__init__(path)
+
+    def _init_schema(self):
+        # type: () -> None
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS deliveries ('
+            'id TEXT PRIMARY KEY, '
+            'seen_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS deliveries_seen_at ON deliveries (seen_at)')
+
+    def claim(self,
+        delivery, # type: Text
+        now # type: float
+        ):
+        # type: (...) -> bool
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                cur.execute(
+                    'SELECT seen_at FROM deliveries WHERE id = ?', (delivery,))
+                row = cur.fetchone()
+                fresh = row is None or now - row[0] >= self.ttl
+                if fresh:
+                    cur.execute(
+                        'INSERT OR REPLACE INTO deliveries (id, seen_at) '
+                        'VALUES (?, ?)', (delivery, now))
+                self._claims += 1
+                if self._claims % 100 == 0:
+                    self._prune(cur, now)
+                cur.execute('COMMIT')
+            except:
+                cur.execute('ROLLBACK')
+                raise
+        return fresh
+
+    def _prune(self, cur, now):
+        # type: (...) -> None
+        cur.execute(
+            'DELETE FROM deliveries WHERE seen_at < ?', (now - self.ttl,))
+        cur.execute(
+            'DELETE FROM deliveries WHERE id IN ('
+            'SELECT id FROM deliveries ORDER BY seen_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,))
+
+    def forget(self,
+        delivery # type: Text
+        ):
+        # type: (...) -> None
+        with self._lock:
+            self._conn.execute('DELETE FROM deliveries WHERE id = ?', (delivery,))
+
+
+class DeliveryDeduplicator(object):
+    """remember recent X-GitHub-Delivery ids, so redeliveries are skipped
+
+    an in-memory TTL/LRU map answers most questions, the optional sqlite
+    file makes the memory survive restarts and be shared by processes.
+    """
+
+    def __init__(self,
+        ttl=86400.0, # type: float
+        max_entries=10000, # type: int
+        path=None # type: Optional[Text]
+        ):
+        # type: (...) -> None
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._seen = OrderedDict() # type: Dict[Text, float]
+        self._store = None # type: Optional[_SeenDeliveries]
+        if path:
+            self._store = _SeenDeliveries(path, ttl, max_entries)
+
+    def claim(self,
+        delivery # type: Text
+        ):
+        # type: (...) -> bool
+        """mark the delivery as seen, return False if it was seen already"""
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            if delivery in self._seen:
+                return False
+            if self._store is None:
+                self._seen[delivery] = now
+                self._evict(now)
+                return True
+        # the store decides atomically, even across processes
+        fresh = self._store.claim(delivery, now)
+        with self._lock:
+            self._seen[delivery] = now
+            self._evict(now)
+        return fresh
+
+    def __len__(self):
+        # type: () -> int
+        """deliveries remembered in memory"""
+        with self._lock:
+            return len(self._seen)
+
+    def forget(self,
+        delivery # type: Text
+        ):
+        # type: (...) -> None
+        """the delivery was not processed after all, let it come again"""
+        with self._lock:
+            self._seen.pop(delivery, None)
+        if self._store is not None:
+            self._store.forget(delivery)
+
+    def _evict(self, now):
+        # type: (float) -> None
+        # entries are kept in insertion order, so the oldest come first
+        while self._seen:
+            delivery, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.ttl and len(self._seen) <= self.max_entries:
+                break
+            del self._seen[delivery]
@@ -0,0 +1,220 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+a bare local mirror of the content repos, to read pull requests from disk
+
+on every pull request event only `refs/pull/N/head` and the base branch
+are fetched, which brings the new objects and nothing else. the changed
+files come from diffing the head against the merge base, the articles
+are read from the object store in one `git cat-file --batch`.
+
+the remote is `GIT_MIRROR_URL` with `{owner}` and `{repo}` filled in,
+a local path works as well, e.g. a bare repository standing in for github.
+"""
+from __future__ import unicode_literals, print_function
+import base64
+from contextlib import contextmanager
+import logging
+import os
+import subprocess
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Text, Tuple
+try:
+    import fcntl
+except ImportError: # windows, one process there
+    fcntl = None # type: ignore
+
+from . import resilience
+
+__all__ = ['GitError', 'GitMirror']
+
+
+NULL_SHA = u'0' * 40
+
+
+class GitError(Exception):
+    """a git command failed, or its output is not what we expect"""
+
+
+class GitMirror(object):
+    """bare mirrors under `root`, one per repository"""
+
+    def __init__(self,
+        root, # type: Text
+        url_template=u'https://github.com/{owner}/{repo}.git', # type: Text
+        auth=None, # type: Optional[Tuple[Text, Text]]
+        timeout=300.0, # type: float
+        logger=None # type: Optional[logging.Logger]
+        ):
+        # type: (...) -> None
+        self.root = root
+        self.url_template = url_template
+        self.auth = auth
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._repo_locks = {} # type: Dict[Text, threading.Lock]
+
+    def path(self, owner, repo):
+        # type: (Text, Text) -> Text
+        return os.path.join(self.root, owner, repo + u'.git')
+
+    def _env(self, remote):
+        # type: (bool) -> Dict[Text, Text]
+        env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+        if remote and self.auth and self.url_template.startswith('https://'):
+            # through the environment, a command line is visible to everyone
+            token = base64.b64encode(
+                u'{}:{}'.format(*self.auth).encode('utf-8')).decode('ascii')
+            env.update({
+                'GIT_CONFIG_COUNT': '1',
+                'GIT_CONFIG_KEY_0': 'http.extraHeader',
+                'GIT_CONFIG_VALUE_0': 'Authorization: Basic ' + token})
+        return env
+
+    def _git(self, path, *args, **kwargs):
+        # type: (Text, *Text, **Any) -> bytes
+        command = ['git', '--git-dir', path] + list(args)
+        # the delivery deadline cuts a slow fetch short
+        timeout = resilience.clamp(self.timeout or None, u'git ' + args[0])
+        try:
+            done = subprocess.run(
+                command, input=kwargs.get('input'), stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, timeout=timeout,
+                env=self._env(kwargs.get('remote', False)))
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise GitError(u'git {}: {}'.format(args[0], e))
+        if done.returncode != 0:
+            raise GitError(u'git {}: {}'.format(
+                args[0], done.stderr.decode('utf-8', 'replace').strip()))
+        return done.stdout
+
+    @contextmanager
+    def _locked(self, path):
+        # type: (Text) -> Iterator[None]
+        """one writer per mirror, among threads and among processes"""
+        with self._lock:
+            lock = self._repo_locks.setdefault(path, threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            with open(path + u'.lock', 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def fetch_pull(self,
+        owner, # type: Text
+        repo, # type: Text
+        number, # type: int
+        base_ref, # type: Text
+        head_sha=None # type: Optional[Text]
+        ):
+        # type: (...) -> Tuple[Text, Text]
+        """bring the pull request and its base branch up to date, their shas
+
+        with `head_sha` (the head of the webhook payload) that commit is the
+        head, GitError if the pull ref has not brought it yet; github moves
+        the ref a bit after the push.
+        """
+        path = self.path(owner, repo)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with self._locked(path):
+            if not os.path.isdir(path):
+                self.logger.info(u'create the mirror of {}/{}'.format(owner, repo))
+                self._git(path, 'init', '--bare', '--quiet')
+            head = u'refs/pull/{}/head'.format(number)
+            base = u'refs/heads/{}'.format(base_ref)
+            self._git(
+                path, 'fetch', '--quiet', '--no-tags',
+                self.url_template.format(owner=owner, repo=repo),
+                u'+{0}:{0}'.format(head), u'+{0}:{0}'.format(base),
+                remote=True)
+            shas = self._git(path, 'rev-parse', base, head).decode('ascii').split()
+        if head_sha and shas[1] != head_sha:
+            # a later push moved the ref on, or it has not caught up yet
+            try:
+                self._git(path, 'cat-file', '-e', head_sha + u'^{commit}')
+            except GitError:
+                raise GitError(u'{} of {}/{} is at {}, not yet at {}'.format(
+                    head, owner, repo, shas[1], head_sha))
+            return shas[0], head_sha
+        return shas[0], shas[1]
+
+    def changed_files(self,
+        owner, # type: Text
+        repo, # type: Text
+        base_sha, # type: Text
+        head_sha # type: Text
+        ):
+        # type: (...) -> List[Tuple[Text, Optional[Text], Text]]
+        """(path, blob sha, status) like the files of a pull request
+
+        the blob sha is None for removed files, the status is one of
+        `git diff` letters: A, M, D, T.
+        """
+        path = self.path(owner, repo)
+        merge_base = self._git(path, 'merge-base', base_sha, head_sha).decode('ascii').strip()
+        output = self._git(
+            path, 'diff-tree', '-r', '-z', '--no-renames', merge_base, head_sha)
+        # `:old_mode new_mode old_sha new_sha status\0path\0` per file
+        parts = output.split(b'\0')
+        files = [] # type: List[Tuple[Text, Optional[Text], Text]]
+        for meta, name in zip(parts[0::2], parts[1::2]):
+            fields = meta.decode('ascii').split()
+            if len(fields) != 5:
+                raise GitError(u'unexpected diff-tree output {!r}'.format(meta))
+            new_sha, status = fields[3], fields[4][0]
+            files.append((
+                name.decode('utf-8', 'surrogateescape'),
+                None if new_sha == NULL_SHA else new_sha,
+                status))
+        return files
+
+    def read_blobs(self,
+        owner, # type: Text
+        repo, # type: Text
+        shas, # type: List[Text]
+        max_bytes # type: int
+        ):
+        # type: (...) -> Dict[Text, Optional[bytes]]
+        """contents by sha, None for larger than `max_bytes`; missing ones left out"""
+        if not shas:
+            return {}
+        path = self.path(owner, repo)
+        # the sizes first, a huge file is never read into memory
+        output = self._git(
+            path, 'cat-file', '--batch-check',
+            input=u''.join(x + u'\n' for x in shas).encode('ascii'))
+        blobs = {} # type: Dict[Text, Optional[bytes]]
+        wanted = [] # type: List[Text]
+        for sha, line in zip(shas, output.decode('ascii').splitlines()):
+            # `<sha> <type> <size>` or `<sha> missing`
+            header = line.split()
+            if len(header) != 3 or header[1] != 'blob':
+                continue
+            if int(header[2]) > max_bytes:
+                blobs[sha] = None
+            else:
+                wanted.append(sha)
+        if not wanted:
+            return blobs
+        output = self._git(
+            path, 'cat-file', '--batch',
+            input=u''.join(x + u'\n' for x in wanted).encode('ascii'))
+        offset = 0
+        for sha in wanted:
+            end = output.index(b'\n', offset)
+            header = output[offset:end].decode('ascii').split()
+            offset = end + 1
+            if len(header) != 3:
+                # `<sha> missing`, gone since the check
+                continue
+            size = int(header[2])
+            blobs[sha] = output[offset:offset + size]
+            offset += size + 1
+        return blobs
@@ -0,0 +1,145 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+what an article check needs from a pull request, through the graphql api
+
+the rest api takes a call for the pull request, one per page of files and
+one per article. here it is one query per `FILES_PAGE_SIZE` files and one
+per `BLOB_BATCH` articles, however many articles there are.
+"""
+from __future__ import unicode_literals, print_function
+from collections import namedtuple
+from typing import Any, Dict, List, Optional, Text
+
+
+__all__ = [
+    'GraphQLError', 'PullRequestFiles', 'Blob',
+    'graphql_url', 'query', 'pull_request_files', 'blobs'
+]
+
+
+FILES_PAGE_SIZE = 100
+BLOB_BATCH = 50
+
+# head commit and the changed paths; `files` are (path, change type)
+PullRequestFiles = namedtuple('PullRequestFiles', ['head_oid', 'files'])
+# `text` is None if not asked for, binary, or too large for graphql
+Blob = namedtuple('Blob', ['oid', 'byte_size', 'text'])
+
+PULL_REQUEST_FILES_QUERY = u'''
+query($owner: String!, $name: String!, $number: Int!, $first: Int!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      headRefOid
+      files(first: $first, after: $after) {
+        pageInfo { hasNextPage endCursor }
+        nodes { path changeType }
+      }
+    }
+  }
+}
+'''
+
+BLOB_FIELDS = u'oid byteSize'
+BLOB_TEXT_FIELDS = u'oid byteSize isBinary isTruncated text'
+
+
+class GraphQLError(Exception):
+    """the query was answered with errors, or not in the expected shape"""
+
+
+def graphql_url(client):
+    # type: (Any) -> Text
+    """the endpoint next to the rest api the client talks to"""
+    base = client.session.base_url.rstrip('/')
+    if base.endswith('/api/v3'):
+        # github enterprise
+        return base[:-len('v3')] + u'graphql'
+    return base + u'/graphql'
+
+
+def query(
+    client, # type: Any
+    text, # type: Text
+    variables # type: Dict[Text, Any]
+    ):
+    # type: (...) -> Dict[Text, Any]
+    """the `data` of the answer, raise GraphQLError on any error"""
+    response = client.session.post(
+        graphql_url(client), json={'query': text, 'variables': variables})
+    response.raise_for_status()
+    answer = response.json()
+    if answer.get('errors') or not isinstance(answer.get('data'), dict):
+        raise GraphQLError(u'; '.join(
+            x.get('message', u'{}'.format(x)) for x in answer.get('errors') or [])
+            or u'no data')
+    return answer['data']
+
+
+def pull_request_files(
+    client, # type: Any
+    owner, # type: Text
+    repo, # type: Text
+    number, # type: int
+    page_size=FILES_PAGE_SIZE # type: int
+    ):
+    # type: (...) -> PullRequestFiles
+    """the head commit and every changed file, a query per page"""
+    files = [] # type: List[Any]
+    head_oid = None
+    after = None # type: Optional[Text]
+    while True:
+        data = query(client, PULL_REQUEST_FILES_QUERY, {
+            'owner': owner, 'name': repo, 'number': number,
+            'first': page_size, 'after': after})
+        pull = (data.get('repository') or {}).get('pullRequest')
+        if pull is None:
+            raise GraphQLError(u'no pull request {}/{}#{}'.format(owner, repo, number))
+        head_oid = pull['headRefOid']
+        page = pull['files']
+        files += [(x['path'], x['changeType']) for x in page['nodes']]
+        if not page['pageInfo']['hasNextPage']:
+            break
+        after = page['pageInfo']['endCursor']
+    return PullRequestFiles(head_oid, files)
+
+
+def blobs(
+    client, # type: Any
+    owner, # type: Text
+    repo, # type: Text
+    rev, # type: Text
+    paths, # type: List[Text]
+    text=True, # type: bool
+    batch=BLOB_BATCH # type: int
+    ):
+    # type: (...) -> Dict[Text, Optional[Blob]]
+    """the blobs of `paths` at `rev`, None for a path that is not a file"""
+    found = {} # type: Dict[Text, Optional[Blob]]
+    fields = BLOB_TEXT_FIELDS if text else BLOB_FIELDS
+    for start in range(0, len(paths), batch):
+        chunk = paths[start:start + batch]
+        # one aliased `object` per path, the expressions go as variables
+        # so that no path needs escaping
+        aliases = [u'b{}'.format(idx) for idx in range(len(chunk))]
+        text_query = u'query($owner: String!, $name: String!, {}) {{\n' \
+            u'  repository(owner: $owner, name: $name) {{\n{}\n  }}\n}}\n'.format(
+                u', '.join(u'${}: String!'.format(x) for x in aliases),
+                u'\n'.join(
+                    u'    {0}: object(expression: ${0}) {{ ... on Blob {{ {1} }} }}'.format(
+                        x, fields)
+                    for x in aliases))
+        variables = {'owner': owner, 'name': repo} # type: Dict[Text, Any]
+        for alias, path in zip(aliases, chunk):
+            variables[alias] = u'{}:{}'.format(rev, path)
+        repository = query(client, text_query, variables).get('repository') or {}
+        for alias, path in zip(aliases, chunk):
+            node = repository.get(alias)
+            if not node or 'oid' not in node:
+                found[path] = None
+                continue
+            content = None
+            if text and not node.get('isBinary') and not node.get('isTruncated'):
+                content = node.get('text')
+            found[path] = Blob(node['oid'], node['byteSize'], content)
+    return found
@@ -1,106 +1,589 @@
 #/usr/bin/env python
 # -*- coding: utf-8 -*-
+"""
+the web app
+
+    application = create_app()        # reads the env vars (and .env) once
+    warm_up(application)              # optional, e.g. in a pre-forking master
+
+the queue workers start with the app; `warm_up` stops them again in the
+master, and every forked process starts its own.
+
+github3, yaml and the reactions are only imported by `warm_up` or by the
+first delivery that needs them, not when this module is imported.
+"""
 from __future__ import unicode_literals, print_function
+import json
+import logging
 import os
-import sys
-from hashlib import sha1
-import hmac
+import threading
+import time
+from typing import Any, Dict, Optional, Text
+
+from flask import Blueprint, Flask, Response, current_app, jsonify, request
+
+from . import metrics
+from .config import Config, ConfigError
+from .logging_helpers import get_desired_handler, log_context
+from .payload import PayloadTooLarge, project, read_body
+from .utils import signature_matches
+
+
+__all__ = ['create_app', 'warm_up', 'Config', 'ConfigError']
+
+
+DELIVERIES = metrics.counter(
+    'housekeeper_deliveries_total',
+    'webhook deliveries, by event and http status code', ['event', 'code'])
+WEBHOOK_SECONDS = metrics.histogram(
+    'housekeeper_webhook_seconds',
+    'end to end latency of the webhook handler', ['event'])
+
+
+class Housekeeper(object):
+    """everything the routes need, built from one config
+
+    the github clients, the comment coalescer and the reactions are created
+    on first use, so that each forked worker makes its own.
+    """
+
+    def __init__(self,
+        config, # type: Config
+        logger # type: logging.Logger
+        ):
+        # type: (...) -> None
+        from .dedup import DeliveryDeduplicator
+        from .job_queue import JobQueue, WorkerPool
+        from .profiling import Profiler
+        from .recorder import DeliveryRecorder
+
+        self.config = config
+        self.logger = logger
+        self.startup = {} # type: Dict[Text, float]
+        self._lock = threading.Lock()
+        self._clients = None
+        self._coalescer = None
+        self._check_cache = None
+        self._reaction_class = None
+        self._repo_configs = None
+        self._command_limiter = None
+        self._git_mirror = None
+        self._dead_letters = None
+
+        self.deliveries = DeliveryDeduplicator(
+            ttl=config.dedup_ttl,
+            max_entries=config.dedup_max_entries,
+            path=config.dedup_path)
+
+        self.profiler = Profiler(
+            config.profile_dir,
+            sample_rate=config.profile_sample_rate,
+            secret=config.profile_secret,
+            max_files=config.profile_max_files,
+            logger=logger)
+
+        self.recorder = None
+        if config.record_path:
+            self.recorder = DeliveryRecorder(config.record_path)
+
+        self.job_queue = None
+        self.worker_pool = None
+        if config.queue_workers > 0:
+            self.job_queue = JobQueue(
+                config.queue_path,
+                max_depth=config.queue_max_depth,
+                max_attempts=config.queue_max_attempts,
+                retry_delay=config.queue_retry_delay,
+                lease_seconds=config.queue_lease_seconds,
+                dead_ttl=config.queue_dead_ttl)
+            # create_app starts the workers; warm_up stops them in a master
+            # about to fork, every forked process then starts its own
+            self.worker_pool = WorkerPool(
+                self.job_queue, self.run_job, logger, size=config.queue_workers,
+                on_give_up=self.give_up_job)
+
+    ################################################
+    # created on first use
+    ################################################
+
+    @property
+    def clients(self):
+        if self._clients is None:
+            with self._lock:
+                if self._clients is None:
+                    from .clients import ClientRegistry
+                    from .resilience import CircuitBreaker
+                    self._clients = ClientRegistry(
+                        pool_size=self.config.github_pool_size,
+                        max_age=self.config.github_connection_max_age,
+                        api_url=self.config.github_api_url,
+                        rate_limit_reserve=self.config.github_rate_limit_reserve,
+                        etag_cache_max_bytes=self.config.github_etag_cache_max_bytes,
+                        connect_timeout=self.config.github_connect_timeout,
+                        read_timeout=self.config.github_read_timeout,
+                        retries=self.config.github_retries,
+                        retry_backoff=self.config.github_retry_backoff,
+                        breaker=CircuitBreaker(
+                            failures=self.config.breaker_failures,
+                            reset_seconds=self.config.breaker_reset_seconds))
+        return self._clients
+
+    @property
+    def coalescer(self):
+        if self._coalescer is None:
+            with self._lock:
+                if self._coalescer is None:
+                    from .comments import CommentCoalescer
+                    self._coalescer = CommentCoalescer(
+                        debounce=self.config.comment_debounce, logger=self.logger)
+        return self._coalescer
+
+    @property
+    def command_limiter(self):
+        if self._command_limiter is None:
+            with self._lock:
+                if self._command_limiter is None:
+                    from .commands import IssueRateLimiter
+                    self._command_limiter = IssueRateLimiter(
+                        burst=self.config.command_burst,
+                        interval=self.config.command_interval)
+        return self._command_limiter
+
+    @property
+    def git_mirror(self):
+        if self._git_mirror is None and self.config.github_backend == 'git':
+            with self._lock:
+                if self._git_mirror is None: # only for the git backend
+                    from .git_mirror import GitMirror
+                    self._git_mirror = GitMirror(
+                        self.config.git_mirror_dir,
+                        url_template=self.config.git_mirror_url,
+                        auth=(self.config.user, self.config.password),
+                        timeout=self.config.git_mirror_timeout,
+                        logger=self.logger)
+        return self._git_mirror
+
+    @property
+    def check_cache(self):
+        if self._check_cache is None and self.config.check_cache_path:
+            with self._lock:
+                if self._check_cache is None: # empty path disables the cache
+                    from .check_cache import ArticleCheckCache
+                    self._check_cache = ArticleCheckCache(
+                        self.config.check_cache_path,
+                        max_bytes=self.config.check_cache_max_bytes)
+        return self._check_cache
+
+    @property
+    def dead_letters(self):
+        if self._dead_letters is None and self.config.dead_letter_path:
+            with self._lock:
+                if self._dead_letters is None: # empty path keeps nothing
+                    from .dead_letters import DeadLetterStore
+                    self._dead_letters = DeadLetterStore(self.config.dead_letter_path)
+        return self._dead_letters
+
+    @property
+    def repo_configs(self):
+        if self._repo_configs is None:
+            with self._lock:
+                if self._repo_configs is None:
+                    from .repo_config import RepoConfigStore, default_settings
+                    self._repo_configs = RepoConfigStore(
+                        default_settings(self.config.posts_location),
+                        path=self.config.repos_config_path,
+                        repo_file=self.config.repos_config_file,
+                        ttl=self.config.repos_config_ttl,
+                        logger=self.logger)
+        return self._repo_configs
+
+    @property
+    def reaction_class(self):
+        if self._reaction_class is None:
+            from .reaction import Reaction
+            self._reaction_class = Reaction
+        return self._reaction_class
+
+    def handles(self, event):
+        # type: (Text) -> bool
+        """whether some reaction runs for the event"""
+        return callable(getattr(self.reaction_class, '_{}'.format(event), None))
+
+    def make_reaction(self, payload=None):
+        # type: (Optional[Dict]) -> Any
+        """a reaction wired with the shared client and the settings of
+        the repository the payload comes from"""
+        config = self.config
+        client = self.clients.get(config.user, config.password)
+        full_name = ((payload or {}).get('repository') or {}).get('full_name')
+        return self.reaction_class(
+            config.user, config.password, self.logger, config.posts_location,
+            client=client,
+            fetch_workers=config.article_fetch_workers,
+            max_article_bytes=config.article_max_bytes,
+            check_cache=self.check_cache,
+            max_front_matter_bytes=config.front_matter_max_bytes,
+            rate_limit=self.clients.budget(config.user, config.password),
+            coalescer=self.coalescer,
+            settings=self.repo_configs.get(full_name, client),
+            backend=config.github_backend,
+            git_mirror=self.git_mirror,
+            aliases=config.bot_aliases,
+            command_limiter=self.command_limiter,
+            trace_min_seconds=config.trace_min_seconds,
+            deadline=config.delivery_deadline,
+            breaker=self.clients.breaker)
+
+    def run_job(self, job):
+        """worker side, the real reaction happens here"""
+        from .job_queue import Deferred, Failed
+        with log_context(
+                delivery=job.delivery or u'job-{}'.format(job.id),
+                event=job.event, url=u'<job {}>'.format(job.id)):
+            reaction = self.make_reaction(job.payload)
+            if self.profiler.take(job.delivery):
+                with self.profiler.profile(u'{}-{}-job'.format(job.event, job.delivery)):
+                    res = reaction.run(job.event, job.payload)
+            else:
+                res = reaction.run(job.event, job.payload)
+        if res['status'] == 'deferred':
+            raise Deferred(res['retry_at'], res['data'])
+        if res['status'] != 'ok':
+            raise Failed(res.get('error') or res['data'])
+        if job.delivery and self.dead_letters is not None:
+            self.dead_letters.discard(job.delivery)
+        return True
+
+    def give_up_job(self, job, error):
+        """a job failed too many times, park it with the dead letters"""
+        if self.dead_letters is None:
+            return # it stays in the queue as 'dead'
+        self.dead_letters.park(
+            job.event, job.payload, job.delivery, error, attempts=job.attempts)
+        self.job_queue.ack(job)
+
+    def failed_inline(self, event, payload, delivery, error):
+        """an inline delivery failed or was deferred, github may or may not redeliver it"""
+        if self.dead_letters is None:
+            return
+        try:
+            self.dead_letters.park(event, payload, delivery, error)
+        except:
+            # never fail the response because of the dead letters
+            self.logger.exception('cannot park failed delivery')
 
-from dotenv import load_dotenv, find_dotenv
-from flask import Flask, jsonify, request
+    def warm_up(self):
+        # type: () -> float
+        """import and precompile what every delivery needs, before forking
 
-from .reaction import Reaction
-from .logging_helpers import get_desired_handler
+        no client and no thread is created here, those belong to a worker.
+        """
+        started = time.time()
+        from . import rules
+        _ = self.reaction_class # imports github3, unidiff, yaml and the rules
+        _ = self.coalescer
+        _ = self.command_limiter
+        from .commands import matcher_for
+        matcher_for((self.config.user,) + self.config.bot_aliases)
+        _ = self.check_cache
+        _ = self.git_mirror
+        _ = self.dead_letters
+        self.repo_configs.get(None) # parses the local file, if any
+        # the rule patterns are compiled at import, index them by scope too
+        for scope in ('path', 'meta', 'line'):
+            rules._rules_of(scope)
+        # the budgets outlive the clients, a forked worker inherits them
+        self.clients.budget(self.config.user, self.config.password)
+        return time.time() - started
 
+    ################################################
+    # metrics
+    ################################################
 
-try:
-    load_dotenv(find_dotenv())
-    user = os.environ['GITHUB_USER']
-    password = os.environ['GITHUB_PASSWORD']
-    secret_key = os.environ.get('GITHUB_SECRET', None) # maybe not enabled
-    posts_location = os.environ.get('POSTS_LOCATION', u'content/post/')
-except KeyError:
-    sys.stderr.write(u'you need to specify env var'
-                     u'`GITHUB_USER` and `GITHUB_PASSWORD`')
-    exit(0)
+    def register_gauges(self, log_handler):
+        """numbers the components keep anyway, read at scrape time only"""
+        config = self.config
+        metrics.gauge(
+            'housekeeper_github_clients_total', 'client registry lookups',
+            lambda: dict(((k,), v) for k, v in self.clients.stats().items()
+                         if k in ('hits', 'misses')),
+            ['result'], kind='counter')
+        metrics.gauge(
+            'housekeeper_github_etag_cache_total', 'conditional github requests',
+            lambda: dict(((k,), v) for k, v in self.clients.etag_stats().items()),
+            ['result'], kind='counter')
+        metrics.gauge(
+            'housekeeper_github_rate_limit_remaining',
+            'api calls left in the current rate limit window',
+            lambda: {(): self.clients.budget(
+                config.user, config.password).stats()['remaining']})
+        metrics.gauge(
+            'housekeeper_dedup_entries', 'deliveries remembered in memory',
+            lambda: {(): len(self.deliveries)})
+        metrics.gauge(
+            'housekeeper_log_dropped_total', 'log records dropped on a full queue',
+            lambda: {(): log_handler.dropped}, kind='counter')
+        metrics.gauge(
+            'housekeeper_startup_seconds', 'time spent creating the app, by phase',
+            lambda: dict(((k,), v) for k, v in self.startup.items()), ['phase'])
+        if config.check_cache_path:
+            metrics.gauge(
+                'housekeeper_check_cache_total', 'article check cache lookups',
+                lambda: dict(((k,), self.check_cache.stats()[k])
+                             for k in ('hits', 'misses')),
+                ['result'], kind='counter')
+        metrics.gauge(
+            'housekeeper_github_breaker_open',
+            '1 while github calls keep failing and reactions are shed',
+            lambda: {(): int(self.clients.breaker.degraded())})
+        if config.dead_letter_path:
+            metrics.gauge(
+                'housekeeper_dead_letters', 'failed deliveries waiting for a rerun',
+                lambda: {(): len(self.dead_letters)})
+        if self.job_queue is not None:
+            metrics.gauge(
+                'housekeeper_queue_depth', 'jobs waiting or running',
+                lambda: {(): self.job_queue.depth()})
 
-app = Flask(__name__)
-app.logger.addHandler(get_desired_handler())
 
+def _state():
+    # type: () -> Housekeeper
+    return current_app.extensions['housekeeper']
 
-@app.route('/')
+
+def create_app(
+    config=None # type: Optional[Config]
+    ):
+    # type: (...) -> Flask
+    """the flask app; the config is read from the env vars if not given"""
+    started = time.time()
+    if config is None:
+        config = Config.from_env()
+
+    app = Flask(__name__)
+    if config.log_level:
+        app.logger.setLevel(config.log_level.upper())
+    log_handler = get_desired_handler(config)
+    app.logger.addHandler(log_handler)
+
+    state = Housekeeper(config, app.logger)
+    app.extensions['housekeeper'] = state
+    app.register_blueprint(routes)
+    app.register_error_handler(404, page_not_found)
+    state.register_gauges(log_handler)
+    if state.worker_pool is not None:
+        # jobs left from before a restart should not wait for the next delivery
+        state.worker_pool.start()
+
+    state.startup['create_app'] = time.time() - started
+    app.logger.info(u'app created in {:.1f} ms'.format(
+        state.startup['create_app'] * 1000))
+    return app
+
+
+def warm_up(app):
+    # type: (Flask) -> None
+    """do the expensive imports now, e.g. in the master before it forks"""
+    state = app.extensions['housekeeper']
+    if state.worker_pool is not None and hasattr(os, 'register_at_fork'):
+        # no thread may hold a lock across the fork, each worker process
+        # starts its own once forked
+        state.worker_pool.stop()
+        os.register_at_fork(after_in_child=state.worker_pool.start)
+    state.startup['warm_up'] = state.warm_up()
+    app.logger.info(u'app warmed up in {:.1f} ms'.format(
+        state.startup['warm_up'] * 1000))
+
+
+_default_app = None
+_default_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # `housekeeper.index:app` keeps working, created when first asked for
+    global _default_app
+    if name != 'app':
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    with _default_app_lock:
+        if _default_app is None:
+            _default_app = create_app()
+    return _default_app
+
+
+################################################
+# routes
+################################################
+
+routes = Blueprint('housekeeper', __name__)
+
+
+@routes.route('/metrics')
+def metrics_page():
+    """prometheus scrapes this"""
+    return Response(
+        metrics.REGISTRY.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@routes.route('/')
 def hello():
     """main page"""
-    app.logger.info('someone come to landing page')
+    current_app.logger.info('someone come to landing page')
     return jsonify({
         'data': 'hello world!',
         'status': 'ok'
     })
 
 
-@app.errorhandler(404)
 def page_not_found(err):
     """404 page"""
-    app.logger.error('someone come to 404 page')
+    current_app.logger.error('someone come to 404 page')
     return jsonify({
         'data': 'no where to go :-(',
         'status': 'error'
     }), 404
 
 
-@app.route('/webhook', methods=['GET', 'POST'])
+@routes.route('/webhook', methods=['GET', 'POST'])
 def webhook():
     """do everything cool"""
+    started = time.time()
+    state = _state()
+    event = request.headers.get('X-GitHub-Event', None)
+    delivery = request.headers.get('X-GitHub-Delivery', None)
+    if request.method == 'POST' and state.profiler.wanted(request.headers, delivery):
+        if state.job_queue is not None:
+            # the real work is in the job, profile that one too
+            state.profiler.mark(delivery)
+        with state.profiler.profile(u'{}-{}-request'.format(event, delivery)):
+            response = current_app.make_response(handle_webhook())
+    else:
+        response = current_app.make_response(handle_webhook())
+    # anyone can send any header, only events we know become a label
+    if event is None or not state.handles(event):
+        event = 'other'
+    WEBHOOK_SECONDS.observe(time.time() - started, event=event)
+    DELIVERIES.inc(event=event, code=response.status_code)
+    return response
+
+
+def handle_webhook():
+    logger = current_app.logger
+    state = _state()
+    config = state.config
+    deliveries = state.deliveries
+
     if request.method == 'GET':
-        app.logger.error('someone try to GET /webhook, not allowed')
+        logger.error('someone try to GET /webhook, not allowed')
         return jsonify({
             'data': 'you shall not pass',
             'status': 'error'
         }), 405
 
     event = request.headers.get('X-GitHub-Event', None)
-    # delivery = request.headers.get('X-GitHub-Delivery', None)
+    delivery = request.headers.get('X-GitHub-Delivery', None)
     signature = request.headers.get('X-Hub-Signature', None)
     # user_agent = request.headers.get('User-Agent', None)
 
-    if secret_key is not None and secret_key: # ignore meaningless empty secret
-        # then we do some basic verification
-        bad_request = jsonify({
-            'status': 'error',
-            'data': 'invalid request'
-        }), 400
-        if signature is None:
-            app.logger.error('we have a secret_key but request do not has signature')
-            return bad_request
-        signature = signature[len('sha1='):]
+    bad_request = jsonify({
+        'status': 'error',
+        'data': 'invalid request'
+    }), 400
+
+    too_large = jsonify({
+        'status': 'error',
+        'data': 'payload is larger than {} bytes'.format(config.webhook_max_bytes)
+    }), 413
+    if (request.content_length or 0) > config.webhook_max_bytes:
+        logger.error('payload is too large, do not even read it')
+        return too_large
+
+    secret_key = config.secret_key
+    verify = secret_key is not None and secret_key # ignore meaningless empty secret
+    if verify and signature is None:
+        logger.error('we have a secret_key but request do not has signature')
+        return bad_request
+    try:
+        # read once, hmac on the way; flask keeps no copy of it
+        body, computed = read_body(
+            request.stream, config.webhook_max_bytes, secret_key if verify else None)
+    except PayloadTooLarge:
+        logger.error('payload is too large, stop reading it')
+        return too_large
+    if verify and not signature_matches(signature, computed):
+        logger.error('wrong signature')
+        return bad_request
+
+    if state.recorder is not None:
         try:
-            secret_key_bytes = secret_key.encode('utf-8')
-        except AttributeError:
-            secret_key_bytes = secret_key
-        computed = hmac.new(secret_key_bytes, request.data, sha1).hexdigest()
-        signature_not_right = False
-        if sys.version_info >= (2, 7, 7):
-            if not hmac.compare_digest(str(signature), str(computed)):
-                signature_not_right = True
-        else:
-            # old python version
-            if str(signature) != str(computed):
-                signature_not_right = True
-        if signature_not_right:
-            app.logger.error('wrong signature')
-            return bad_request
+            state.recorder.record(request.headers, body)
+        except:
+            # never lose a delivery because of the archive
+            logger.exception('cannot record delivery')
 
     try:
-        payload = request.json
+        payload = json.loads(body.decode('utf-8'))
     except:
-        app.logger.error('paylog cannot be parsed?? interrupt.')
+        logger.error('paylog cannot be parsed?? interrupt.')
         return bad_request
+    del body
+    if config.webhook_project_payload:
+        payload = project(payload)
+
+    # redeliveries and manual replays should not comment twice
+    if delivery is not None and not deliveries.claim(delivery):
+        logger.info('delivery {} is seen already, skip it'.format(delivery))
+        return jsonify({
+            'event': event,
+            'data': u'delivery "{}" is already processed'.format(delivery),
+            'status': 'ok'
+        })
+
+    if state.job_queue is not None:
+        from .job_queue import QueueFull
+        # answer github quickly, the workers do the real job later
+        try:
+            state.job_queue.put(event, payload, delivery)
+        except QueueFull:
+            if delivery is not None:
+                deliveries.forget(delivery)
+            logger.error('job queue is full, reject delivery')
+            return jsonify({
+                'event': event,
+                'data': 'too many deliveries, try again later',
+                'status': 'error'
+            }), 503
+        # a no-op once running; a child forked without warm_up (or without
+        # os.register_at_fork) has no threads and starts them here
+        state.worker_pool.start()
+        logger.info('delivery is queued, return 202 response')
+        return jsonify({
+            'event': event,
+            'data': u'"{}" is queued'.format(event),
+            'status': 'ok'
+        }), 202
 
-    reaction = Reaction(user, password, app.logger, posts_location)
+    reaction = state.make_reaction(payload)
     res = reaction.run(event, payload)
+    error = res.pop('error', None)
     if res['status'] == 'ok':
-        app.logger.info('everything is fine, return response')
+        if delivery is not None and state.dead_letters is not None:
+            # a redelivery of a parked one went through
+            state.dead_letters.discard(delivery)
+        logger.info('everything is fine, return response')
         return jsonify(res)
+    elif res['status'] == 'deferred':
+        if delivery is not None:
+            deliveries.forget(delivery)
+        # github never redelivers by itself, whatever the Retry-After says
+        state.failed_inline(event, payload, delivery, res['data'])
+        logger.info('out of rate limit, return 503 response')
+        retry_after = max(int(res.pop('retry_at') - time.time()), 1)
+        return jsonify(res), 503, {'Retry-After': str(retry_after)}
     else:
-        app.logger.info('something goes wrong, return 500 response')
+        if delivery is not None:
+            # let github's redelivery have another try
+            deliveries.forget(delivery)
+        state.failed_inline(event, payload, delivery, error or res['data'])
+        logger.info('something goes wrong, return 500 response')
         return jsonify(res), 500
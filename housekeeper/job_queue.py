@@ -0,0 +1,344 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+from collections import namedtuple
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Text
+
+from .storage import SqliteStore
+
+
+__all__ = ['Deferred', 'Failed', 'Job', 'JobQueue', 'QueueFull', 'WorkerPool']
+
+
+Job = namedtuple('Job', ['id', 'event', 'delivery', 'payload', 'attempts'])
+
+
+class QueueFull(Exception):
+    """the queue has reached its configured depth"""
+
+
+class Deferred(Exception):
+    """the handler cannot run the job now, but should at `retry_at`"""
+
+    def __init__(self, retry_at, reason=None):
+        # type: (float, Optional[Text]) -> None
+        super(Deferred, self).__init__(reason or u'deferred')
+        self.retry_at = retry_at
+
+
+class Failed(Exception):
+    """the handler ran the job and it failed, nothing unexpected to trace"""
+
+
+class JobQueue(SqliteStore):
+    """a durable, sqlite backed queue of webhook deliveries
+
+    a job is only removed after it is acked, so a crash in the middle of
+    a job just lets its lease expire and the job is picked up again, which
+    counts as a failed attempt. dead jobs are kept for `dead_ttl` seconds.
+    """
+
+    def __init__(self,
+        path, # type: Text
+        max_depth=1000, # type: int
+        max_attempts=3, # type: int
+        retry_delay=30.0, # type: float
+        lease_seconds=300.0, # type: float
+        dead_ttl=7 * 86400.0 # type: float
+        ):
+        # type: (...) -> None
+        self.max_depth = max_depth
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self.dead_ttl = dead_ttl # 0 to keep them forever
+
+        super(JobQueue, self).__init__(path)
+        self._not_empty = threading.Condition(self._lock)
+
+    def _init_schema(self):
+        # type: () -> None
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'event TEXT NOT NULL, '
+            'delivery TEXT, '
+            'payload TEXT NOT NULL, '
+            'status TEXT NOT NULL, '
+            'attempts INTEGER NOT NULL DEFAULT 0, '
+            'available_at REAL NOT NULL, '
+            'lease_until REAL, '
+            'last_error TEXT)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at)')
+        if self.dead_ttl > 0:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status = 'dead' AND available_at < ?",
+                (time.time() - self.dead_ttl,))
+
+    def put(self,
+        event, # type: Text
+        payload, # type: Dict
+        delivery=None # type: Optional[Text]
+        ):
+        # type: (...) -> int
+        """persist a delivery, raise QueueFull if there is no room"""
+        data = json.dumps(payload)
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                cur.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')")
+                if cur.fetchone()[0] >= self.max_depth:
+                    raise QueueFull(u'queue is full ({})'.format(self.max_depth))
+                cur.execute(
+                    "INSERT INTO jobs (event, delivery, payload, status, available_at) "
+                    "VALUES (?, ?, ?, 'queued', ?)",
+                    (event, delivery, data, time.time()))
+                job_id = cur.lastrowid
+                assert job_id is not None # always set after an INSERT
+                cur.execute('COMMIT')
+            except:
+                cur.execute('ROLLBACK')
+                raise
+            self._not_empty.notify()
+        return job_id
+
+    def claim(self):
+        # type: () -> Optional[Job]
+        """take the next runnable job, or None if there is nothing to do"""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                # expired leases belong to workers that died mid-job
+                cur.execute(
+                    "SELECT id, event, delivery, payload, attempts, status FROM jobs "
+                    "WHERE (status = 'queued' AND available_at <= ?) "
+                    "OR (status = 'running' AND lease_until <= ?) "
+                    "ORDER BY available_at, id LIMIT 1",
+                    (now, now))
+                row = cur.fetchone()
+                if row is not None:
+                    attempts = row[4]
+                    if row[5] == 'running':
+                        # the worker crashed or hung on it, that was an attempt too
+                        attempts += 1
+                    cur.execute(
+                        "UPDATE jobs SET status = 'running', lease_until = ?, "
+                        "attempts = ? WHERE id = ?",
+                        (now + self.lease_seconds, attempts, row[0]))
+                cur.execute('COMMIT')
+            except:
+                cur.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return Job(row[0], row[1], row[2], json.loads(row[3]), attempts)
+
+    def ack(self,
+        job # type: Job
+        ):
+        # type: (...) -> None
+        """the job is done, forget about it"""
+        with self._lock:
+            self._conn.execute('DELETE FROM jobs WHERE id = ?', (job.id,))
+
+    def retry(self,
+        job, # type: Job
+        error=None # type: Optional[Text]
+        ):
+        # type: (...) -> bool
+        """schedule the job again with backoff, return False if it is dead"""
+        attempts = job.attempts + 1
+        with self._lock:
+            if attempts >= self.max_attempts:
+                self._bury(job.id, attempts, error)
+                return False
+            delay = self.retry_delay * (2 ** (attempts - 1))
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = ?, "
+                "available_at = ?, lease_until = NULL, last_error = ? "
+                "WHERE id = ?",
+                (attempts, time.time() + delay, error, job.id))
+        return True
+
+    def bury(self,
+        job, # type: Job
+        error=None # type: Optional[Text]
+        ):
+        # type: (...) -> None
+        """give up on the job, whatever attempts it has left"""
+        with self._lock:
+            self._bury(job.id, job.attempts, error)
+
+    def _bury(self, job_id, attempts, error):
+        # type: (int, int, Optional[Text]) -> None
+        now = time.time()
+        # a dead job is never available again, the column keeps its time of death
+        self._conn.execute(
+            "UPDATE jobs SET status = 'dead', attempts = ?, available_at = ?, "
+            "lease_until = NULL, last_error = ? WHERE id = ?",
+            (attempts, now, error, job_id))
+        if self.dead_ttl > 0:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status = 'dead' AND available_at < ?",
+                (now - self.dead_ttl,))
+
+    def defer(self,
+        job, # type: Job
+        retry_at, # type: float
+        reason=None # type: Optional[Text]
+        ):
+        # type: (...) -> None
+        """put the job back until `retry_at`, this is not a failed attempt"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, "
+                "lease_until = NULL, last_error = ? WHERE id = ?",
+                (retry_at, reason, job.id))
+
+    def depth(self):
+        # type: () -> int
+        """how many jobs are waiting or running"""
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')")
+            return cur.fetchone()[0]
+
+    def wait(self,
+        timeout # type: float
+        ):
+        # type: (...) -> None
+        """block until someone puts a job in this process, or timeout"""
+        with self._not_empty:
+            self._not_empty.wait(timeout)
+
+    def wake_all(self):
+        # type: () -> None
+        """wake up every waiting worker"""
+        with self._not_empty:
+            self._not_empty.notify_all()
+
+
+class WorkerPool(object):
+    """a few daemon threads draining a JobQueue"""
+
+    def __init__(self,
+        queue, # type: JobQueue
+        handler, # type: Callable[[Job], bool]
+        logger, # type: logging.Logger
+        size=2, # type: int
+        poll_interval=1.0, # type: float
+        on_give_up=None # type: Optional[Callable[[Job, Optional[Text]], None]]
+        ):
+        # type: (...) -> None
+        self.queue = queue
+        self.handler = handler
+        self.logger = logger
+        self.size = size
+        self.poll_interval = poll_interval
+        # called with the job and its last error once it is dead
+        self.on_give_up = on_give_up
+
+        self._lock = threading.Lock()
+        self._threads = [] # type: List[threading.Thread]
+        self._pid = None # type: Optional[int]
+        self._stopping = threading.Event()
+
+    def start(self):
+        # type: () -> None
+        """start the workers, safe to call many times and after fork"""
+        with self._lock:
+            # threads do not survive a fork, so we check the pid as well
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = []
+            for idx in range(self.size):
+                thread = threading.Thread(
+                    target=self._work, name='housekeeper-worker-{}'.format(idx))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self,
+        timeout=None # type: Optional[float]
+        ):
+        # type: (...) -> None
+        """ask the workers to finish their current job and exit"""
+        self._stopping.set()
+        self.queue.wake_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        # type: () -> None
+        while not self._stopping.is_set():
+            try:
+                job = self.queue.claim()
+            except:
+                self.logger.exception(u'cannot claim job from queue')
+                job = None
+            if job is None:
+                self.queue.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+    def run_job(self,
+        job # type: Job
+        ):
+        # type: (...) -> None
+        """run a single job and ack or retry it"""
+        if job.attempts >= self.queue.max_attempts:
+            # only after expired leases, a failed run is not claimed again
+            error = u'its lease expired, the worker crashed or hung' # type: Optional[Text]
+            self.queue.bury(job, error)
+            self._give_up(job, error)
+            return
+        try:
+            ok = self.handler(job)
+            error = None if ok else u'handler reported an error'
+        except Deferred as err:
+            self.queue.defer(job, err.retry_at, u'{}'.format(err))
+            self.logger.info(u'job {} ({}) is deferred: {}'.format(
+                job.id, job.event, err))
+            return
+        except Failed as err:
+            ok = False
+            error = u'{}'.format(err) or u'handler reported an error'
+        except Exception as err:
+            self.logger.exception(u'job {} has an exception'.format(job.id))
+            ok = False
+            error = u'{}'.format(err)
+        if ok:
+            self.queue.ack(job)
+            return
+        if self.queue.retry(job, error):
+            self.logger.info(u'job {} ({}) will be retried'.format(
+                job.id, job.event))
+        else:
+            self._give_up(job._replace(attempts=job.attempts + 1), error)
+
+    def _give_up(self,
+        job, # type: Job
+        error # type: Optional[Text]
+        ):
+        # type: (...) -> None
+        self.logger.error(u'job {} ({}) failed {} times, giving up'.format(
+            job.id, job.event, job.attempts))
+        if self.on_give_up is not None:
+            try:
+                self.on_give_up(job, error)
+            except:
+                self.logger.exception(u'cannot give up job {}'.format(job.id))
@@ -1,50 +1,184 @@
 #/usr/bin/env python
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
+import atexit
+from contextlib import contextmanager
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import threading
+import uuid
+try:
+    import queue
+except ImportError:
+    import Queue as queue # type: ignore
+from typing import Any, Dict, Iterator, List, Optional, Text
 
-from dotenv import load_dotenv, find_dotenv
-from flask import request
+from flask import g, has_request_context, request
 
-__all__ = ['get_desired_handler']
+__all__ = ['get_desired_handler', 'log_context']
+
+
+# what every record carries, whether it comes from a request or a worker
+CONTEXT_FIELDS = ('url', 'remote_addr', 'event', 'delivery', 'signature')
+
+_local = threading.local()
+
+
+@contextmanager
+def log_context(**fields):
+    # type: (**Text) -> Iterator[None]
+    """attach fields (delivery, event, ...) to the records of this thread"""
+    previous = getattr(_local, 'fields', {})
+    _local.fields = dict(previous, **fields)
+    try:
+        yield
+    finally:
+        _local.fields = previous
+
+
+def _request_fields():
+    # type: () -> Dict[Text, Text]
+    delivery = request.headers.get('X-GitHub-Delivery')
+    if delivery is None:
+        # still correlate every line of this very request
+        if 'correlation_id' not in g:
+            g.correlation_id = u'local-{}'.format(uuid.uuid4())
+        delivery = g.correlation_id
+    return {
+        'url': request.url,
+        'remote_addr': request.remote_addr or u'<no address>',
+        'event': request.headers.get('X-GitHub-Event', '<no event>'),
+        'delivery': delivery,
+        'signature': request.headers.get('X-Hub-Signature', '<no signature>')
+    }
+
+
+class ContextFilter(logging.Filter):
+    """capture the context in the thread that logs, it is gone afterwards"""
+
+    def filter(self, record):
+        fields = getattr(_local, 'fields', {}) # type: Dict[Text, Text]
+        if has_request_context():
+            fields = dict(_request_fields(), **fields)
+        for name in CONTEXT_FIELDS:
+            if not hasattr(record, name):
+                setattr(record, name, fields.get(name, u'<no {}>'.format(name)))
+        return True
 
 
 class RequestFormatter(logging.Formatter):
+    """the human readable format, from the fields captured up front"""
+
+
+class JsonFormatter(logging.Formatter):
+    """one json object per line, no regex needed to aggregate them"""
+
     def format(self, record):
-        record.url = request.url
-        record.remote_addr = request.remote_addr
-        record.event = request.headers.get('X-GitHub-Event', '<no event>')
-        record.delivery = request.headers.get('X-GitHub-Delivery', '<no delivery>')
-        record.signature = request.headers.get('X-Hub-Signature', '<no signature>')
-        return super().format(record)
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        } # type: Dict[Text, Any]
+        for name in CONTEXT_FIELDS:
+            data[name] = getattr(record, name, None)
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class AsyncHandler(QueueHandler):
+    """only put records on a queue, a listener thread formats and writes them
+
+    a full queue drops the record instead of blocking the request.
+    the listener is restarted in a forked child, its thread did not survive.
+    """
+
+    def __init__(self,
+        handlers, # type: List[logging.Handler]
+        max_records=10000 # type: int
+        ):
+        # type: (...) -> None
+        self.handlers = handlers
+        self.max_records = max_records
+        self.dropped = 0
+        self._listener = None # type: Optional[QueueListener]
+        self._pid = None # type: Optional[int]
+        self._start_lock = threading.Lock()
+        super(AsyncHandler, self).__init__(queue.Queue(max_records))
+        self.addFilter(ContextFilter())
+        self._ensure_listener()
+        atexit.register(self.stop)
+
+    def _ensure_listener(self):
+        # type: () -> None
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # the parent's queue may hold records (and locks) of the parent
+            self.queue = queue.Queue(self.max_records)
+            self._listener = QueueListener(
+                self.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # unlike the stock QueueHandler, no formatting here: merge the
+        # arguments (they may change later) and leave the rest to the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
 
-def get_desired_handler():
-    """get the predifined logger handler"""
-    # find the logging file?
-    load_dotenv(find_dotenv())
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
-    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    default_log_dir = os.path.join(parent_dir, 'access_and_errors.log')
-    log_dir = os.environ.get('LOG_DIR', default_log_dir)
+    def stop(self):
+        # type: () -> None
+        """write out what is queued, e.g. at exit"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
 
-    default_max_bytes = 10000
-    max_bytes = int(os.environ.get('LOG_MAX_BYTES', default_max_bytes))
 
-    default_backup_count = 10
-    backup_count = int(os.environ.get('LOG_BACKUP_COUNT', default_backup_count))
+def get_desired_handler(config):
+    """get the predifined logger handler, as the LOG_* settings say"""
+    log_dir = config.log_dir
+    max_bytes = config.log_max_bytes
+    backup_count = config.log_backup_count
+    log_format = config.log_format
+    log_queue_size = config.log_queue_size
 
     rotating_file_handler = RotatingFileHandler(
         log_dir, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
 
     rotating_file_handler.setLevel(logging.INFO)
 
-    request_formatter = RequestFormatter(
-        u'[%(asctime)s] %(remote_addr)s requested %(url)s\n'
-        u'event: %(event)s\ndelivery: %(delivery)s\nsignature: %(signature)s\n'
-        u'%(levelname)s in %(module)s: %(message)s'
-    )
-    rotating_file_handler.setFormatter(request_formatter)
+    if log_format == 'json':
+        rotating_file_handler.setFormatter(JsonFormatter())
+    else:
+        request_formatter = RequestFormatter(
+            u'[%(asctime)s] %(remote_addr)s requested %(url)s\n'
+            u'event: %(event)s\ndelivery: %(delivery)s\nsignature: %(signature)s\n'
+            u'%(levelname)s in %(module)s: %(message)s'
+        )
+        rotating_file_handler.setFormatter(request_formatter)
 
-    return rotating_file_handler
+    async_handler = AsyncHandler(
+        [rotating_file_handler], max_records=log_queue_size)
+    async_handler.setLevel(logging.INFO)
+    return async_handler
@@ -0,0 +1,265 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+a very small prometheus text format exporter, no extra dependency
+
+recording is a dict lookup and an addition under a lock,
+everything else (gauges, formatting) happens when /metrics is scraped.
+"""
+from __future__ import unicode_literals, print_function
+from bisect import bisect_left
+from collections import OrderedDict
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Text, Tuple
+
+from . import tracing
+
+
+__all__ = [
+    'Counter', 'Gauge', 'Histogram', 'Registry', 'REGISTRY',
+    'counter', 'gauge', 'histogram', 'timed'
+]
+
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    # type: (Any) -> Text
+    return u'{}'.format(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    # type: (Tuple[Text, ...], Tuple[Any, ...], Iterable[Tuple[Text, Any]]) -> Text
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return u''
+    return u'{' + u','.join(
+        u'{}="{}"'.format(name, _escape(value)) for name, value in pairs) + u'}'
+
+
+def _number(value):
+    # type: (float) -> Text
+    if value == float('inf'):
+        return u'+Inf'
+    if float(value).is_integer():
+        return u'{}'.format(int(value))
+    return repr(float(value))
+
+
+class _Metric(object):
+    kind = u'untyped'
+
+    def __init__(self,
+        name, # type: Text
+        documentation, # type: Text
+        labels=() # type: Iterable[Text]
+        ):
+        # type: (...) -> None
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        # type: (Dict[Text, Any]) -> Tuple[Any, ...]
+        return tuple(labels.get(name, u'') for name in self.label_names)
+
+    def header(self):
+        # type: () -> List[Text]
+        return [
+            u'# HELP {} {}'.format(self.name, self.documentation),
+            u'# TYPE {} {}'.format(self.name, self.kind)
+        ]
+
+    def samples(self):
+        # type: () -> List[Text]
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = u'counter'
+
+    def __init__(self, *args, **kwargs):
+        super(Counter, self).__init__(*args, **kwargs)
+        self._values = {} # type: Dict[Tuple[Any, ...], float]
+
+    def inc(self, amount=1, **labels):
+        # type: (float, **Any) -> None
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        # type: (**Any) -> float
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            u'{}{} {}'.format(self.name, _labels(self.label_names, key), _number(value))
+            for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = u'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: counts per bucket (not cumulative), sum, count
+        self._values = {} # type: Dict[Tuple[Any, ...], List]
+
+    def observe(self, value, **labels):
+        # type: (float, **Any) -> None
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        # type: (**Any) -> _Timer
+        """`with histogram.time(...)` observes the duration of the block"""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(
+                (key, (list(entry[0]), entry[1], entry[2]))
+                for key, entry in self._values.items())
+        lines = [] # type: List[Text]
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(u'{}_bucket{} {}'.format(
+                    self.name,
+                    _labels(self.label_names, key, [('le', _number(bound))]),
+                    cumulative))
+            lines.append(u'{}_sum{} {}'.format(
+                self.name, _labels(self.label_names, key), repr(total)))
+            lines.append(u'{}_count{} {}'.format(
+                self.name, _labels(self.label_names, key), count))
+        return lines
+
+
+class _Timer(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.time() - self.started, **self.labels)
+        return False
+
+
+class Gauge(_Metric):
+    """read when scraped: `collect()` returns {label values: value}
+
+    `kind` may be 'counter' as well, for totals some object keeps anyway.
+    """
+
+    def __init__(self, name, documentation, collect, labels=(), kind=u'gauge'):
+        # type: (Text, Text, Callable[[], Dict[Tuple[Any, ...], float]], Iterable[Text], Text) -> None
+        super(Gauge, self).__init__(name, documentation, labels)
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self):
+        lines = [] # type: List[Text]
+        for key, value in sorted(self.collect().items()):
+            if value is None:
+                continue
+            lines.append(u'{}{} {}'.format(
+                self.name, _labels(self.label_names, key), _number(value)))
+        return lines
+
+
+class Registry(object):
+    def __init__(self):
+        # type: () -> None
+        self._lock = threading.Lock()
+        self._metrics = OrderedDict() # type: Dict[Text, _Metric]
+
+    def register(self, metric):
+        # type: (_Metric) -> _Metric
+        """add a metric, or return the one registered under its name already"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def unregister(self, name):
+        # type: (Text) -> None
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self):
+        # type: () -> Text
+        """everything, in the prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [] # type: List[Text]
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                # a broken gauge must not take the others down
+                continue
+            lines += metric.header() + samples
+        return u'\n'.join(lines) + u'\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labels=(), registry=REGISTRY):
+    # type: (Text, Text, Iterable[Text], Registry) -> Counter
+    return registry.register(Counter(name, documentation, labels)) # type: ignore
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+    # type: (Text, Text, Iterable[Text], Tuple[float, ...], Registry) -> Histogram
+    return registry.register(Histogram(name, documentation, labels, buckets)) # type: ignore
+
+
+def gauge(name, documentation, collect, labels=(), kind=u'gauge', registry=REGISTRY):
+    # type: (Text, Text, Callable[[], Dict[Tuple[Any, ...], float]], Iterable[Text], Text, Registry) -> Gauge
+    """a metric computed at scrape time; registering again replaces it"""
+    registry.unregister(name)
+    return registry.register(Gauge(name, documentation, collect, labels, kind)) # type: ignore
+
+
+REACTION_SECONDS = histogram(
+    'housekeeper_reaction_seconds',
+    'time spent in a single reaction', ['reaction'])
+
+
+def timed(func):
+    # type: (Callable) -> Callable
+    """observe every call of a reaction function in REACTION_SECONDS,
+    and add it to the trace of the run"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.time() - started
+            REACTION_SECONDS.observe(elapsed, reaction=name)
+            tracing.record(name, started, elapsed)
+    return wrapper
@@ -0,0 +1,318 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+check jupyter notebooks while they download
+
+a notebook is mostly base64 outputs. the json is read incrementally and
+the outputs, attachments and cell metadata are skipped byte by byte,
+only the sources of the cells are kept. the yaml meta is in the first
+cell, like the `---` block of a markdown post; the line rules run on the
+markdown cells, with line numbers inside the cell.
+"""
+from __future__ import unicode_literals, print_function
+from collections import namedtuple
+import json
+import re
+from typing import Iterable, Iterator, List, Optional, Text
+
+from . import rules
+
+
+__all__ = ['Cell', 'NotebookError', 'iter_cells', 'check_notebook', 'MAX_NOTEBOOK_BYTES']
+
+
+# we stop reading a notebook after this many bytes, however it is going
+MAX_NOTEBOOK_BYTES = 100 * 1024 * 1024
+
+# `index` is 1-based, like the cell numbers people see
+Cell = namedtuple('Cell', ['index', 'cell_type', 'source'])
+
+_WHITESPACE = re.compile(br'[ \t\r\n]*')
+_STRING_SPECIAL = re.compile(br'["\\]')
+_SCALAR_END = re.compile(br'[,\]}\s]')
+
+
+class NotebookError(ValueError):
+    """not json, or not the json of a notebook"""
+
+
+class _TooLarge(Exception):
+    """args: the limit that was hit"""
+
+
+class _Reader(object):
+    """just enough of an incremental json parser, over byte chunks"""
+
+    def __init__(self,
+        chunks, # type: Iterable[bytes]
+        max_bytes # type: int
+        ):
+        # type: (...) -> None
+        self._chunks = iter(chunks)
+        self.max_bytes = max_bytes
+        self.read = 0
+        self.buf = b''
+        self.pos = 0
+
+    def _more(self):
+        # type: () -> bool
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            self.read += len(chunk)
+            if self.read > self.max_bytes:
+                raise _TooLarge(self.max_bytes)
+            self.buf = self.buf[self.pos:] + chunk
+            self.pos = 0
+            return True
+        return False
+
+    def peek(self):
+        # type: () -> bytes
+        """the next significant byte, b'' at the end"""
+        while True:
+            matched = _WHITESPACE.match(self.buf, self.pos)
+            assert matched is not None # it matches the empty string too
+            self.pos = matched.end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos:self.pos + 1]
+            if not self._more():
+                return b''
+
+    def expect(self, char):
+        # type: (bytes) -> None
+        found = self.peek()
+        if found != char:
+            raise NotebookError(u'expected {!r}, found {!r} at byte {}'.format(
+                char.decode('ascii'), found.decode('utf-8', 'replace'),
+                self.read - len(self.buf) + self.pos))
+        self.pos += 1
+
+    def comma_or(self, end):
+        # type: (bytes) -> bool
+        """True after a comma, False at the end of the container"""
+        found = self.peek()
+        if found == b',':
+            self.pos += 1
+            return True
+        self.expect(end)
+        return False
+
+    def string(self, limit=None):
+        # type: (Optional[int]) -> Optional[Text]
+        """the next string, None (and skipped) if longer than `limit` bytes"""
+        self.expect(b'"')
+        kept = [] # type: List[bytes]
+        size = 0
+        while True:
+            matched = _STRING_SPECIAL.search(self.buf, self.pos)
+            end = matched.start() if matched else len(self.buf)
+            if limit is None or size + end - self.pos <= limit:
+                kept.append(self.buf[self.pos:end])
+            size += end - self.pos
+            self.pos = end
+            if matched is None:
+                if not self._more():
+                    raise NotebookError(u'unterminated string')
+                continue
+            if self.buf[self.pos:self.pos + 1] == b'"':
+                self.pos += 1
+                break
+            # an escape, the escaped byte goes with it
+            while len(self.buf) < self.pos + 2:
+                if not self._more():
+                    raise NotebookError(u'unterminated string')
+            if limit is None or size + 2 <= limit:
+                kept.append(self.buf[self.pos:self.pos + 2])
+            size += 2
+            self.pos += 2
+        if limit is not None and size > limit:
+            return None
+        try:
+            return json.loads(b'"' + b''.join(kept) + b'"')
+        except ValueError as e:
+            raise NotebookError(u'{}'.format(e))
+
+    def skip(self):
+        # type: () -> None
+        """skip a value of any size, nothing of it is kept"""
+        found = self.peek()
+        if found == b'"':
+            self.string(limit=0)
+        elif found in (b'{', b'['):
+            end = b'}' if found == b'{' else b']'
+            self.pos += 1
+            if self.peek() == end:
+                self.pos += 1
+                return
+            while True:
+                if found == b'{':
+                    self.string()
+                    self.expect(b':')
+                self.skip()
+                if not self.comma_or(end):
+                    return
+        elif found:
+            # a number, true, false or null
+            while True:
+                matched = _SCALAR_END.search(self.buf, self.pos)
+                if matched is not None:
+                    self.pos = matched.start()
+                    return
+                self.pos = len(self.buf)
+                if not self._more():
+                    return
+        else:
+            raise NotebookError(u'unexpected end')
+
+    def members(self):
+        # type: () -> Iterator[Text]
+        """the keys of an object; read or skip each value before the next"""
+        self.expect(b'{')
+        if self.peek() == b'}':
+            self.pos += 1
+            return
+        while True:
+            key = self.string()
+            assert key is not None # only strings over a limit are None
+            self.expect(b':')
+            yield key
+            if not self.comma_or(b'}'):
+                return
+
+    def items(self):
+        # type: () -> Iterator[None]
+        """step through an array; read or skip each item before the next"""
+        self.expect(b'[')
+        if self.peek() == b']':
+            self.pos += 1
+            return
+        while True:
+            yield None
+            if not self.comma_or(b']'):
+                return
+
+
+def _source(
+    reader, # type: _Reader
+    limit # type: int
+    ):
+    # type: (...) -> Optional[Text]
+    """a cell source, a string or a list of lines; None if over `limit` bytes"""
+    if reader.peek() != b'[':
+        return reader.string(limit)
+    parts = [] # type: List[Text]
+    size = 0
+    too_large = False
+    for _ in reader.items():
+        if too_large:
+            reader.skip()
+            continue
+        part = reader.string(limit - size)
+        if part is None:
+            too_large = True
+            continue
+        parts.append(part)
+        size += len(part.encode('utf-8'))
+    return None if too_large else u''.join(parts)
+
+
+def iter_cells(
+    chunks, # type: Iterable[bytes]
+    max_text_bytes, # type: int
+    max_bytes=MAX_NOTEBOOK_BYTES # type: int
+    ):
+    # type: (...) -> Iterator[Cell]
+    """the cells of a nbformat 4 notebook, as the bytes come in
+
+    code cells come without their source. raise NotebookError for what is
+    not a notebook, and `_TooLarge` once the sources kept add up to more
+    than `max_text_bytes`, or the notebook to more than `max_bytes`.
+    """
+    reader = _Reader(chunks, max_bytes)
+    found_cells = False
+    kept = 0
+    for key in reader.members():
+        if key != u'cells':
+            reader.skip()
+            continue
+        found_cells = True
+        for index, _ in enumerate(reader.items(), 1):
+            cell_type = None # type: Optional[Text]
+            source = None # type: Optional[Text]
+            for cell_key in reader.members():
+                if cell_key == u'cell_type':
+                    cell_type = reader.string(100)
+                elif cell_key == u'source' and cell_type != u'code':
+                    source = _source(reader, max_text_bytes - kept)
+                    if source is None:
+                        raise _TooLarge(max_text_bytes)
+                else:
+                    reader.skip()
+            if cell_type == u'code':
+                source = None
+            elif source is not None:
+                kept += len(source.encode('utf-8'))
+            yield Cell(index, cell_type, source)
+    if not found_cells:
+        raise NotebookError(u'no cells, not a nbformat 4 notebook')
+    if reader.peek():
+        raise NotebookError(u'extra data after the notebook')
+
+
+def check_notebook(
+    chunks, # type: Iterable[bytes]
+    max_text_bytes, # type: int
+    max_front_matter_bytes=rules.MAX_FRONT_MATTER_BYTES, # type: int
+    options=rules.DEFAULT_OPTIONS # type: rules.Options
+    ):
+    # type: (...) -> List[rules.Finding]
+    """the content findings of a notebook, like `rules.check_text`
+
+    the yaml meta is the first cell; line findings carry their cell.
+    """
+    findings = [] # type: List[rules.Finding]
+    body_lines = 0
+    try:
+        cells = iter_cells(chunks, max_text_bytes)
+        first = next(cells, None)
+        if first is None:
+            return [rules.structural_finding('content-empty')]
+        head = first.source or u''
+        if not rules.META_DELIMETER_PATTERN.match(head):
+            return [rules.structural_finding('yaml-missing')]
+        body_start, yaml_text, body_offset = rules.scan_front_matter(
+            head, max_front_matter_bytes)
+        if not body_start:
+            if len(head) > max_front_matter_bytes:
+                return [rules.structural_finding(
+                    'yaml-too-large', max_bytes=max_front_matter_bytes)]
+            return [rules.structural_finding('yaml-delimiter')]
+        findings += rules.check_meta(yaml_text, options)
+
+        def check_lines(cell, text, line_no):
+            # type: (Cell, Text, int) -> int
+            """the line rules, on a markdown cell; the count of lines"""
+            count = 0
+            for line in text.split(u'\n'):
+                line_no += 1
+                count += bool(line.strip())
+                findings.extend(
+                    x._replace(cell=cell.index) for x in rules.check_line(line, line_no))
+            return count
+
+        if body_offset is not None:
+            body_lines += check_lines(first, head[body_offset:], body_start)
+        for cell in cells:
+            if cell.cell_type == u'markdown' and cell.source:
+                body_lines += check_lines(cell, cell.source, 0)
+            elif cell.cell_type == u'code':
+                body_lines += 1
+    except _TooLarge as e:
+        return [rules.file_too_large(e.args[0])]
+    except NotebookError as e:
+        return [rules.structural_finding('notebook-invalid', error=u'{}'.format(e))]
+    if not body_lines:
+        # only the yaml meta, no article body???
+        return [rules.structural_finding('yaml-delimiter')]
+    return findings
@@ -0,0 +1,100 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+read, verify and slim down webhook bodies
+
+the body is read once from the input stream, in chunks, feeding the
+signature HMAC along the way; it is never held by flask a second time.
+"""
+from __future__ import unicode_literals, print_function
+from hashlib import sha1
+import hmac
+from typing import Any, BinaryIO, Dict, Optional, Text, Tuple, Union
+
+
+__all__ = ['PayloadTooLarge', 'read_body', 'project', 'PAYLOAD_FIELDS']
+
+
+# what the reactions read, `True` keeps the whole value
+PAYLOAD_FIELDS = {
+    'action': True,
+    'before': True,
+    'after': True,
+    'sender': {'login': True},
+    'repository': {'full_name': True},
+    'pull_request': {
+        'url': True,
+        'user': {'login': True},
+        'author_association': True,
+        'base': {'ref': True},
+        'head': {'sha': True}
+    },
+    'issue': {
+        'url': True,
+        'body': True,
+        'user': {'login': True},
+        'author_association': True,
+        'pull_request': {'url': True}
+    },
+    'comment': {
+        'body': True,
+        'user': {'login': True}
+    },
+    'changes': {'body': True}
+} # type: Dict[Text, Any]
+
+
+class PayloadTooLarge(Exception):
+    """the body is over the configured maximum size"""
+
+
+def read_body(
+    stream, # type: BinaryIO
+    max_bytes, # type: int
+    secret_key=None, # type: Optional[Union[Text, bytes]]
+    chunk_size=64 * 1024 # type: int
+    ):
+    # type: (...) -> Tuple[bytes, Optional[Text]]
+    """the body and its `sha1=` signature (None without a secret)
+
+    raise PayloadTooLarge as soon as more than `max_bytes` came in.
+    """
+    digest = None
+    if secret_key:
+        if isinstance(secret_key, bytes):
+            secret_key_bytes = secret_key
+        else:
+            secret_key_bytes = secret_key.encode('utf-8')
+        digest = hmac.new(secret_key_bytes, digestmod=sha1)
+    body = bytearray()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if len(body) + len(chunk) > max_bytes:
+            raise PayloadTooLarge(
+                u'body is larger than {} bytes'.format(max_bytes))
+        if digest is not None:
+            digest.update(chunk)
+        body.extend(chunk)
+    signature = u'sha1=' + digest.hexdigest() if digest is not None else None
+    return bytes(body), signature
+
+
+def project(
+    payload, # type: Any
+    fields=PAYLOAD_FIELDS # type: Dict[Text, Any]
+    ):
+    # type: (...) -> Any
+    """only the `fields` of the payload, missing ones stay missing"""
+    if not isinstance(payload, dict):
+        return payload
+    projected = {} # type: Dict[Text, Any]
+    for name, sub_fields in fields.items():
+        if name not in payload:
+            continue
+        if sub_fields is True:
+            projected[name] = payload[name]
+        else:
+            projected[name] = project(payload[name], sub_fields)
+    return projected
@@ -0,0 +1,147 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+cProfile dumps of some webhook requests, and of the jobs they queue
+
+a request is profiled when it is sampled (`PROFILE_SAMPLE_RATE`), or when
+it carries `X-Housekeeper-Profile: sha1=<hmac of the delivery id>` signed
+with `PROFILE_SECRET`. the dumps go to `PROFILE_DIR`, only the newest
+`PROFILE_MAX_FILES` are kept; read them with `python -m pstats`.
+"""
+from __future__ import unicode_literals, print_function
+from contextlib import contextmanager
+from hashlib import sha1
+import hmac
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import Iterator, Mapping, Optional, Set, Text
+
+from .utils import signature_matches
+
+
+__all__ = ['Profiler', 'PROFILE_HEADER']
+
+
+PROFILE_HEADER = 'X-Housekeeper-Profile'
+_UNSAFE = re.compile(r'[^\w.-]')
+
+
+class Profiler(object):
+    """decide what to profile, profile it, and rotate the dumps"""
+
+    def __init__(self,
+        directory, # type: Text
+        sample_rate=0.0, # type: float
+        secret=None, # type: Optional[Text]
+        max_files=50, # type: int
+        logger=None # type: Optional[logging.Logger]
+        ):
+        # type: (...) -> None
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.max_files = max_files
+        self.logger = logger or logging.getLogger(__name__)
+        self.dumps = 0
+        # a profiler hooks the interpreter, one at a time is plenty
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        # deliveries whose queued job is to be profiled too
+        self._marked = set() # type: Set[Text]
+
+    @property
+    def enabled(self):
+        # type: () -> bool
+        return self.sample_rate > 0 or bool(self.secret)
+
+    def sign(self, delivery):
+        # type: (Text) -> Text
+        """the header value that asks to profile this delivery"""
+        assert self.secret, 'no PROFILE_SECRET to sign with'
+        return u'sha1=' + hmac.new(
+            self.secret.encode('utf-8'), delivery.encode('utf-8'), sha1).hexdigest()
+
+    def wanted(self,
+        headers, # type: Mapping[Text, Text]
+        delivery=None # type: Optional[Text]
+        ):
+        # type: (...) -> bool
+        if not self.enabled:
+            return False
+        asked = headers.get(PROFILE_HEADER)
+        if asked and self.secret and delivery:
+            if signature_matches(asked, self.sign(delivery)):
+                return True
+            self.logger.warning(u'wrong {} header, ignore it'.format(PROFILE_HEADER))
+        return random.random() < self.sample_rate
+
+    def mark(self, delivery):
+        # type: (Optional[Text]) -> None
+        """profile the job of this delivery too, if this process runs it"""
+        if delivery:
+            with self._lock:
+                if len(self._marked) >= 1000:
+                    # rejected or run elsewhere, never taken
+                    self._marked.clear()
+                self._marked.add(delivery)
+
+    def take(self, delivery):
+        # type: (Optional[Text]) -> bool
+        with self._lock:
+            if delivery in self._marked:
+                self._marked.discard(delivery)
+                return True
+            return False
+
+    @contextmanager
+    def profile(self, name):
+        # type: (Text) -> Iterator[None]
+        """run the block under cProfile, the dump is named after `name`"""
+        if not self._busy.acquire(False):
+            # another thread is being profiled, this one runs as usual
+            self.logger.info(u'profiler is busy, skip {}'.format(name))
+            yield
+            return
+        try:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # some other profiler is active already
+                self.logger.warning(u'cannot profile {}: {}'.format(name, e))
+                yield
+                return
+            try:
+                yield
+            finally:
+                profiler.disable()
+                self._dump(profiler, name)
+        finally:
+            self._busy.release()
+
+    def _dump(self, profiler, name):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            path = os.path.join(self.directory, u'{}-{}.prof'.format(
+                time.strftime('%Y%m%dT%H%M%S'), _UNSAFE.sub(u'_', name)[:100]))
+            profiler.dump_stats(path)
+            self.dumps += 1
+            self.logger.info(u'profile is written to {}'.format(path))
+            self._rotate()
+        except (IOError, OSError) as e:
+            self.logger.error(u'cannot write profile {}: {}'.format(name, e))
+
+    def _rotate(self):
+        # type: () -> None
+        dumps = sorted(
+            (os.path.join(self.directory, x) for x in os.listdir(self.directory)
+             if x.endswith('.prof')),
+            key=os.path.getmtime)
+        for path in dumps[:max(0, len(dumps) - self.max_files)]:
+            os.remove(path)
@@ -0,0 +1,339 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Text, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics, resilience, tracing
+
+
+__all__ = [
+    'HIGH', 'LOW', 'RateLimited', 'RateLimitBudget',
+    'ConditionalCache', 'ConditionalAdapter'
+]
+
+
+# article checks are what the bot is for, greetings and chit-chat can wait
+HIGH = u'high'
+LOW = u'low'
+
+API_REQUESTS = metrics.counter(
+    'housekeeper_github_requests_total',
+    'github api requests, 304 means answered from the etag cache',
+    ['method', 'endpoint', 'status'])
+API_RETRIES = metrics.counter(
+    'housekeeper_github_retries_total',
+    'github api reads sent again after a 5xx or a connection error',
+    ['method', 'endpoint'])
+API_BYTES = metrics.counter(
+    'housekeeper_github_response_bytes_total',
+    'github api response body bytes, as sent over the wire',
+    ['method', 'endpoint'])
+
+# answers worth another try of an idempotent read, github having a bad moment
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+
+# segments after which the rest of the path is data, not the endpoint
+_OPAQUE_TAILS = {'contents': u'{path}', 'compare': u'{range}'}
+
+
+def api_endpoint(url):
+    # type: (Text) -> Text
+    """the url as a low cardinality endpoint, e.g. /repos/{owner}/{repo}/pulls/{n}"""
+    parts = requests.utils.urlparse(url).path.strip('/').split('/')
+    endpoint = [] # type: List[Text]
+    for idx, part in enumerate(parts):
+        if idx in (1, 2) and parts[0] == 'repos':
+            part = u'{owner}' if idx == 1 else u'{repo}'
+        elif part.isdigit():
+            part = u'{n}'
+        endpoint.append(part)
+        if part in _OPAQUE_TAILS and idx + 1 < len(parts):
+            endpoint.append(_OPAQUE_TAILS[part])
+            break
+    return u'/' + u'/'.join(endpoint)
+
+
+class RateLimited(Exception):
+    """not enough api budget left, try again at `retry_at`"""
+
+    def __init__(self, retry_at):
+        # type: (float) -> None
+        super(RateLimited, self).__init__(
+            u'rate limit budget exhausted until {}'.format(retry_at))
+        self.retry_at = retry_at
+
+
+class RateLimitBudget(object):
+    """what github told us about our hourly rate limit
+
+    updated from the `X-RateLimit-*` headers of every response.
+    low priority work leaves the last `reserve` calls to high priority work.
+    """
+
+    def __init__(self,
+        reserve=500 # type: int
+        ):
+        # type: (...) -> None
+        self.reserve = reserve
+        self.limit = None # type: Optional[int]
+        self.remaining = None # type: Optional[int]
+        self.reset_at = 0.0
+        self._lock = threading.Lock()
+
+    def update(self,
+        headers # type: Mapping[Text, Text]
+        ):
+        # type: (...) -> None
+        if headers.get('X-RateLimit-Resource', u'core') != u'core':
+            # graphql and search have limits of their own
+            return
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset_at = headers.get('X-RateLimit-Reset')
+        if remaining is None or reset_at is None:
+            return
+        with self._lock:
+            self.remaining = int(remaining)
+            self.reset_at = float(reset_at)
+            if headers.get('X-RateLimit-Limit') is not None:
+                self.limit = int(headers['X-RateLimit-Limit'])
+
+    def delay(self,
+        priority=HIGH, # type: Text
+        now=None # type: Optional[float]
+        ):
+        # type: (...) -> float
+        """seconds to wait before work of this priority may spend calls"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if self.remaining is None or now >= self.reset_at:
+                # unknown yet, or a fresh window has started
+                return 0.0
+            keep = self.reserve if priority == LOW else 0
+            if self.remaining > keep:
+                return 0.0
+            return self.reset_at - now
+
+    def ensure(self,
+        priority=HIGH # type: Text
+        ):
+        # type: (...) -> None
+        """raise RateLimited if work of this priority has to wait"""
+        delay = self.delay(priority)
+        if delay > 0:
+            raise RateLimited(time.time() + delay)
+
+    def stats(self):
+        # type: () -> Dict[Text, Any]
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'remaining': self.remaining,
+                'reset_at': self.reset_at
+            }
+
+
+class ConditionalCache(object):
+    """last seen body and etag of GET responses, least recently used first out
+
+    a `304 Not Modified` answer to `If-None-Match` costs no rate limit
+    and carries no body, so we replay the stored one instead.
+    """
+
+    def __init__(self,
+        max_bytes=10 * 1024 * 1024 # type: int
+        ):
+        # type: (...) -> None
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        # (url, accept) -> (etag, status, headers, body)
+        self._entries = OrderedDict() # type: OrderedDict
+
+    def get(self, key):
+        # type: (Tuple[Text, Text]) -> Optional[Tuple[Text, int, Dict, bytes]]
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry # most recently used again
+            return entry
+
+    def count(self, hit):
+        # type: (bool) -> None
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self,
+        key, # type: Tuple[Text, Text]
+        etag, # type: Text
+        response # type: requests.Response
+        ):
+        # type: (...) -> None
+        body = response.content
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (
+                etag, response.status_code, dict(response.headers), body)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[3])
+
+    def stats(self):
+        # type: () -> Dict[Text, Any]
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / total if total else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._size
+            }
+
+
+class ConditionalAdapter(HTTPAdapter):
+    """transport adapter doing conditional GETs and tracking the rate limit
+
+    reads that fail with a 5xx or a connection error are sent again, up to
+    `retries` times; every call counts for the circuit `breaker`.
+    """
+
+    def __init__(self,
+        budget, # type: RateLimitBudget
+        cache=None, # type: Optional[ConditionalCache]
+        retries=2, # type: int
+        retry_backoff=0.5, # type: float
+        breaker=None, # type: Optional[resilience.CircuitBreaker]
+        *args,
+        **kwargs
+        ):
+        # type: (...) -> None
+        super(ConditionalAdapter, self).__init__(*args, **kwargs)
+        self.budget = budget
+        self.cache = cache
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.breaker = breaker
+
+    def send(self, request, stream=False, timeout=None, *args, **kwargs):
+        # streamed bodies (raw article contents) are read lazily, never cached
+        cacheable = (
+            self.cache is not None and request.method == 'GET' and not stream)
+        key = (request.url, request.headers.get('Accept', u''))
+        cached = self.cache.get(key) if cacheable else None
+        if cached is not None:
+            request.headers['If-None-Match'] = cached[0]
+
+        endpoint = api_endpoint(request.url)
+        # graphql only gets queries from us, they are reads too
+        idempotent = request.method in ('GET', 'HEAD') or endpoint == u'/graphql'
+        what = u'{} {}'.format(request.method, endpoint)
+        attempt = 0
+        while True:
+            try:
+                response = self._send_once(
+                    request, endpoint, stream, resilience.clamp(timeout, what),
+                    *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                delay = self._retry_delay(idempotent, attempt)
+                if delay is None:
+                    # a timeout cut short by the deadline is the deadline's fault
+                    resilience.check(what)
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                delay = self._retry_delay(idempotent, attempt)
+                if delay is None:
+                    break
+                response.close()
+            API_RETRIES.inc(method=request.method, endpoint=endpoint)
+            time.sleep(delay)
+            attempt += 1
+
+        if not cacheable:
+            return response
+        if response.status_code == 304 and cached is not None:
+            self.cache.count(True)
+            return self._replay(cached, response)
+        self.cache.count(False)
+        etag = response.headers.get('ETag')
+        if response.status_code == 200 and etag:
+            self.cache.put(key, etag, response)
+        return response
+
+    def _send_once(self, request, endpoint, stream, timeout, *args, **kwargs):
+        started = time.time()
+        try:
+            response = super(ConditionalAdapter, self).send(
+                request, stream, timeout, *args, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            API_REQUESTS.inc(method=request.method, endpoint=endpoint, status='error')
+            if self.breaker is not None:
+                self.breaker.record(False)
+            raise
+        self.budget.update(response.headers)
+        if self.breaker is not None:
+            self.breaker.record(response.status_code not in RETRY_STATUSES)
+        # until the headers are in, a streamed body is read by the caller
+        tracing.record(
+            u'{} {}'.format(request.method, endpoint), started, time.time() - started)
+        API_REQUESTS.inc(
+            method=request.method, endpoint=endpoint, status=response.status_code)
+        # never touch a streamed body here, the reader may stop early
+        size = response.headers.get('Content-Length')
+        if size is None and not stream:
+            size = len(response.content)
+        if size is not None:
+            API_BYTES.inc(int(size), method=request.method, endpoint=endpoint)
+        return response
+
+    def _retry_delay(self, idempotent, attempt):
+        # type: (bool, int) -> Optional[float]
+        """how long to wait before the next try, None for no more tries"""
+        if not idempotent or attempt >= self.retries:
+            return None
+        delay = resilience.backoff(attempt, self.retry_backoff)
+        left = resilience.remaining()
+        if left is not None and delay >= left:
+            # the deadline would pass while we wait
+            return None
+        return delay
+
+    def _replay(self,
+        cached, # type: Tuple[Text, int, Dict, bytes]
+        not_modified # type: requests.Response
+        ):
+        # type: (...) -> requests.Response
+        _, status, headers, body = cached
+        response = requests.Response()
+        response.status_code = status
+        response.reason = 'OK'
+        response.headers.update(headers)
+        # fresh rate limit numbers and such
+        response.headers.update(not_modified.headers)
+        response.headers.pop('Content-Length', None)
+        response._content = body
+        response.encoding = not_modified.encoding or 'utf-8'
+        response.url = not_modified.url
+        response.request = not_modified.request
+        response.connection = not_modified.connection
+        response.elapsed = not_modified.elapsed
+        return response
@@ -2,34 +2,118 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 from collections import OrderedDict
-import os
+from concurrent.futures import ThreadPoolExecutor
+import json
 import re
-from typing import Any, Dict, List, Text
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Text, Tuple
 import logging
 
 import github3
-import yaml
+import requests
+from unidiff import PatchSet, PatchedFile
+from unidiff.errors import UnidiffParseError
 
+from . import graphql, metrics, notebook, resilience, rules, tracing
+from .git_mirror import GitError, GitMirror
+from .check_cache import ArticleCheckCache
+from .clients import default_registry
+from .commands import (
+    MAX_COMMANDS, MENTION, HANDLERS, Command, IssueRateLimiter, command,
+    default_limiter, matcher_for)
+from .comments import CommentBuffer, CommentCoalescer, default_coalescer
+from .ratelimit import HIGH, LOW, RateLimitBudget, RateLimited
+from .repo_config import REACTIONS, RepoSettings, rule_options
 from .utils import extract_info_from_url
 
 
 __all__ = ['Reaction']  # only expose a few api
 
+# bump this whenever the rules change their verdicts,
+# cached results of older versions are then simply never hit again
+CHECKER_VERSION = u'5'
+
+
+def _checker_version(options):
+    # type: (rules.Options) -> Text
+    """results under other rule options are kept apart, in the cache too"""
+    fingerprint = rules.options_fingerprint(options)
+    return CHECKER_VERSION + u'-' + fingerprint if fingerprint else CHECKER_VERSION
+
+# our article check comment carries its findings in a hidden html comment,
+# so that later pushes can update it instead of starting from scratch
+ARTICLE_CHECK_MARKER = u'<!-- housekeeper:article-check'
+ARTICLE_CHECK_STATE_PATTERN = re.compile(
+    re.escape(ARTICLE_CHECK_MARKER) + r' (.*?) -->', re.DOTALL)
+
+REACTION_RUNS = metrics.counter(
+    'housekeeper_reaction_runs_total',
+    'events run by Reaction.run, by result status', ['event', 'status'])
+COMMAND_RUNS = metrics.counter(
+    'housekeeper_commands_total',
+    'commands asked for by mentioning the bot, by status', ['command', 'status'])
+
+# sections of the one comment we keep on every pull request
+GREETING_SECTION = u'greeting'
+ARTICLE_CHECK_SECTION = u'article-check'
+
 
 class Reaction(object):
     def __init__(self,
         user, # type: Text
         password, # type: Text
         logger, # type: logging.Logger
-        posts_location=u'content/post/' # type: Text
+        posts_location=u'content/post/', # type: Text
+        client=None, # type: Optional[github3.github.GitHub]
+        fetch_workers=4, # type: int
+        max_article_bytes=1000000, # type: int
+        check_cache=None, # type: Optional[ArticleCheckCache]
+        max_front_matter_bytes=rules.MAX_FRONT_MATTER_BYTES, # type: int
+        rate_limit=None, # type: Optional[RateLimitBudget]
+        coalescer=None, # type: Optional[CommentCoalescer]
+        settings=None, # type: Optional[RepoSettings]
+        backend=u'rest', # type: Text
+        git_mirror=None, # type: Optional[GitMirror]
+        aliases=(), # type: Tuple[Text, ...]
+        command_limiter=None, # type: Optional[IssueRateLimiter]
+        trace_min_seconds=1.0, # type: float
+        deadline=0.0, # type: float
+        breaker=None # type: Optional[resilience.CircuitBreaker]
         ):
         # type: (...) -> None
         self.user = user
         self.password = password
         self.logger = logger
         self.posts_location = posts_location
+        self.options = rules.DEFAULT_OPTIONS # type: rules.Options
+        self.reactions = frozenset(REACTIONS)
+        if settings is not None:
+            # the repository decides, see repo_config
+            self.posts_location = settings.posts_location
+            self.options = rule_options(settings)
+            self.reactions = settings.reactions
+        self.fetch_workers = fetch_workers
+        self.max_article_bytes = max_article_bytes
+        self.check_cache = check_cache
+        self.max_front_matter_bytes = max_front_matter_bytes
+        self.backend = backend
+        self.git_mirror = git_mirror
+        # the login is always an alias, the others are for renamed bots
+        self.matcher = matcher_for((user,) + tuple(aliases))
+        self.command_limiter = command_limiter or default_limiter
+        self.trace_min_seconds = trace_min_seconds
+        self.deadline = deadline # seconds per event, 0 for no limit
 
-        self.client = github3.login(user, password) # type: github3.github.GitHub
+        if client is None:
+            # reuse the shared, pooled client instead of logging in again
+            client = default_registry.get(user, password)
+            if rate_limit is None:
+                rate_limit = default_registry.budget(user, password)
+            if breaker is None:
+                breaker = default_registry.breaker
+        self.client = client # type: github3.github.GitHub
+        self.rate_limit = rate_limit
+        self.breaker = breaker
+        self.coalescer = coalescer or default_coalescer
 
     def run(self,
             event, # type: Text
@@ -39,25 +123,61 @@ class Reaction(object):
             ):
         # (...) -> Dict
         """dispatch event to its real "runner" and run"""
+        name = u'{} {}'.format(event, payload.get('action') or u'').strip()
+        with tracing.trace(name, self.logger, self.trace_min_seconds), \
+                resilience.deadline(self.deadline):
+            res = self._run(event, payload, *args, **kwargs)
+        REACTION_RUNS.inc(event=event, status=res['status'])
+        return res
+
+    def _run(self,
+            event, # type: Text
+            payload, # type: Dict
+            *args,
+            **kwargs
+            ):
+        # (...) -> Dict
         # python magic, directly call attribute by convention
         # convention: runner == '_' + event
-        try:
-            runner = getattr(self, '_{}'.format(event))
-            if callable(runner):
-                runner(event, payload, *args, **kwargs)
-        except AttributeError:
+        runner = getattr(self, '_{}'.format(event), None)
+        if not callable(runner):
             self.logger.info(u'event {} not implemented'.format(event))
             return {
                 'event': event,
                 'data': u'runner for "{}" is not implemented.'.format(event),
                 'status': 'ok'
             }
-        except:
+        # every reaction of the event writes into this, we write it out once
+        comments = CommentBuffer(
+            self.client, self.user, self.logger,
+            legacy_sections={ARTICLE_CHECK_SECTION: ARTICLE_CHECK_MARKER})
+        try:
+            runner(event, payload, comments, *args, **kwargs)
+            self.coalescer.submit(comments)
+        except RateLimited as err:
+            self.logger.warning(u'event {} is deferred: {}'.format(event, err))
+            return {
+                'event': event,
+                'data': u'"{}" has to wait for the rate limit'.format(event),
+                'status': 'deferred',
+                'retry_at': err.retry_at
+            }
+        except resilience.DeadlineExceeded as err:
+            self.logger.error(u'event {} ran out of time: {}'.format(event, err))
+            return {
+                'event': event,
+                'data': u'"{}" took longer than {}s'.format(event, self.deadline),
+                'status': 'error',
+                'error': u'{}: {}'.format(type(err).__name__, err)
+            }
+        except Exception as err:
             self.logger.exception(u'event {} has an exception'.format(event))
             return {
                 'event': event,
                 'data': u'something goes wrong with "{}"'.format(event),
-                'status': 'error'
+                'status': 'error',
+                # for the dead letters, not for the response
+                'error': u'{}: {}'.format(type(err).__name__, err)
             }
         self.logger.info(u'event {} is ok'.format(event))
         return {
@@ -69,22 +189,54 @@ class Reaction(object):
     def _pull_request(
         self,
         event, # type: Text
-        payload # type: Dict
+        payload, # type: Dict
+        comments # type: CommentBuffer
         ):
         # guard: we don't react for self activity
         person = payload['sender']['login'] # type: Text
         if person == self.user:
             return
 
+        # the reactions below only handle these, e.g. `labeled` costs nothing
+        if payload.get('action') not in ('opened', 'synchronize'):
+            return
+
+        # nothing is done yet, so the whole event can wait if we are out of calls
+        if self.rate_limit is not None:
+            self.rate_limit.ensure(HIGH)
+
         # do something
-        greeting_for_first_time_contributor(event, payload, self.logger, self.client)
-        check_article_submission(
-            event, payload, self.logger, self.client, self.posts_location)
+        if u'greeting' in self.reactions:
+            greeting_for_first_time_contributor(
+                event, payload, self.logger, comments, budget=self.rate_limit,
+                breaker=self.breaker)
+        if u'article-check' in self.reactions:
+            check_article_submission(
+                event, payload, self.logger, self.client, comments,
+                self.posts_location,
+                fetch_workers=self.fetch_workers,
+                max_article_bytes=self.max_article_bytes,
+                cache=self.check_cache,
+                max_front_matter_bytes=self.max_front_matter_bytes,
+                options=self.options,
+                backend=self.backend,
+                git_mirror=self.git_mirror)
+            recheck_article_submission(
+                event, payload, self.logger, self.client, comments,
+                self.posts_location,
+                fetch_workers=self.fetch_workers,
+                max_article_bytes=self.max_article_bytes,
+                cache=self.check_cache,
+                max_front_matter_bytes=self.max_front_matter_bytes,
+                options=self.options,
+                backend=self.backend,
+                git_mirror=self.git_mirror)
 
     def _issues(
         self,
         event, # type: Text
-        payload # type: Dict
+        payload, # type: Dict
+        comments # type: CommentBuffer
         ):
         # guard: we don't react for self activity
         person = payload['sender']['login'] # type: Text
@@ -92,13 +244,14 @@ class Reaction(object):
             return
 
         # do something
-        say_something_if_mentioned(
-            event, payload, self.logger, self.client, self.user)
+        if u'mentions' in self.reactions:
+            answer_mentions(event, payload, self, comments)
 
     def _issue_comment(
         self,
         event, # type: Text
-        payload # type: Dict
+        payload, # type: Dict
+        comments # type: CommentBuffer
         ):
         # guard: we don't react for self activity
         person = payload['comment']['user']['login'] # type: Text
@@ -106,19 +259,22 @@ class Reaction(object):
             return
 
         # do something
-        say_something_if_mentioned(
-            event, payload, self.logger, self.client, self.user)
+        if u'mentions' in self.reactions:
+            answer_mentions(event, payload, self, comments)
 
 
 ################################################
 # lots of reactions below
 ################################################
 
+@metrics.timed
 def greeting_for_first_time_contributor(
     event, # type: Text
     payload, # type: Dict
     logger, # type: logging.Logger
-    client, # type: github3.github.GitHub
+    comments, # type: CommentBuffer
+    budget=None, # type: Optional[RateLimitBudget]
+    breaker=None, # type: Optional[resilience.CircuitBreaker]
     *args,
     **kwargs
     ):
@@ -130,26 +286,46 @@ def greeting_for_first_time_contributor(
         payload['pull_request']['author_association'] == 'NONE'):
         return False
 
+    if budget is not None and budget.delay(LOW) > 0:
+        # the article check must not starve for a greeting,
+        # and the event cannot be deferred without checking twice
+        logger.info('rate limit budget is low, skip greeting')
+        return False
+    if breaker is not None and breaker.degraded():
+        # every call we save is one more for the article check
+        logger.info('github keeps failing, skip greeting')
+        return False
+
     url_info = extract_info_from_url(payload['pull_request']['url'])
     person = payload['pull_request']['user']['login'] # type: Text
 
-    # say hi, post comment on this issue
-    issue = client.issue(
-        url_info['owner'], url_info['repo'], url_info['number'])
-    issue.create_comment(
-        u'@{}\n'
-        u"Hi, it seems that you're the first time contributor, welcome!\n"
-        u'你好，你似乎是第一次投稿，非常欢迎！'
-    ).format(person)
+    # say hi, on top of our comment on this issue
+    comments.set_section(
+        (url_info['owner'], url_info['repo'], url_info['number']),
+        GREETING_SECTION,
+        (
+            u'@{}\n'
+            u"Hi, it seems that you're the first time contributor, welcome!\n"
+            u'你好，你似乎是第一次投稿，非常欢迎！'
+        ).format(person))
     return True
 
 
+@metrics.timed
 def check_article_submission(
     event, # type: Text
     payload, # type: Dict
     logger, # type: logging.Logger
     client, # type: github3.github.GitHub
+    comments, # type: CommentBuffer
     posts_location = u'content/post/', # type: Text
+    fetch_workers = 4, # type: int
+    max_article_bytes = 1000000, # type: int
+    cache = None, # type: Optional[ArticleCheckCache]
+    max_front_matter_bytes = rules.MAX_FRONT_MATTER_BYTES, # type: int
+    options = rules.DEFAULT_OPTIONS, # type: rules.Options
+    backend = u'rest', # type: Text
+    git_mirror = None, # type: Optional[GitMirror]
     *args,
     **kwargs
     ):
@@ -161,164 +337,703 @@ def check_article_submission(
         return False
 
     url_info = extract_info_from_url(payload['pull_request']['url'])
-    pr = client.pull_request(
-        url_info['owner'], url_info['repo'], url_info['number'])
-    issue = client.issue(
-        url_info['owner'], url_info['repo'], url_info['number'])
+    state = _full_article_check(
+        payload, logger, client, posts_location,
+        fetch_workers, max_article_bytes, cache, max_front_matter_bytes,
+        options, backend, git_mirror)
+    if state is None:
+        return False
 
-    messages = OrderedDict() # type: Dict[Text, Any]
+    person = payload['pull_request']['user']['login'] # type: Text
+    comments.set_section(
+        (url_info['owner'], url_info['repo'], url_info['number']),
+        ARTICLE_CHECK_SECTION, _render_article_check(state, person))
+    logger.info('we have comment for some errors in article submission')
+    return True
 
-    files_info = {} # type: Dict[Text, github3.pulls.PullFile]
-    for single_file in pr.files():
-        files_info[single_file.filename] = single_file
+
+@metrics.timed
+def recheck_article_submission(
+    event, # type: Text
+    payload, # type: Dict
+    logger, # type: logging.Logger
+    client, # type: github3.github.GitHub
+    comments, # type: CommentBuffer
+    posts_location = u'content/post/', # type: Text
+    fetch_workers = 4, # type: int
+    max_article_bytes = 1000000, # type: int
+    cache = None, # type: Optional[ArticleCheckCache]
+    max_front_matter_bytes = rules.MAX_FRONT_MATTER_BYTES, # type: int
+    options = rules.DEFAULT_OPTIONS, # type: rules.Options
+    backend = u'rest', # type: Text
+    git_mirror = None, # type: Optional[GitMirror]
+    *args,
+    **kwargs
+    ):
+    # type: (...) -> bool
+    """on every push, only re-check what the pushed diff touches"""
+    if not (
+        event == 'pull_request' and
+        payload['action'] == 'synchronize'):
+        return False
+
+    url_info = extract_info_from_url(payload['pull_request']['url'])
+    owner, repo, number = url_info['owner'], url_info['repo'], url_info['number']
+
+    # one call gives us the per-file patches of this very push
+    response = client.session.get(client.session.build_url(
+        'repos', owner, repo, 'compare',
+        u'{}...{}'.format(payload['before'], payload['after'])))
+    response.raise_for_status()
+    comparison = response.json()
+
+    changed_files = comparison.get('files', []) # type: List[Dict]
+    touched_posts = [
+        x for x in changed_files
+        if x['filename'].startswith(posts_location) or
+        x.get('previous_filename', u'').startswith(posts_location)]
+    touched_members = any(
+        x['filename'] == 'data/members.yaml' for x in changed_files)
+    if not touched_posts and not touched_members:
+        return False
+
+    state = _load_article_check(
+        comments.section((owner, repo, number), ARTICLE_CHECK_SECTION),
+        _checker_version(options))
+
+    if state is None or comparison.get('status') != 'ahead':
+        # nothing to build upon, or history was rewritten by a force push,
+        # so we check everything again (the cache keeps this cheap)
+        logger.info('no usable prior article check, check everything again')
+        state = _full_article_check(
+            payload, logger, client, posts_location,
+            fetch_workers, max_article_bytes, cache, max_front_matter_bytes,
+            options, backend, git_mirror)
+        if state is None:
+            return False
+    else:
+        if touched_members:
+            state['members'] = False
+        prefetch = None
+        base_ref = payload['pull_request'].get('base', {}).get('ref')
+        if backend == u'git' and git_mirror is not None and base_ref:
+            try:
+                # the pushed articles are read from the mirror, not downloaded
+                git_mirror.fetch_pull(
+                    owner, repo, number, base_ref,
+                    payload['pull_request'].get('head', {}).get('sha'))
+                prefetch = _git_prefetch(git_mirror, owner, repo, max_article_bytes)
+            except GitError as e:
+                logger.warning(u'git mirror failed, use the rest api: {}'.format(e))
+        _update_article_check(
+            state, touched_posts, logger, client, posts_location,
+            fetch_workers, max_article_bytes, cache, max_front_matter_bytes,
+            options, prefetch)
+
+    person = payload['pull_request']['user']['login'] # type: Text
+    # replaces the earlier check in our comment, no new comment
+    comments.set_section(
+        (owner, repo, number),
+        ARTICLE_CHECK_SECTION, _render_article_check(state, person))
+    return True
+
+
+def _full_article_check(
+    payload, # type: Dict
+    logger, # type: logging.Logger
+    client, # type: github3.github.GitHub
+    posts_location, # type: Text
+    fetch_workers, # type: int
+    max_article_bytes, # type: int
+    cache, # type: Optional[ArticleCheckCache]
+    max_front_matter_bytes=rules.MAX_FRONT_MATTER_BYTES, # type: int
+    options=rules.DEFAULT_OPTIONS, # type: rules.Options
+    backend=u'rest', # type: Text
+    git_mirror=None # type: Optional[GitMirror]
+    ):
+    # type: (...) -> Optional[Dict]
+    """check every article of the pull request, None if there is no article"""
+    url_info = extract_info_from_url(payload['pull_request']['url'])
+    owner, repo, number = url_info['owner'], url_info['repo'], url_info['number']
+
+    pull_files, prefetch = _list_pull_files(
+        logger, client, owner, repo, number, posts_location, max_article_bytes,
+        cache, backend, git_mirror, payload['pull_request'].get('base', {}).get('ref'),
+        payload['pull_request'].get('head', {}).get('sha'))
+
+    # (blob sha, contents url) by name
+    files_info = OrderedDict(
+        (name, (sha, contents_url)) for name, sha, contents_url in pull_files)
 
     # we only deal with those who make articles
-    articles = {} # type: Dict[Text, github3.pulls.PullFile]
-    for name, single_file in files_info.items():
-        if name.startswith(posts_location):
-            articles[name] = single_file
+    articles = OrderedDict(
+        (name, info) for name, info in files_info.items()
+        if name.startswith(posts_location))
     if not articles:
-        return False
+        return None
 
-    # for first time user, we remind them to add members.yaml
-    if payload['pull_request']['author_association'] == 'NONE':
-        if 'data/members.yaml' not in files_info:
-            messages[u'添加 `data/members.yaml`'] = (
-                u"我们注意到你是第一次投稿者，"
-                u"也许你想在这次 pr 里"
-                u"向 `data/members.yaml` 添加你自己的信息一并提交。"
-            )
+    state = {
+        'version': _checker_version(options),
+        # for first time user, we remind them to add members.yaml
+        'members': (
+            payload['pull_request']['author_association'] == 'NONE' and
+            'data/members.yaml' not in files_info),
+        'files': OrderedDict()
+    } # type: Dict[Text, Any]
 
     # we check the article
-    for name, article in articles.items():
+    checking = [] # type: List[Tuple[Text, Optional[Text], Text]]
+    for name, (sha, contents_url) in articles.items():
         assert name.startswith(posts_location)
+        path_findings = rules.check_path(name, posts_location, options)
+        if path_findings is None:
+            # unexpected thing happen??
+            continue
+        state['files'][name] = {'path': path_findings}
+        checking.append((name, sha, contents_url))
 
-        single_article_messages = {} # type: Dict[Text, Text]
+    reports = _article_content_reports(
+        checking, logger, client, fetch_workers, max_article_bytes, cache,
+        max_front_matter_bytes, options, prefetch)
+    for name, report in reports.items():
+        state['files'][name]['content'] = report
+    return state
 
-        # file name checking
-        name_no_parent = name[len(posts_location):].lstrip('/')
-        if not name_no_parent:
-            # unexpected thing happen??
+
+def _list_pull_files(
+    logger, # type: logging.Logger
+    client, # type: github3.github.GitHub
+    owner, # type: Text
+    repo, # type: Text
+    number, # type: int
+    posts_location, # type: Text
+    max_article_bytes, # type: int
+    cache, # type: Optional[ArticleCheckCache]
+    backend, # type: Text
+    git_mirror=None, # type: Optional[GitMirror]
+    base_ref=None, # type: Optional[Text]
+    head_sha=None # type: Optional[Text]
+    ):
+    # type: (...) -> Tuple[List[Tuple[Text, Optional[Text], Text]], Optional[Callable]]
+    """the files of the pull request and maybe a prefetch of the articles"""
+    if backend == u'git' and git_mirror is not None and base_ref:
+        try:
+            return _git_pull_files(
+                git_mirror, client, owner, repo, number, base_ref,
+                posts_location, max_article_bytes, head_sha)
+        except GitError as e:
+            logger.warning(u'git mirror failed, use the rest api: {}'.format(e))
+    if backend == u'graphql':
+        try:
+            return _graphql_pull_files(
+                client, owner, repo, number, posts_location,
+                with_sha=cache is not None, max_article_bytes=max_article_bytes)
+        except (graphql.GraphQLError, requests.RequestException, ValueError, KeyError) as e:
+            logger.warning(u'graphql failed, use the rest api: {}'.format(e))
+    return _rest_pull_files(client, owner, repo, number), None
+
+
+def _rest_pull_files(
+    client, # type: github3.github.GitHub
+    owner, # type: Text
+    repo, # type: Text
+    number # type: int
+    ):
+    # type: (...) -> List[Tuple[Text, Optional[Text], Text]]
+    """(name, blob sha, contents url) of every file of the pull request"""
+    pr = client.pull_request(owner, repo, number)
+    return [(x.filename, x.sha, x.contents_url) for x in pr.files()]
+
+
+def _graphql_pull_files(
+    client, # type: github3.github.GitHub
+    owner, # type: Text
+    repo, # type: Text
+    number, # type: int
+    posts_location, # type: Text
+    with_sha, # type: bool
+    max_article_bytes # type: int
+    ):
+    # type: (...) -> Tuple[List[Tuple[Text, Optional[Text], Text]], Callable]
+    """like `_rest_pull_files`, plus a prefetch of the article texts
+
+    blob shas are only asked for (in one more query) when there is a cache
+    to look them up in, the texts are then only fetched for cache misses.
+    """
+    pull = graphql.pull_request_files(client, owner, repo, number)
+    # a removed post has no blob to check, it still counts as a changed file
+    posts = [
+        path for path, change_type in pull.files
+        if path.startswith(posts_location) and change_type != 'DELETED']
+    shas = {} # type: Dict[Text, Optional[Text]]
+    if with_sha and posts:
+        found = graphql.blobs(client, owner, repo, pull.head_oid, posts, text=False)
+        shas = dict((path, blob and blob.oid) for path, blob in found.items())
+    pull_files = [
+        (path, shas.get(path), u'{}?ref={}'.format(
+            client.session.build_url('repos', owner, repo, 'contents', path),
+            pull.head_oid))
+        for path, change_type in pull.files
+        if change_type != 'DELETED' or not path.startswith(posts_location)]
+
+    def prefetch(missing):
+        # type: (List[Tuple[Text, Optional[Text], Text]]) -> Dict[Text, Optional[Text]]
+        texts = {} # type: Dict[Text, Optional[Text]]
+        found = graphql.blobs(
+            client, owner, repo, pull.head_oid, [name for name, _, _ in missing])
+        for name, blob in found.items():
+            if blob is None:
+                continue
+            if blob.byte_size > max_article_bytes:
+                texts[name] = None
+            elif blob.text is not None:
+                texts[name] = blob.text
+            # binary or truncated ones are left to the rest api
+        return texts
+
+    return pull_files, prefetch
+
+
+def _git_pull_files(
+    git_mirror, # type: GitMirror
+    client, # type: github3.github.GitHub
+    owner, # type: Text
+    repo, # type: Text
+    number, # type: int
+    base_ref, # type: Text
+    posts_location, # type: Text
+    max_article_bytes, # type: int
+    head_sha=None # type: Optional[Text]
+    ):
+    # type: (...) -> Tuple[List[Tuple[Text, Optional[Text], Text]], Callable]
+    """like `_rest_pull_files` from the local mirror, no api call at all"""
+    base_sha, head_sha = git_mirror.fetch_pull(owner, repo, number, base_ref, head_sha)
+    pull_files = [
+        (path, sha, u'{}?ref={}'.format(
+            client.session.build_url('repos', owner, repo, 'contents', path),
+            head_sha))
+        for path, sha, _ in git_mirror.changed_files(owner, repo, base_sha, head_sha)
+        # a removed post has no blob to check
+        if sha is not None or not path.startswith(posts_location)]
+    return pull_files, _git_prefetch(git_mirror, owner, repo, max_article_bytes)
+
+
+def _git_prefetch(
+    git_mirror, # type: GitMirror
+    owner, # type: Text
+    repo, # type: Text
+    max_article_bytes # type: int
+    ):
+    # type: (...) -> Callable
+    """a prefetch reading the articles by blob sha from the mirror"""
+    def prefetch(missing):
+        # type: (List[Tuple[Text, Optional[Text], Text]]) -> Dict[Text, Optional[Text]]
+        found = git_mirror.read_blobs(
+            owner, repo, [sha for _, sha, _ in missing if sha], max_article_bytes)
+        texts = {} # type: Dict[Text, Optional[Text]]
+        for name, sha, _ in missing:
+            if sha not in found:
+                continue
+            content = found[sha]
+            if content is None:
+                texts[name] = None
+                continue
+            try:
+                texts[name] = content.decode('utf-8')
+            except UnicodeDecodeError:
+                # left to the rest api, which tells the same
+                pass
+        return texts
+    return prefetch
+
+
+def _update_article_check(
+    state, # type: Dict
+    touched_posts, # type: List[Dict]
+    logger, # type: logging.Logger
+    client, # type: github3.github.GitHub
+    posts_location, # type: Text
+    fetch_workers, # type: int
+    max_article_bytes, # type: int
+    cache, # type: Optional[ArticleCheckCache]
+    max_front_matter_bytes=rules.MAX_FRONT_MATTER_BYTES, # type: int
+    options=rules.DEFAULT_OPTIONS, # type: rules.Options
+    prefetch=None # type: Optional[Callable]
+    ):
+    # type: (...) -> None
+    """apply the files of a compare response to the prior findings in place"""
+    files = state['files'] # type: Dict[Text, Dict]
+    full_checking = [] # type: List[Tuple[Text, Text, Text]]
+    for changed in touched_posts:
+        name = changed['filename']
+        if changed['status'] == 'removed':
+            files.pop(name, None)
+            continue
+        if changed['status'] == 'renamed':
+            files.pop(changed.get('previous_filename', u''), None)
+        if not name.startswith(posts_location):
             continue
-        if '/' in name_no_parent:
-            single_article_messages[u'文章所在位置: {}'.format(name)] = (
-                u"如果你投稿的是文章，不应该创建更深的文件；如果不是请忽略。"
-            )
-        file_name, ext = os.path.splitext(name.split('/')[-1])
-        allowed_file_exts = {
-            '.md', '.markdown',
-            '.rmd', '.rmarkdown',
-            '.txt',
-            '.ipynb'
-        }
-        file_name_warning = u''
-        if ext.lower() not in allowed_file_exts:
-            file_name_warning += (
-                u'只允许这类文件：{t}\n\n'
-            ).format(t=allowed_file_exts)
-        if re.match(r'\d{4}-\d{2}-\d{2}-.+', file_name) is None:
-            file_name_warning += (
-                u"文件名格式应该如 `2018-01-01-something.md`\n\n"
-            )
-        if file_name_warning:
-            single_article_messages[u'文件名问题'] = \
-                file_name_warning.rstrip()
-
-        # check file content (including yaml meta)
-        content = article.contents() # type: github3.repos.contents.Contents
-        text = content.decoded.decode('utf-8')
-        file_content_warning = _check_article_content(text)
-        if file_content_warning:
-            single_article_messages[u'文件内容问题'] = \
-                file_content_warning
-
-        messages[u'文件 `{}` 问题'.format(name)] = single_article_messages
-
-    if not messages:
-        return False
 
-    person = payload['pull_request']['user']['login'] # type: Text
+        prior = files.get(name, {}).get('content')
+        report = None
+        if (changed['status'] == 'modified' and prior is not None and
+                'patch' in changed):
+            report = _incremental_content_report(
+                prior, name, changed['patch'], changed['contents_url'], client,
+                max_front_matter_bytes, options)
+        if report is not None:
+            files[name]['content'] = report
+            continue
+
+        # new file, or the diff alone cannot tell, check it in full
+        path_findings = rules.check_path(name, posts_location, options)
+        if path_findings is None:
+            continue
+        files[name] = {'path': path_findings}
+        full_checking.append((name, changed['sha'], changed['contents_url']))
+
+    reports = _article_content_reports(
+        full_checking, logger, client, fetch_workers, max_article_bytes, cache,
+        max_front_matter_bytes, options, prefetch)
+    for name, report in reports.items():
+        files[name]['content'] = report
+
+
+def _incremental_content_report(
+    prior, # type: Dict
+    name, # type: Text
+    patch, # type: Text
+    contents_url, # type: Text
+    client, # type: github3.github.GitHub
+    max_front_matter_bytes=rules.MAX_FRONT_MATTER_BYTES, # type: int
+    options=rules.DEFAULT_OPTIONS # type: rules.Options
+    ):
+    # type: (...) -> Optional[Dict]
+    """derive the new content report from the prior one and a file patch
+
+    meta rules run again only if the patch reaches into the yaml meta,
+    line rules only look at added body lines.
+    None means we cannot tell from the patch, a full check is needed.
+    """
+    if rules.article_kind(name) != u'text':
+        # a line may start or end a knitr chunk, the rest of the file
+        # changes meaning with it; notebooks are json, not lines
+        return None
+    if not prior['body_start']:
+        # the yaml meta was broken, or the file was not checked at all
+        return None
+    try:
+        patched_file = PatchSet(
+            u'--- a/{n}\n+++ b/{n}\n{p}\n'.format(n=name, p=patch))[0]
+    except (UnidiffParseError, IndexError):
+        return None
+
+    meta_findings = [x for x in prior['findings'] if x.line is None]
+    line_findings = [] # type: List[rules.Finding]
+    body_start = prior['body_start'] # type: int
+
+    # `body_start` is also the line number of the closing yaml delimiter
+    first_change = _first_changed_source_line(patched_file)
+    if first_change is not None and first_change <= body_start:
+        head = _fetch_article_head(client, contents_url, max_front_matter_bytes)
+        if not head or not rules.META_DELIMETER_PATTERN.match(head):
+            return None
+        body_start, yaml_text, _ = rules.scan_front_matter(
+            head, max_front_matter_bytes)
+        if not body_start:
+            return None
+        if body_start != _remap_line_number(prior['body_start'], patched_file):
+            # another `---` closes the meta now, e.g. a later one in the body
+            # after the old closing line was removed; the lines between
+            # changed sides, only a full check tells what they are now
+            return None
+        meta_findings = rules.check_meta(yaml_text, options)
+
+    if not _body_left(patched_file, prior['body_start'], body_start):
+        # maybe nothing but the yaml meta is left, which is a finding of its own
+        return None
+
+    # old findings move with the lines around them, changed lines are dropped
+    for finding in prior['findings']:
+        if finding.line is None:
+            continue
+        new_line = _remap_line_number(finding.line, patched_file)
+        if new_line is not None and new_line > body_start:
+            line_findings.append(rules.move_finding(finding, new_line))
+    # and the line rules only run on the added body lines
+    for hunk in patched_file:
+        for line in hunk:
+            line_no = line.target_line_no # None for removed lines
+            if line.is_added and line_no is not None and line_no > body_start:
+                line_findings += rules.check_line(line.value.rstrip('\n'), line_no)
+    line_findings.sort(key=lambda x: x.line)
+
+    return {
+        'findings': meta_findings + line_findings,
+        'body_start': body_start
+    }
+
+
+def _body_left(
+    patched_file, # type: PatchedFile
+    old_body_start, # type: int
+    body_start # type: int
+    ):
+    # type: (...) -> bool
+    """whether the body surely still has lines enough, like `rules.check_text` wants"""
+    removed = False
+    kept = 0
+    for hunk in patched_file:
+        for line in hunk:
+            if line.is_removed:
+                removed = removed or (line.source_line_no or 0) > old_body_start
+            elif (line.target_line_no or 0) > body_start:
+                # added or kept, the new file has it
+                kept += 1
+    # the body was fine before, only removals can take it away
+    return not removed or kept >= 2
+
+
+def _first_changed_source_line(
+    patched_file # type: PatchedFile
+    ):
+    # type: (...) -> Optional[int]
+    """line number in the old file where the first change happens"""
+    for hunk in patched_file:
+        last_source_line = hunk.source_start - 1
+        for line in hunk:
+            if line.is_removed:
+                return line.source_line_no
+            if line.is_added:
+                # inserted before the next old line
+                return last_source_line + 1
+            last_source_line = line.source_line_no or last_source_line
+    return None
+
+
+def _remap_line_number(
+    pos, # type: int
+    patched_file # type: PatchedFile
+    ):
+    # type: (...) -> Optional[int]
+    """where an old line is after the patch, None if it was changed"""
+    offset = 0
+    for hunk in patched_file:
+        if pos < hunk.source_start:
+            break
+        if pos < hunk.source_start + hunk.source_length:
+            for line in hunk:
+                if line.source_line_no == pos:
+                    return line.target_line_no if line.is_context else None
+            return None
+        offset += hunk.target_length - hunk.source_length
+    return pos + offset
+
+
+def _load_article_check(
+    text, # type: Optional[Text]
+    version=CHECKER_VERSION # type: Text
+    ):
+    # type: (...) -> Optional[Dict]
+    """the findings hidden in our article check, None if unusable"""
+    matched = ARTICLE_CHECK_STATE_PATTERN.search(text or u'')
+    if matched is None:
+        return None
+    try:
+        state = json.loads(matched.group(1), object_pairs_hook=OrderedDict)
+    except ValueError:
+        return None
+    if state.get('version') != version:
+        # written by older rules, or under other options, do not build upon it
+        return None
+    for checked in state['files'].values():
+        checked['path'] = _load_findings(checked['path'])
+        checked['content']['findings'] = \
+            _load_findings(checked['content']['findings'])
+    return state
+
+
+def _load_findings(
+    raw # type: List[List]
+    ):
+    # type: (...) -> List[rules.Finding]
+    return [rules.Finding(*x) for x in raw]
+
+
+def _render_article_check(
+    state, # type: Dict
+    person # type: Text
+    ):
+    # type: (...) -> Text
+    """the comment body, with the findings hidden inside for later updates"""
+    messages = OrderedDict() # type: Dict[Text, Any]
+
+    if state['members']:
+        messages[u'添加 `data/members.yaml`'] = (
+            u"我们注意到你是第一次投稿者，"
+            u"也许你想在这次 pr 里"
+            u"向 `data/members.yaml` 添加你自己的信息一并提交。"
+        )
+
+    for name, checked in state['files'].items():
+        messages[u'文件 `{}` 问题'.format(name)] = rules.render_findings(
+            name, checked['path'] + checked['content']['findings'])
 
     md_lines = [
         u'# 自动检查',
         u'@{} 欢迎投稿！不过我们发现了一些问题。'.format(person)
     ]
     md_lines += _flattern_messages_to_md_lines(messages, depth=2)
-    comment = u'\n\n'.join(md_lines)
-    issue.create_comment(comment)
-    logger.info('we created comment for some errors in article submission')
-    return True
+    # `--` is not allowed inside a html comment
+    state_json = json.dumps(state, ensure_ascii=False).replace('--', '-\\u002d')
+    md_lines.append(u'{} {} -->'.format(ARTICLE_CHECK_MARKER, state_json))
+    return u'\n\n'.join(md_lines)
+
 
-def _check_article_content(
-    text # type: Text
+def _article_content_reports(
+    checking, # type: Sequence[Tuple[Text, Optional[Text], Text]]
+    logger, # type: logging.Logger
+    client, # type: github3.github.GitHub
+    fetch_workers, # type: int
+    max_article_bytes, # type: int
+    cache, # type: Optional[ArticleCheckCache]
+    max_front_matter_bytes=rules.MAX_FRONT_MATTER_BYTES, # type: int
+    options=rules.DEFAULT_OPTIONS, # type: rules.Options
+    prefetch=None # type: Optional[Callable[[List[Tuple[Text, Optional[Text], Text]]], Dict[Text, Optional[Text]]]]
     ):
-    # type: (...) -> Text
-    """a helper function to ensure article content is valid"""
-    lines = text.split('\n')
-    if not lines:
-        return u'没有内容？？\n\n'
+    # type: (...) -> Dict[Text, Dict]
+    """content reports of (name, blob sha, contents url), in the same order
 
-    warning = u''
-    body_start_line_pos = 0
+    `prefetch` may download the texts of the cache misses in one go,
+    the ones it leaves out are then fetched one by one.
+    """
+    version = _checker_version(options)
+    # unchanged blobs are answered by the cache without downloading them
+    reports = {} # type: Dict[Text, Dict]
+    if cache is not None and checking:
+        for name, sha, _ in checking:
+            if not sha:
+                continue
+            cached = cache.get(sha, version)
+            if cached is not None:
+                report = json.loads(cached)
+                report['findings'] = _load_findings(report['findings'])
+                reports[name] = report
+        stats = cache.stats()
+        logger.info(
+            u'article check cache: {} of {} hit, hit rate {:.2%} so far'.format(
+                len(reports), len(checking), stats['hit_rate']))
+    missing = [item for item in checking if item[0] not in reports]
 
-    # check yaml
-    if not re.match(r'\-{3,}', lines[0]):
-        warning += u'缺少 yaml meta？？\n\n'
-    else:
-        meta_delimeter_len = len(lines[0])
+    # notebooks are checked while they stream in, never prefetched whole
+    texts = [item for item in missing if rules.article_kind(item[0]) != u'notebook']
+    prefetched = {} # type: Dict[Text, Optional[Text]]
+    if prefetch is not None and texts:
+        try:
+            prefetched = prefetch(texts)
+        except (graphql.GraphQLError, GitError, requests.RequestException, ValueError, KeyError) as e:
+            logger.warning(u'cannot prefetch articles, fetch one by one: {}'.format(e))
+
+    def check(item):
+        # type: (Tuple[Text, Optional[Text], Text]) -> Dict
+        kind = rules.article_kind(item[0])
+        if kind == u'notebook':
+            with tracing.span(u'check notebook'):
+                findings = notebook.check_notebook(
+                    _iter_raw_article(client, item[2]), max_article_bytes,
+                    max_front_matter_bytes, options)
+            return {'findings': findings, 'body_start': 0}
+        if item[0] in prefetched:
+            text = prefetched[item[0]]
+        else:
+            with tracing.span(u'download article'):
+                text = _fetch_article_text(client, item[2], max_article_bytes)
+        if text is None:
+            return {
+                'findings': [rules.file_too_large(max_article_bytes)],
+                'body_start': 0
+            }
+        with tracing.span(u'check_text'):
+            findings, body_start = rules.check_text(
+                text, max_front_matter_bytes, options, rmarkdown=kind == u'rmarkdown')
+        return {'findings': findings, 'body_start': body_start}
 
-        # extract yaml
-        yaml_lines = []
-        for idx, line in enumerate(lines):
-            if idx == 0:
+    # contents are downloaded and checked concurrently,
+    # but map() keeps the original order
+    with ThreadPoolExecutor(max_workers=max(1, fetch_workers)) as executor:
+        checked = executor.map(tracing.bind(resilience.bind(check)), missing)
+        for (name, sha, _), report in zip(missing, checked):
+            reports[name] = report
+            if any(x.rule == u'file-too-large' for x in report['findings']):
+                # the limit may be raised, it is not a verdict on the blob
                 continue
-            if (line.rstrip() == '-' * meta_delimeter_len or
-                line.rstrip() == '.' * meta_delimeter_len):
-                # we've found the yaml meta end
-                body_start_line_pos = idx + 1
-                break
-            yaml_lines.append(line)
-
-        if body_start_line_pos >= len(lines) - 1:
-            # no article body???
-            warning += (
-                u'yaml 分隔符异常；'
-                u'你应该在两行 `---` 之间插入 yaml meta 信息。\n\n'
-            )
-            return warning.rstrip()
+            if cache is not None and sha:
+                cache.put(sha, version, json.dumps(report))
+
+    return OrderedDict((name, reports[name]) for name, _, _ in checking)
+
+
+def _iter_raw_article(
+    client, # type: github3.github.GitHub
+    contents_url # type: Text
+    ):
+    # type: (...) -> Iterator[bytes]
+    """stream the raw bytes of a file from the contents api"""
+    # the raw media type skips the base64 json envelope,
+    # and streaming lets the caller stop before reading a huge file in full
+    response = client.session.get(
+        contents_url,
+        headers={'Accept': 'application/vnd.github.v3.raw'},
+        stream=True)
+    try:
+        response.raise_for_status()
+        for chunk in response.iter_content(64 * 1024):
+            # the read timeout is per chunk, a slow trickle would never end
+            resilience.check(u'reading ' + contents_url)
+            yield chunk
+    finally:
+        response.close()
+
+
+def _fetch_article_text(
+    client, # type: github3.github.GitHub
+    contents_url, # type: Text
+    max_bytes # type: int
+    ):
+    # type: (...) -> Optional[Text]
+    """download the raw article, give up (None) as soon as it is too large"""
+    chunks = [] # type: List[bytes]
+    size = 0
+    for chunk in _iter_raw_article(client, contents_url):
+        size += len(chunk)
+        if size > max_bytes:
+            return None
+        chunks.append(chunk)
+    return b''.join(chunks).decode('utf-8')
+
+
+def _fetch_article_head(
+    client, # type: github3.github.GitHub
+    contents_url, # type: Text
+    max_bytes # type: int
+    ):
+    # type: (...) -> Optional[Text]
+    """download only the head of an article, until the yaml meta is closed"""
+    head = b''
+    for chunk in _iter_raw_article(client, contents_url):
+        head += chunk
+        # a character may be cut at the end of the chunk, it is past the meta
+        text = head.decode('utf-8', 'ignore')
+        if not rules.META_DELIMETER_PATTERN.match(text):
+            return text
+        body_start, _, body_offset = rules.scan_front_matter(text, max_bytes)
+        # the closing delimiter line has to be complete
+        if body_start and body_offset is not None:
+            return text
+        if len(head) > max_bytes:
+            return None
+    return head.decode('utf-8', 'ignore')
 
-        try:
-            yaml_parsed_dict = yaml.safe_load('\n'.join(yaml_lines))
-            yaml_is_parsed = True
-        except:
-            yaml_is_parsed = False
-        if yaml_is_parsed:
-            if 'meta_extra' not in yaml_parsed_dict:
-                warning += (
-                    u'请添加一行 `meta_extra: ""` 到 yaml meta 里。\n\n'
-                )
-            if 'forum_id' not in yaml_parsed_dict:
-                warning += (
-                    u'请添加一行 `forum_id:` 到 yaml meta 里。'
-                    u'编辑部成员会在发布前添加具体信息。\n\n'
-                )
-            for essential_info in {'author', 'categories', 'tags'}:
-                if essential_info not in yaml_parsed_dict:
-                    warning += (
-                        u'请在 yaml meta 添加 `{info_key}` 值。\n\n'
-                    ).format(info_key=essential_info)
-
-        # wild checkings on the real content body
-        no_alt_img_pattern = re.compile(r'!\[\]\([^\)]*\)')
-        for idx in range(body_start_line_pos, len(lines)):
-            if no_alt_img_pattern.findall(lines[idx]):
-                warning += (
-                    u'似乎第 {pos} 行的图片没有加上文字说明，'
-                    u'这对于无障碍阅读很重要，请考虑添加上去。\n\n'
-                ).format(pos=idx+1) # line in py starts with 0, thus shift 1 here
-
-    # finally we have full warning
-    return warning.rstrip()
 
 def _flattern_messages_to_md_lines(
     messages, # type: Dict
@@ -336,15 +1051,15 @@ def _flattern_messages_to_md_lines(
     return res
 
 
-def say_something_if_mentioned(
+@metrics.timed
+def answer_mentions(
     event, # type: Text
     payload, # type: Dict
-    logger, # type: logging.Logger
-    client, # type: github3.github.GitHub
-    client_user # type: Text
+    reaction, # type: Reaction
+    comments # type: CommentBuffer
     ):
     # type: (...) -> bool
-    """echo info if mentioned in issue"""
+    """run the commands people give us by mentioning us in an issue"""
     if not (
         (
             event == 'issue_comment' and
@@ -366,46 +1081,170 @@ def say_something_if_mentioned(
         assert False
 
     # very important to avoid infinite mention!!!
-    if person == client_user:
+    if person == reaction.user:
         return False
 
-    pattern = re.compile(
-        r'(?:[^a-zA-Z0-9]|^)(@{})(?:[^a-zA-Z0-9]|$)'.format(client_user))
-    if pattern.search(body) is None:
+    asked = reaction.matcher.parse(body)
+    if not asked:
         # no mention, no talk
         return False
 
-    # if 'created', we only need to check whether be mentioned
-    if payload['action'] in {'opened', 'created'}:
-        pass
-
-    # if 'edited', we check the 'from' and current,
-    # if the 'mention' is the first time, we react.
-    elif payload['action'] == 'edited':
-        if 'body' not in payload['changes']:
+    # if 'edited', only the commands that were not there before are new
+    if payload['action'] == 'edited':
+        if 'body' not in payload.get('changes', {}):
             # body has not been changed,
             # we don't do anything because we had been mentioned.
             return False
-        if pattern.search(payload['changes']['body']['from']) is not None:
-            # although the body has been changed,
-            # we had been mentioned before, so do nothing this time.
+        before = reaction.matcher.parse(payload['changes']['body']['from'])
+        asked = [x for x in asked if x not in before]
+        if not asked:
             return False
 
-    # huh?
-    else:
-        assert False
+    asked = asked[:MAX_COMMANDS]
+    handlers = [HANDLERS.get(x.name) or HANDLERS[MENTION] for x in asked]
+    if (reaction.breaker is not None and reaction.breaker.degraded()
+            and all(x.priority == LOW for x in handlers)):
+        # chit-chat can go while github is failing, commands that check can't
+        reaction.logger.info(u'github keeps failing, ignore chit-chat')
+        for handler in handlers:
+            COMMAND_RUNS.inc(command=handler.name or u'mention', status='shed')
+        return False
+    if reaction.rate_limit is not None:
+        # before taking a token, so that a deferred event is not charged twice
+        reaction.rate_limit.ensure(
+            HIGH if any(x.priority == HIGH for x in handlers) else LOW)
+
+    url_info = extract_info_from_url(payload['issue']['url'])
+    key = (url_info['owner'], url_info['repo'], url_info['number'])
+    if not reaction.command_limiter.allow(key):
+        reaction.logger.info(u'too many commands on {}/{}#{}, ignore'.format(*key))
+        for handler in handlers:
+            COMMAND_RUNS.inc(command=handler.name or u'mention', status='limited')
+        return False
+
+    replies = [] # type: List[Text]
+    for found, handler in zip(asked, handlers):
+        with tracing.span(u'command {}'.format(handler.name or u'mention')):
+            reply = handler.run(reaction, event, payload, comments, found)
+        COMMAND_RUNS.inc(command=handler.name or u'mention', status='ok')
+        if reply:
+            replies.append(reply)
+    if replies:
+        quote = _quote(body)
+        comments.reply(key, u'{}\n\n{}'.format(quote, u'\n\n'.join(replies)))
+    return True
 
+
+def _quote(
+    body, # type: Text
+    omit_threshold=3 # type: int
+    ):
+    # type: (...) -> Text
     body_lines = body.split('\n')
-    omit_threshold = 3
     ellipsis = u'\n> ...' if len(body_lines) > omit_threshold else u''
-    quote_body = u'\n'.join([u'> {}'.format(x) for x in body_lines[:omit_threshold]]) + ellipsis
-    comment = (
-        u'{quote_body}\n\nHi @{person} you mentioned me!\n'
-        u'But I am too busy right now.'
-    ).format(quote_body=quote_body, person=person)
+    return u'\n'.join([u'> {}'.format(x) for x in body_lines[:omit_threshold]]) + ellipsis
 
-    url_info = extract_info_from_url(payload['issue']['url'])
-    issue = client.issue(
-        url_info['owner'], url_info['repo'], url_info['number'])
-    issue.create_comment(comment)
-    return True
+
+def _pull_request_of(
+    payload # type: Dict
+    ):
+    # type: (...) -> Optional[Dict]
+    """the pull request an issue event is about, like in a pull_request event"""
+    issue = payload['issue']
+    if not issue.get('pull_request'):
+        return None
+    return {
+        'url': issue['pull_request']['url'],
+        'user': issue['user'],
+        'author_association': issue.get('author_association'),
+        # an issue event does not tell the base, the git backend falls back
+        'base': {}
+    }
+
+
+################################################
+# commands, see commands.py
+################################################
+
+@command(MENTION)
+def _command_mention(reaction, event, payload, comments, found):
+    # type: (Reaction, Text, Dict, CommentBuffer, Command) -> Text
+    return (
+        u'Hi @{person} you mentioned me! '
+        u'Say `@{bot} help` to see what I can do.\n'
+        u'你好，我能做的事情请看 `@{bot} help`。'
+    ).format(person=payload['sender']['login'], bot=reaction.user)
+
+
+@command(u'help', description=u'list the commands / 列出所有命令')
+def _command_help(reaction, event, payload, comments, found):
+    # type: (Reaction, Text, Dict, CommentBuffer, Command) -> Text
+    return u'\n'.join(
+        u'- `@{} {}`: {}'.format(reaction.user, x.usage, x.description)
+        for x in HANDLERS.values() if x.name != MENTION)
+
+
+@command(u'recheck', description=u'check the articles of this pull request again / 重新检查文章',
+         priority=HIGH)
+def _command_recheck(reaction, event, payload, comments, found):
+    # type: (Reaction, Text, Dict, CommentBuffer, Command) -> Optional[Text]
+    pull_request = _pull_request_of(payload)
+    if pull_request is None:
+        return u'`recheck` only works in a pull request. / 只能在 pull request 里使用。'
+    if u'article-check' not in reaction.reactions:
+        return None
+    state = _full_article_check(
+        {'pull_request': pull_request}, reaction.logger, reaction.client,
+        reaction.posts_location, reaction.fetch_workers,
+        reaction.max_article_bytes, reaction.check_cache,
+        reaction.max_front_matter_bytes, reaction.options, reaction.backend,
+        reaction.git_mirror)
+    if state is None:
+        return u'No article in this pull request. / 这个 pull request 里没有文章。'
+    url_info = extract_info_from_url(pull_request['url'])
+    comments.set_section(
+        (url_info['owner'], url_info['repo'], url_info['number']),
+        ARTICLE_CHECK_SECTION,
+        _render_article_check(state, pull_request['user']['login']))
+    return u'Checked again, see the comment above. / 已重新检查，结果见上面的评论。'
+
+
+@command(u'lint', usage=u'lint <file>',
+         description=u'check one article of this pull request / 检查其中一篇文章',
+         priority=HIGH)
+def _command_lint(reaction, event, payload, comments, found):
+    # type: (Reaction, Text, Dict, CommentBuffer, Command) -> Optional[Text]
+    pull_request = _pull_request_of(payload)
+    if pull_request is None:
+        return u'`lint` only works in a pull request. / 只能在 pull request 里使用。'
+    if not found.args:
+        return u'Usage / 用法: `@{} lint <file>`'.format(reaction.user)
+    wanted = found.args[0].lstrip('/')
+    url_info = extract_info_from_url(pull_request['url'])
+    pull_files, prefetch = _list_pull_files(
+        reaction.logger, reaction.client,
+        url_info['owner'], url_info['repo'], url_info['number'],
+        reaction.posts_location, reaction.max_article_bytes,
+        reaction.check_cache, reaction.backend, reaction.git_mirror,
+        pull_request['base'].get('ref'), pull_request.get('head', {}).get('sha'))
+    # the full path, or relative to the posts location
+    matched = [
+        x for x in pull_files
+        if x[0] in (wanted, reaction.posts_location + wanted)]
+    if not matched:
+        return u'`{}` is not changed in this pull request. / 这个 pull request 没有改动这个文件。'.format(
+            wanted)
+    name = matched[0][0]
+    path_findings = rules.check_path(name, reaction.posts_location, reaction.options)
+    if path_findings is None:
+        return u'`{}` is not an article. / 这不是一篇文章。'.format(name)
+    report = _article_content_reports(
+        matched[:1], reaction.logger, reaction.client, 1,
+        reaction.max_article_bytes, reaction.check_cache,
+        reaction.max_front_matter_bytes, reaction.options, prefetch)[name]
+    findings = path_findings + report['findings']
+    if not findings:
+        return u'`{}` looks fine. / 没有发现问题。'.format(name)
+    md_lines = _flattern_messages_to_md_lines(
+        {u'文件 `{}` 问题'.format(name): rules.render_findings(name, findings)}, depth=2)
+    return u'\n\n'.join(md_lines)
@@ -0,0 +1,97 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import base64
+import gzip
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, Mapping, Optional, Text
+
+
+__all__ = ['DeliveryRecorder', 'read_archive']
+
+
+# everything github sends that we (or a replay) may care about
+RECORDED_HEADERS = (
+    'X-GitHub-Event',
+    'X-GitHub-Delivery',
+    'X-Hub-Signature',
+    'Content-Type',
+    'User-Agent',
+)
+
+
+class DeliveryRecorder(object):
+    """append raw webhook deliveries to a gzipped json lines archive
+
+    the body is kept byte for byte (base64), so that a replay can still
+    verify `X-Hub-Signature` against it. `{pid}` in the path gives every
+    process of a pre-forking server its own archive.
+    """
+
+    def __init__(self,
+        path # type: Text
+        ):
+        # type: (...) -> None
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None # type: Any
+        self._pid = None # type: Optional[int]
+
+    def _archive(self):
+        # type: () -> Any
+        if self._pid != os.getpid():
+            # a forked child must not share the parent's compressor state
+            self._file = gzip.open(self.path.format(pid=os.getpid()), 'ab')
+            self._pid = os.getpid()
+        return self._file
+
+    def record(self,
+        headers, # type: Mapping[Text, Text]
+        body # type: bytes
+        ):
+        # type: (...) -> None
+        """store one delivery, as it came in"""
+        line = json.dumps({
+            'received_at': time.time(),
+            'headers': dict(
+                (name, headers[name]) for name in RECORDED_HEADERS
+                if headers.get(name) is not None),
+            'body': base64.b64encode(body).decode('ascii')
+        }) + '\n'
+        with self._lock:
+            archive = self._archive()
+            archive.write(line.encode('utf-8'))
+            # a sync flush keeps every complete line readable after a crash
+            archive.flush()
+
+    def close(self):
+        # type: () -> None
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._file.close()
+            self._file = None
+            self._pid = None
+
+
+def read_archive(
+    path # type: Text
+    ):
+    # type: (...) -> Iterator[Dict[Text, Any]]
+    """the recorded deliveries, with `body` decoded back to bytes"""
+    with gzip.open(path, 'rb') as f:
+        while True:
+            try:
+                line = f.readline()
+            except EOFError:
+                # the writer was killed in the middle of a block
+                return
+            if not line:
+                return
+            if not line.endswith(b'\n'):
+                return # the same, for an unfinished last line
+            record = json.loads(line.decode('utf-8'))
+            record['body'] = base64.b64decode(record['body'])
+            yield record
@@ -0,0 +1,218 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+settings per repository, so that one deployment serves many content repos
+
+a local yaml file (`REPOS_CONFIG_PATH`) like
+
+    default:
+      reactions: [greeting, article-check, mentions]
+    repositories:
+      cosname/cosx.org:
+        posts_location: content/post/
+        required_meta_keys: [author, categories, tags]
+      someone/notes:
+        allowed_extensions: [.md, .rmd]
+        reactions: []            # ignore this repo
+
+and optionally a file in the repository itself (`REPOS_CONFIG_FILE`,
+e.g. `.github/housekeeper.yml`) with the same keys as an entry above.
+later sources win: env defaults < `default` < the repo entry < the repo file.
+"""
+from __future__ import unicode_literals, print_function
+from collections import namedtuple
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Text, Tuple
+
+import yaml
+
+from . import rules
+
+
+__all__ = ['REACTIONS', 'RepoSettings', 'RepoConfigStore']
+
+
+# the reactions one can switch on and off
+REACTIONS = (u'greeting', u'article-check', u'mentions')
+
+RepoSettings = namedtuple('RepoSettings', [
+    'posts_location', 'allowed_extensions', 'required_meta_keys', 'reactions'])
+
+
+def _text(value):
+    if not isinstance(value, Text):
+        raise ValueError(u'expected a string, got {!r}'.format(value))
+    return value
+
+
+def _texts(value):
+    if not isinstance(value, (list, tuple)):
+        raise ValueError(u'expected a list, got {!r}'.format(value))
+    return tuple(_text(x) for x in value)
+
+
+def _extensions(value):
+    return frozenset(x.lower() if x.startswith('.') else u'.' + x.lower()
+                     for x in _texts(value))
+
+
+def _reactions(value):
+    reactions = _texts(value)
+    unknown = set(reactions) - set(REACTIONS)
+    if unknown:
+        raise ValueError(u'unknown reactions {}'.format(sorted(unknown)))
+    return frozenset(reactions)
+
+
+_PARSERS = {
+    'posts_location': _text,
+    'allowed_extensions': _extensions,
+    'required_meta_keys': _texts,
+    'reactions': _reactions,
+}
+
+
+def default_settings(posts_location=u'content/post/'):
+    # type: (Text) -> RepoSettings
+    """what a repository gets when nothing is configured"""
+    return RepoSettings(
+        posts_location=posts_location,
+        allowed_extensions=rules.DEFAULT_OPTIONS.allowed_extensions,
+        required_meta_keys=rules.DEFAULT_OPTIONS.required_meta_keys,
+        reactions=frozenset(REACTIONS))
+
+
+def rule_options(settings):
+    # type: (RepoSettings) -> rules.Options
+    return rules.Options(
+        allowed_extensions=settings.allowed_extensions,
+        required_meta_keys=settings.required_meta_keys)
+
+
+class RepoConfigStore(object):
+    """resolve the settings of a repository, cached in this process
+
+    the local file is read again only when its mtime changes, the file in
+    a repository at most once per `ttl` seconds (and then with an etag,
+    so an unchanged file costs no rate limit).
+    """
+
+    def __init__(self,
+        defaults, # type: RepoSettings
+        path=None, # type: Optional[Text]
+        repo_file=None, # type: Optional[Text]
+        ttl=300.0, # type: float
+        logger=None # type: Optional[logging.Logger]
+        ):
+        # type: (...) -> None
+        self.defaults = defaults
+        self.path = path
+        self.repo_file = repo_file
+        self.ttl = ttl
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._local = {} # type: Dict[Text, Any]
+        self._local_stamp = None # type: Optional[Tuple[float, int]]
+        self._remote = {} # type: Dict[Text, Tuple[float, Dict[Text, Any]]]
+        self._resolved = {} # type: Dict[Text, Tuple[Any, RepoSettings]]
+
+    def get(self,
+        full_name, # type: Optional[Text]
+        client=None # type: Any
+        ):
+        # type: (...) -> RepoSettings
+        """the settings of `owner/repo`, the defaults if it is unknown"""
+        local = self._load_local()
+        remote = {} # type: Dict[Text, Any]
+        if full_name and self.repo_file and client is not None:
+            remote = self._load_remote(full_name, client)
+        entry = (local.get('repositories') or {}).get(full_name) or {}
+        sources = (local.get('default') or {}, entry, remote)
+
+        with self._lock:
+            cached = self._resolved.get(full_name or u'')
+            if cached is not None and cached[0] == sources:
+                return cached[1]
+        settings = self.defaults
+        for source in sources:
+            settings = self._apply(settings, source, full_name)
+        with self._lock:
+            self._resolved[full_name or u''] = (sources, settings)
+        return settings
+
+    def _apply(self, settings, source, full_name):
+        # type: (RepoSettings, Dict[Text, Any], Optional[Text]) -> RepoSettings
+        changes = {} # type: Dict[Text, Any]
+        for key, value in source.items():
+            parse = _PARSERS.get(key)
+            if parse is None:
+                self.logger.warning(u'config of {}: unknown key {}'.format(full_name, key))
+                continue
+            try:
+                changes[key] = parse(value)
+            except ValueError as err:
+                self.logger.warning(u'config of {}: bad {}: {}'.format(full_name, key, err))
+        return settings._replace(**changes)
+
+    def _load_local(self):
+        # type: () -> Dict[Text, Any]
+        if not self.path:
+            return {}
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime, stat.st_size)
+        except OSError:
+            stamp = None
+        with self._lock:
+            if stamp == self._local_stamp:
+                return self._local
+        loaded = {} # type: Dict[Text, Any]
+        if stamp is not None:
+            try:
+                with open(self.path, 'rb') as f:
+                    loaded = yaml.safe_load(f) or {}
+                if not isinstance(loaded, dict):
+                    raise ValueError(u'not a mapping')
+            except Exception as err:
+                # keep serving what we had, a half written file is no config;
+                # tell once, not on every delivery
+                self.logger.error(u'cannot load {}: {}'.format(self.path, err))
+                with self._lock:
+                    self._local_stamp = stamp
+                    return self._local
+        self.logger.info(u'repository config {} is (re)loaded'.format(self.path))
+        with self._lock:
+            self._local, self._local_stamp = loaded, stamp
+        return loaded
+
+    def _load_remote(self, full_name, client):
+        # type: (Text, Any) -> Dict[Text, Any]
+        now = time.time()
+        with self._lock:
+            cached = self._remote.get(full_name)
+            if cached is not None and now - cached[0] < self.ttl:
+                return cached[1]
+        loaded = cached[1] if cached is not None else {}
+        try:
+            owner, repo = full_name.split('/', 1)
+            response = client.session.get(
+                client.session.build_url('repos', owner, repo, 'contents', self.repo_file),
+                headers={'Accept': 'application/vnd.github.v3.raw'})
+            if response.status_code == 404:
+                loaded = {}
+            else:
+                response.raise_for_status()
+                loaded = yaml.safe_load(response.content) or {}
+                if not isinstance(loaded, dict):
+                    raise ValueError(u'not a mapping')
+        except Exception as err:
+            # the rate limit, github being down, a broken file: keep the last one
+            self.logger.warning(u'cannot load {} of {}: {}'.format(
+                self.repo_file, full_name, err))
+        with self._lock:
+            self._remote[full_name] = (now, loaded)
+        return loaded
@@ -0,0 +1,165 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+how long a delivery may take, and what we do while github misbehaves
+
+`Reaction.run` opens a deadline; every github call is given what is left
+of it as its timeout, and a call past it is not even sent. idempotent
+reads are retried with jittered exponential backoff, within the deadline.
+the circuit breaker counts failing calls, while it is open the reactions
+that can be skipped (greetings, chit-chat) are.
+"""
+from __future__ import unicode_literals, print_function
+from contextlib import contextmanager
+import functools
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Text
+
+
+__all__ = [
+    'DeadlineExceeded', 'deadline', 'remaining', 'check', 'clamp', 'bind',
+    'backoff', 'CircuitBreaker'
+]
+
+
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """the delivery ran out of time"""
+
+
+def remaining():
+    # type: () -> Optional[float]
+    """seconds left before the deadline of this thread, None without one"""
+    until = getattr(_local, 'until', None)
+    return None if until is None else until - time.time()
+
+
+@contextmanager
+def deadline(
+    seconds # type: float
+    ):
+    # type: (...) -> Iterator[None]
+    """a deadline for this thread, 0 for none; an outer one still holds"""
+    previous = getattr(_local, 'until', None)
+    if seconds > 0:
+        until = time.time() + seconds
+        _local.until = until if previous is None else min(until, previous)
+    try:
+        yield
+    finally:
+        _local.until = previous
+
+
+def check(
+    what=u'' # type: Text
+    ):
+    # type: (...) -> None
+    """raise DeadlineExceeded if the deadline has passed"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(u'deadline passed {:.1f}s ago{}'.format(
+            -left, u', before ' + what if what else u''))
+
+
+def clamp(
+    timeout, # type: Any
+    what=u'' # type: Text
+    ):
+    # type: (...) -> Any
+    """a requests timeout (None, seconds or a (connect, read) pair) cut to the deadline"""
+    left = remaining()
+    if left is None:
+        return timeout
+    check(what)
+    if timeout is None:
+        return left
+    if isinstance(timeout, tuple):
+        return tuple(left if x is None else min(x, left) for x in timeout)
+    return min(timeout, left)
+
+
+def bind(func):
+    # type: (Callable) -> Callable
+    """let `func` keep the deadline of this thread, when run in a pool thread"""
+    until = getattr(_local, 'until', None)
+    if until is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'until', None)
+        _local.until = until
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.until = previous
+    return wrapper
+
+
+def backoff(
+    attempt, # type: int
+    base=0.5, # type: float
+    cap=8.0 # type: float
+    ):
+    # type: (...) -> float
+    """seconds to wait before retry `attempt` (0-based), full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker(object):
+    """open after `failures` failing calls in a row, for `reset_seconds`
+
+    after that, calls go through again; the next result closes it, or
+    opens it for another `reset_seconds`. a `failures` of 0 never opens.
+    """
+
+    def __init__(self,
+        failures=5, # type: int
+        reset_seconds=30.0 # type: float
+        ):
+        # type: (...) -> None
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.opened = 0
+        self._failed = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self,
+        ok, # type: bool
+        now=None # type: Optional[float]
+        ):
+        # type: (...) -> None
+        now = time.time() if now is None else now
+        with self._lock:
+            if ok:
+                self._failed = 0
+                self._open_until = 0.0
+                return
+            self._failed += 1
+            if 0 < self.failures <= self._failed and now >= self._open_until:
+                # closed, or trying again after a while: open (again)
+                self.opened += 1
+                self._open_until = now + self.reset_seconds
+
+    def degraded(self,
+        now=None # type: Optional[float]
+        ):
+        # type: (...) -> bool
+        """whether github is failing us, skip what can be skipped"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return now < self._open_until
+
+    def stats(self):
+        # type: () -> Dict[Text, Any]
+        with self._lock:
+            return {
+                'failed_in_a_row': self._failed,
+                'open_until': self._open_until,
+                'opened': self.opened
+            }
@@ -0,0 +1,518 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+from collections import OrderedDict, namedtuple
+import hashlib
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Text, Tuple
+
+import yaml
+try:
+    # libyaml, many times faster when it is installed
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader # type: ignore
+
+from . import tracing
+
+
+__all__ = [
+    'Finding', 'Rule', 'RULES', 'register_rule', 'rule',
+    'check_path', 'check_text', 'check_meta', 'check_line',
+    'file_too_large', 'structural_finding', 'move_finding', 'render_findings',
+    'scan_front_matter', 'load_meta', 'Options', 'DEFAULT_OPTIONS',
+    'options_fingerprint', 'article_kind'
+]
+
+
+# `line` is 1-based, None for findings about the whole file or its meta.
+# messages of line findings keep their `{line}` placeholder,
+# so that a finding can move when lines are inserted above it.
+# `cell` is the 1-based notebook cell `line` counts in, None for other files
+Finding = namedtuple('Finding', ['rule', 'line', 'severity', 'message', 'cell'])
+Finding.__new__.__defaults__ = (None,)
+
+NAME_SECTION = u'文件名问题'
+CONTENT_SECTION = u'文件内容问题'
+
+META_DELIMETER_PATTERN = re.compile(r'\-{3,}')
+
+# ```{r label, echo=FALSE} opens a knitr chunk, ``` alone closes it
+RMD_CHUNK_OPEN_PATTERN = re.compile(r'\s*(`{3,})\s*\{[^}]*\}\s*$')
+RMD_CHUNK_CLOSE_PATTERN = re.compile(r'\s*(`{3,})\s*$')
+
+# the yaml meta is a dozen keys, we never look further than this for its end
+MAX_FRONT_MATTER_BYTES = 64 * 1024
+
+# what may differ between the repositories we check
+Options = namedtuple('Options', ['allowed_extensions', 'required_meta_keys'])
+
+
+class Rule(object):
+    """a single article check
+
+    `scope` tells what the check needs:
+      - 'path':     check(name, posts_location, options) -> messages
+      - 'meta':     check(parsed yaml dict, options) -> messages
+      - 'line':     check(line text) -> messages, `{line}` is filled in later;
+                    a `pattern` alone makes a line rule without `check`
+      - 'document': found by the engine itself, no check at all
+    `section` is the title the messages are grouped under, `{name}` allowed.
+    """
+
+    def __init__(self,
+        rule_id, # type: Text
+        scope, # type: Text
+        section, # type: Text
+        severity=u'warning', # type: Text
+        check=None, # type: Optional[Callable[..., Iterable[Text]]]
+        pattern=None, # type: Optional[Text]
+        message=u'' # type: Text
+        ):
+        # type: (...) -> None
+        self.rule_id = rule_id
+        self.scope = scope
+        self.section = section
+        self.severity = severity
+        self.message = message
+        # compiled once, here, at import time
+        self.pattern = re.compile(pattern) if pattern is not None else None
+        self.check = check or self._match_pattern # type: Callable[..., Iterable[Text]]
+
+    def _match_pattern(self, line):
+        # type: (Text) -> List[Text]
+        if self.pattern is not None and self.pattern.search(line):
+            return [self.message]
+        return []
+
+
+RULES = OrderedDict() # type: Dict[Text, Rule]
+_RULES_BY_SCOPE = {} # type: Dict[Text, List[Rule]]
+
+
+def register_rule(
+    new_rule # type: Rule
+    ):
+    # type: (...) -> Rule
+    """add (or replace) a rule in the registry"""
+    RULES[new_rule.rule_id] = new_rule
+    _RULES_BY_SCOPE.clear()
+    return new_rule
+
+
+def rule(
+    rule_id, # type: Text
+    scope, # type: Text
+    section, # type: Text
+    severity=u'warning' # type: Text
+    ):
+    # type: (...) -> Callable
+    """decorator flavour of register_rule"""
+    def decorator(check):
+        register_rule(Rule(rule_id, scope, section, severity, check=check))
+        return check
+    return decorator
+
+
+def _rules_of(
+    scope # type: Text
+    ):
+    # type: (...) -> List[Rule]
+    if not _RULES_BY_SCOPE:
+        for registered in RULES.values():
+            _RULES_BY_SCOPE.setdefault(registered.scope, []).append(registered)
+    return _RULES_BY_SCOPE.get(scope, [])
+
+
+################################################
+# the built-in rules
+################################################
+
+register_rule(Rule(
+    'content-empty', 'document', CONTENT_SECTION, u'error',
+    message=u'没有内容？？'))
+register_rule(Rule(
+    'yaml-missing', 'document', CONTENT_SECTION, u'error',
+    message=u'缺少 yaml meta？？'))
+register_rule(Rule(
+    'yaml-delimiter', 'document', CONTENT_SECTION, u'error',
+    message=(
+        u'yaml 分隔符异常；'
+        u'你应该在两行 `---` 之间插入 yaml meta 信息。'
+    )))
+register_rule(Rule(
+    'file-too-large', 'document', CONTENT_SECTION, u'notice',
+    message=u'文件超过 {max_bytes} 字节，跳过了内容检查。'))
+register_rule(Rule(
+    'yaml-too-large', 'document', CONTENT_SECTION, u'error',
+    message=(
+        u'在前 {max_bytes} 字节里没有找到 yaml meta 的结束分隔符；'
+        u'yaml meta 是不是没有用 `---` 结束？'
+    )))
+register_rule(Rule(
+    'notebook-invalid', 'document', CONTENT_SECTION, u'error',
+    message=u'无法读取这个 Jupyter notebook：{error}'))
+register_rule(Rule(
+    'rmd-chunk-unclosed', 'document', CONTENT_SECTION, u'error',
+    message=u'第 {line} 行开始的代码块没有用 ``` 结束，knitr 会出错。'))
+
+
+@rule('post-location', 'path', u'文章所在位置: {name}', u'notice')
+def _check_post_location(name, posts_location, options):
+    name_no_parent = name[len(posts_location):].lstrip('/')
+    if '/' in name_no_parent:
+        return [u"如果你投稿的是文章，不应该创建更深的文件；如果不是请忽略。"]
+    return []
+
+
+ALLOWED_FILE_EXTS = frozenset({
+    '.md', '.markdown',
+    '.rmd', '.rmarkdown',
+    '.txt',
+    '.ipynb'
+})
+NOTEBOOK_EXTS = frozenset({'.ipynb'})
+RMARKDOWN_EXTS = frozenset({'.rmd', '.rmarkdown'})
+
+
+def article_kind(
+    name # type: Text
+    ):
+    # type: (...) -> Text
+    """how an article is checked: 'notebook', 'rmarkdown' or 'text'"""
+    _, ext = os.path.splitext(name.split('/')[-1])
+    if ext.lower() in NOTEBOOK_EXTS:
+        return u'notebook'
+    if ext.lower() in RMARKDOWN_EXTS:
+        return u'rmarkdown'
+    return u'text'
+
+@rule('file-extension', 'path', NAME_SECTION)
+def _check_file_extension(name, posts_location, options):
+    _, ext = os.path.splitext(name.split('/')[-1])
+    if ext.lower() not in options.allowed_extensions:
+        return [u'只允许这类文件：{t}'.format(t=sorted(options.allowed_extensions))]
+    return []
+
+
+FILE_NAME_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}-.+')
+
+@rule('file-name-format', 'path', NAME_SECTION)
+def _check_file_name_format(name, posts_location, options):
+    file_name, _ = os.path.splitext(name.split('/')[-1])
+    if FILE_NAME_PATTERN.match(file_name) is None:
+        return [u"文件名格式应该如 `2018-01-01-something.md`"]
+    return []
+
+
+@rule('meta-extra', 'meta', CONTENT_SECTION)
+def _check_meta_extra(meta, options):
+    if 'meta_extra' not in meta:
+        return [u'请添加一行 `meta_extra: ""` 到 yaml meta 里。']
+    return []
+
+
+@rule('meta-forum-id', 'meta', CONTENT_SECTION)
+def _check_meta_forum_id(meta, options):
+    if 'forum_id' not in meta:
+        return [
+            u'请添加一行 `forum_id:` 到 yaml meta 里。'
+            u'编辑部成员会在发布前添加具体信息。'
+        ]
+    return []
+
+
+@rule('meta-essential-keys', 'meta', CONTENT_SECTION)
+def _check_meta_essential_keys(meta, options):
+    return [
+        u'请在 yaml meta 添加 `{info_key}` 值。'.format(info_key=essential_info)
+        for essential_info in options.required_meta_keys
+        if essential_info not in meta
+    ]
+
+
+DEFAULT_OPTIONS = Options(
+    allowed_extensions=ALLOWED_FILE_EXTS,
+    required_meta_keys=('author', 'categories', 'tags'))
+
+
+def options_fingerprint(
+    options # type: Options
+    ):
+    # type: (...) -> Text
+    """a short id of the options, for cache keys; empty for the defaults"""
+    if options == DEFAULT_OPTIONS:
+        return u''
+    data = u'{}|{}'.format(
+        sorted(options.allowed_extensions), list(options.required_meta_keys))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:12]
+
+
+register_rule(Rule(
+    'image-alt-text', 'line', CONTENT_SECTION,
+    pattern=r'!\[\]\([^\)]*\)',
+    message=(
+        u'似乎第 {line} 行的图片没有加上文字说明，'
+        u'这对于无障碍阅读很重要，请考虑添加上去。'
+    )))
+
+
+################################################
+# the engine
+################################################
+
+def _findings(
+    checker, # type: Rule
+    messages, # type: Iterable[Text]
+    line=None # type: Optional[int]
+    ):
+    # type: (...) -> List[Finding]
+    return [
+        Finding(checker.rule_id, line, checker.severity, message, None)
+        for message in messages
+    ]
+
+
+def structural_finding(
+    rule_id, # type: Text
+    **kwargs # type: Any
+    ):
+    # type: (...) -> Finding
+    """the finding of a 'document' rule, its message filled in"""
+    checker = RULES[rule_id]
+    return Finding(
+        rule_id, None, checker.severity, checker.message.format(**kwargs), None)
+
+
+def file_too_large(
+    max_bytes # type: int
+    ):
+    # type: (...) -> Finding
+    """the finding we report instead of checking a huge file"""
+    return structural_finding('file-too-large', max_bytes=max_bytes)
+
+
+def check_path(
+    name, # type: Text
+    posts_location, # type: Text
+    options=DEFAULT_OPTIONS # type: Options
+    ):
+    # type: (...) -> Optional[List[Finding]]
+    """run the path rules, None if the name is not an article at all"""
+    if not name[len(posts_location):].lstrip('/'):
+        return None
+    findings = [] # type: List[Finding]
+    for checker in _rules_of('path'):
+        findings += _findings(checker, checker.check(name, posts_location, options))
+    return findings
+
+
+_META_CACHE_SIZE = 1024
+_meta_cache = OrderedDict() # type: OrderedDict[bytes, Any]
+_meta_cache_lock = threading.Lock()
+_MISSING = object()
+_UNPARSABLE = object()
+
+
+def load_meta(
+    yaml_text # type: Text
+    ):
+    # type: (...) -> Any
+    """the parsed yaml meta, None if unparsable; memoized by content hash
+
+    the same meta is parsed again and again (every push, every recheck),
+    so the result is shared: treat it as read only.
+    """
+    key = hashlib.sha1(yaml_text.encode('utf-8')).digest()
+    with _meta_cache_lock:
+        meta = _meta_cache.pop(key, _MISSING)
+        if meta is not _MISSING:
+            _meta_cache[key] = meta # most recently used again
+    if meta is _MISSING:
+        try:
+            with tracing.span(u'yaml'):
+                meta = yaml.load(yaml_text, Loader=SafeLoader)
+        except:
+            meta = _UNPARSABLE
+        with _meta_cache_lock:
+            _meta_cache[key] = meta
+            while len(_meta_cache) > _META_CACHE_SIZE:
+                _meta_cache.popitem(last=False)
+    return None if meta is _UNPARSABLE else meta
+
+
+def check_meta(
+    yaml_text, # type: Text
+    options=DEFAULT_OPTIONS # type: Options
+    ):
+    # type: (...) -> List[Finding]
+    """run the meta rules, an unparsable meta is left alone"""
+    meta = load_meta(yaml_text)
+    if not isinstance(meta, dict):
+        return []
+    findings = [] # type: List[Finding]
+    for checker in _rules_of('meta'):
+        findings += _findings(checker, checker.check(meta, options))
+    return findings
+
+
+def check_line(
+    line, # type: Text
+    line_no # type: int
+    ):
+    # type: (...) -> List[Finding]
+    """run every line rule on a single body line"""
+    findings = [] # type: List[Finding]
+    for checker in _rules_of('line'):
+        findings += _findings(checker, checker.check(line), line_no)
+    return findings
+
+
+def _iter_lines(
+    text, # type: Text
+    start=0 # type: int
+    ):
+    # type: (...) -> Iterator[Text]
+    """like text[start:].split('\\n'), without building the whole list"""
+    while True:
+        end = text.find('\n', start)
+        if end < 0:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+def _is_closing_delimiter(
+    line, # type: Text
+    meta_delimeter_len # type: int
+    ):
+    # type: (...) -> bool
+    stripped = line.rstrip()
+    return (stripped == '-' * meta_delimeter_len or
+            stripped == '.' * meta_delimeter_len)
+
+
+def scan_front_matter(
+    text, # type: Text
+    max_bytes=MAX_FRONT_MATTER_BYTES # type: int
+    ):
+    # type: (...) -> Tuple[int, Text, Optional[int]]
+    """find the yaml meta in the head of the text only
+
+    returns the index of the first body line (0 if the meta is not closed
+    within `max_bytes` characters), the yaml text, and the offset where
+    the body starts (None if there is no body line at all).
+    the first line is expected to be the opening delimiter.
+    """
+    first_end = text.find('\n')
+    if first_end < 0:
+        return 0, u'', None
+    delimiter_len = first_end
+    pos = first_end + 1
+    line_idx = 1
+    while pos <= max_bytes:
+        end = text.find('\n', pos, pos + max_bytes + 1)
+        line = text[pos:end] if end >= 0 else text[pos:pos + max_bytes + 1]
+        if _is_closing_delimiter(line, delimiter_len):
+            body_offset = end + 1 if end >= 0 else None
+            yaml_text = text[first_end + 1:max(pos - 1, first_end + 1)]
+            return line_idx + 1, yaml_text, body_offset
+        if end < 0:
+            break
+        pos = end + 1
+        line_idx += 1
+    return 0, u'', None
+
+
+def check_text(
+    text, # type: Text
+    max_front_matter_bytes=MAX_FRONT_MATTER_BYTES, # type: int
+    options=DEFAULT_OPTIONS, # type: Options
+    rmarkdown=False # type: bool
+    ):
+    # type: (...) -> Tuple[List[Finding], int]
+    """run every content rule in a single pass over the text
+
+    returns the findings and the index of the first body line
+    (0 if the yaml meta is broken, then only the structural finding is kept).
+    with `rmarkdown`, the line rules skip the knitr chunks, which are code.
+    """
+    if not text:
+        return [structural_finding('content-empty')], 0
+
+    if not META_DELIMETER_PATTERN.match(text):
+        return [structural_finding('yaml-missing')], 0
+
+    # the yaml meta, looked for in the head of the text only
+    body_start, yaml_text, body_offset = scan_front_matter(
+        text, max_front_matter_bytes)
+    if not body_start:
+        if len(text) > max_front_matter_bytes:
+            return [structural_finding(
+                'yaml-too-large', max_bytes=max_front_matter_bytes)], 0
+        return [structural_finding('yaml-delimiter')], 0
+    if body_offset is None:
+        # the text ends with the closing delimiter, no article body???
+        return [structural_finding('yaml-delimiter')], 0
+
+    findings = check_meta(yaml_text, options)
+
+    # then all line rules at once, on each body line
+    line_no = body_start
+    chunk_fence = None # type: Optional[Text]
+    chunk_start = 0
+    for line in _iter_lines(text, body_offset):
+        line_no += 1
+        if rmarkdown:
+            if chunk_fence is None:
+                opened = RMD_CHUNK_OPEN_PATTERN.match(line)
+                if opened is not None:
+                    chunk_fence, chunk_start = opened.group(1), line_no
+                    continue
+            else:
+                closed = RMD_CHUNK_CLOSE_PATTERN.match(line)
+                if closed is not None and len(closed.group(1)) >= len(chunk_fence):
+                    chunk_fence = None
+                continue
+        findings += check_line(line, line_no)
+
+    if body_start >= line_no - 1:
+        # no article body???
+        return [structural_finding('yaml-delimiter')], 0
+    if chunk_fence is not None:
+        # a line finding, its message keeps the `{line}` placeholder
+        unclosed = RULES['rmd-chunk-unclosed']
+        findings += _findings(unclosed, [unclosed.message], chunk_start)
+    return findings, body_start
+
+
+def move_finding(
+    finding, # type: Finding
+    line # type: int
+    ):
+    # type: (...) -> Finding
+    """the same finding, reported at another line"""
+    return finding._replace(line=line)
+
+
+def render_findings(
+    name, # type: Text
+    findings # type: Iterable[Finding]
+    ):
+    # type: (...) -> Dict[Text, Text]
+    """group findings by section, ready for the markdown renderer"""
+    sections = OrderedDict() # type: Dict[Text, List[Text]]
+    for finding in findings:
+        section = RULES[finding.rule].section.format(name=name)
+        message = finding.message
+        if finding.line is not None:
+            message = message.format(line=finding.line)
+        if finding.cell is not None:
+            message = u'第 {} 个单元格：{}'.format(finding.cell, message)
+        sections.setdefault(section, []).append(message)
+    return OrderedDict(
+        (section, u'\n\n'.join(messages))
+        for section, messages in sections.items())
@@ -0,0 +1,47 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import sqlite3
+import threading
+from typing import Optional, Text
+
+
+__all__ = ['SqliteStore']
+
+
+class SqliteStore(object):
+    """base class for the small sqlite files we keep next to the bot
+
+    one connection per process, guarded by a lock, reconnected after fork.
+    several processes may share the same file.
+    """
+
+    def __init__(self,
+        path # type: Text
+        ):
+        # type: (...) -> None
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None # type: Optional[sqlite3.Connection]
+        self._pid = None # type: Optional[int]
+        with self._lock:
+            self._init_schema()
+
+    @property
+    def _conn(self):
+        # type: () -> sqlite3.Connection
+        # sqlite connections must not cross a fork, reconnect in the child
+        if self._db is None or self._pid != os.getpid():
+            # autocommit mode, we issue our own BEGIN IMMEDIATE
+            # when several statements must be atomic
+            self._db = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None,
+                check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._pid = os.getpid()
+        return self._db
+
+    def _init_schema(self):
+        # type: () -> None
+        raise NotImplementedError
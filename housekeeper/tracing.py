@@ -0,0 +1,121 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+where the time of a slow delivery went
+
+`Reaction.run` opens a trace; every reaction function, every github api
+call and the heavier steps of an article check add a span to it. when
+the run took long enough, the spans are logged in one line, which
+carries the delivery id like every other record of the delivery.
+without an open trace, a span costs next to nothing.
+"""
+from __future__ import unicode_literals, print_function
+from collections import OrderedDict
+from contextlib import contextmanager
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Iterator, List, Optional, Text, Tuple
+
+
+__all__ = ['Trace', 'trace', 'span', 'record', 'bind']
+
+
+_local = threading.local()
+
+
+class Trace(object):
+    """the spans of one run, threads of the run may add to it"""
+
+    def __init__(self, name):
+        # type: (Text) -> None
+        self.name = name
+        self.started = time.time()
+        # (name, seconds since the start, seconds)
+        self.spans = [] # type: List[Tuple[Text, float, float]]
+        self._lock = threading.Lock()
+
+    def add(self, name, started, seconds):
+        # type: (Text, float, float) -> None
+        with self._lock:
+            self.spans.append((name, started - self.started, seconds))
+
+    def summary(self, seconds):
+        # type: (float) -> Text
+        """spans of the same name summed up, in the order they first began"""
+        totals = OrderedDict() # type: OrderedDict
+        with self._lock:
+            spans = sorted(self.spans, key=lambda x: x[1])
+        for name, _, took in spans:
+            count, total = totals.get(name, (0, 0.0))
+            totals[name] = (count + 1, total + took)
+        parts = [u'trace of {}: {:.1f} ms'.format(self.name, seconds * 1000)]
+        for name, (count, total) in totals.items():
+            times = u' x{}'.format(count) if count > 1 else u''
+            parts.append(u'{}{} {:.1f} ms'.format(name, times, total * 1000))
+        return u' | '.join(parts)
+
+
+def current():
+    # type: () -> Optional[Trace]
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def trace(
+    name, # type: Text
+    logger, # type: logging.Logger
+    min_seconds=1.0 # type: float
+    ):
+    # type: (...) -> Iterator[Trace]
+    """open a trace in this thread, log it if it takes `min_seconds` or more"""
+    previous = current()
+    opened = _local.trace = Trace(name)
+    try:
+        yield opened
+    finally:
+        _local.trace = previous
+        seconds = time.time() - opened.started
+        if seconds >= min_seconds:
+            logger.info(opened.summary(seconds))
+
+
+def record(name, started, seconds):
+    # type: (Text, float, float) -> None
+    """add a span measured elsewhere to the open trace, if any"""
+    opened = current()
+    if opened is not None:
+        opened.add(name, started, seconds)
+
+
+@contextmanager
+def span(name):
+    # type: (Text) -> Iterator[None]
+    opened = current()
+    if opened is None:
+        yield
+        return
+    started = time.time()
+    try:
+        yield
+    finally:
+        opened.add(name, started, time.time() - started)
+
+
+def bind(func):
+    # type: (Callable) -> Callable
+    """let `func` add to the trace of this thread, when run in a pool thread"""
+    opened = current()
+    if opened is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = current()
+        _local.trace = opened
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.trace = previous
+    return wrapper
@@ -6,6 +6,9 @@ try:
 except ImportError:
     from urlparse import urlparse # type: ignore
 import datetime
+from hashlib import sha1
+import hmac
+import sys
 
 
 def extract_info_from_url(url):
@@ -39,3 +42,23 @@ def extract_info_from_url(url):
 def get_today():
     """today object"""
     return datetime.date.today()
+
+
+def verify_signature(secret_key, body, signature):
+    """check the `X-Hub-Signature` header github computed over the raw body"""
+    try:
+        secret_key_bytes = secret_key.encode('utf-8')
+    except AttributeError:
+        secret_key_bytes = secret_key
+    computed = hmac.new(secret_key_bytes, body, sha1).hexdigest()
+    return signature_matches(signature, u'sha1=' + computed)
+
+
+def signature_matches(signature, computed):
+    """compare a `sha1=...` header with the one we computed, in constant time"""
+    if signature is None or not signature.startswith('sha1='):
+        return False
+    if sys.version_info >= (2, 7, 7):
+        return hmac.compare_digest(str(signature), str(computed))
+    # old python version
+    return str(signature) == str(computed)
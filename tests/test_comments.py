@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import pytest
+
+from .context import housekeeper
+from benchmarks.fake_github import FakeGitHub
+import housekeeper.clients
+from housekeeper.comments import CommentBuffer
+
+
+KEY = ('owner', 'repo', 1)
+
+
+@pytest.fixture
+def fake():
+    fake = FakeGitHub().start()
+    fake.add_issue('owner', 'repo', 1, 'someone', '')
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def new_buffer(fake):
+    client = housekeeper.clients.ClientRegistry(api_url=fake.url).get('bot', 'secret')
+    return lambda: CommentBuffer(client, 'bot', logging.getLogger(__name__))
+
+
+def test_one_comment(fake, new_buffer):
+    first = new_buffer()
+    first.set_section(KEY, 'a', 'first')
+    first.flush()
+    second = new_buffer()
+    second.set_section(KEY, 'b', 'second')
+    second.flush()
+
+    bodies = fake.comments_on('owner', 'repo', 1)
+    assert len(bodies) == 1
+    assert 'first' in bodies[0] and 'second' in bodies[0]
+
+
+def test_created_after_lookup(fake, new_buffer):
+    late = new_buffer()
+    # found none, then another worker comments first
+    assert late.section(KEY, 'a') is None
+    other = new_buffer()
+    other.set_section(KEY, 'a', 'other')
+    other.flush()
+
+    late.set_section(KEY, 'b', 'late')
+    late.flush()
+
+    bodies = fake.comments_on('owner', 'repo', 1)
+    assert len(bodies) == 1
+    assert 'other' in bodies[0] and 'late' in bodies[0]
+
+
+def test_deleted_after_lookup(fake, new_buffer):
+    first = new_buffer()
+    first.set_section(KEY, 'a', 'first')
+    first.flush()
+    late = new_buffer()
+    assert late.section(KEY, 'a') == 'first'
+    fake.comments.clear()
+
+    late.set_section(KEY, 'a', 'again')
+    late.flush()
+
+    bodies = fake.comments_on('owner', 'repo', 1)
+    assert len(bodies) == 1
+    assert 'again' in bodies[0]
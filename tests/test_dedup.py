@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from .context import housekeeper
+from housekeeper.dedup import DeliveryDeduplicator
+
+
+def test_claim_once():
+    deliveries = DeliveryDeduplicator()
+
+    assert deliveries.claim('d1')
+    assert not deliveries.claim('d1')
+    assert deliveries.claim('d2')
+
+
+def test_forget():
+    deliveries = DeliveryDeduplicator()
+    deliveries.claim('d1')
+
+    deliveries.forget('d1')
+
+    assert deliveries.claim('d1')
+
+
+def test_ttl():
+    deliveries = DeliveryDeduplicator(ttl=0.0)
+    deliveries.claim('d1')
+
+    assert deliveries.claim('d1')
+
+
+def test_max_entries():
+    deliveries = DeliveryDeduplicator(max_entries=2)
+    for delivery in ('d1', 'd2', 'd3'):
+        deliveries.claim(delivery)
+
+    assert len(deliveries) == 2
+    # the oldest one is forgotten first
+    assert deliveries.claim('d1')
+    assert not deliveries.claim('d3')
+
+
+def test_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'dedup.sqlite3')
+    first = DeliveryDeduplicator(path=path)
+    # e.g. another gunicorn worker, or after a restart
+    second = DeliveryDeduplicator(path=path)
+
+    assert first.claim('d1')
+    assert not second.claim('d1')
+
+    first.forget('d1')
+    assert DeliveryDeduplicator(path=path).claim('d1')
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import subprocess
+
+import pytest
+
+from .context import housekeeper
+from housekeeper.git_mirror import GitError, GitMirror
+
+
+def git(cwd, *args):
+    return subprocess.run(
+        ['git', '-c', 'user.name=someone', '-c', 'user.email=someone@example.com'] +
+        list(args),
+        cwd=str(cwd), check=True, stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
+
+
+def commit(work, files):
+    for name, data in files.items():
+        path = work / name
+        if data is None:
+            path.unlink()
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    git(work, 'add', '--all')
+    git(work, 'commit', '--quiet', '-m', 'change')
+    return git(work, 'rev-parse', 'HEAD')
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """a bare owner/repo standing in for github, with pull request 1"""
+    bare = tmp_path / 'remote' / 'owner' / 'repo.git'
+    git(tmp_path, 'init', '--quiet', '--bare', str(bare))
+    work = tmp_path / 'work'
+    git(tmp_path, 'init', '--quiet', str(work))
+    base = commit(work, {
+        'README.md': b'readme',
+        'content/post/old.md': b'old',
+        'content/post/gone.md': b'gone'})
+    git(work, 'push', '--quiet', str(bare), 'HEAD:refs/heads/master')
+    head = commit(work, {
+        'content/post/old.md': b'changed',
+        'content/post/gone.md': None,
+        'content/post/new.md': 'new 文章'.encode('utf-8')})
+    git(work, 'push', '--quiet', str(bare), 'HEAD:refs/pull/1/head')
+    return {'work': work, 'bare': bare, 'base': base, 'head': head}
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    return GitMirror(
+        str(tmp_path / 'mirrors'),
+        url_template=str(tmp_path / 'remote' / '{owner}' / '{repo}.git'))
+
+
+def test_fetch_pull(remote, mirror):
+    assert mirror.fetch_pull('owner', 'repo', 1, 'master') == (remote['base'], remote['head'])
+
+    # a push to the pull request is fetched on the next event
+    head = commit(remote['work'], {'content/post/new.md': b'again'})
+    git(remote['work'], 'push', '--quiet', '--force', str(remote['bare']), 'HEAD:refs/pull/1/head')
+    assert mirror.fetch_pull('owner', 'repo', 1, 'master') == (remote['base'], head)
+
+
+def test_fetch_pull_lagging_ref(remote, mirror):
+    assert mirror.fetch_pull('owner', 'repo', 1, 'master', remote['head'])[1] == remote['head']
+
+    # the payload tells of a push the pull ref does not have yet
+    with pytest.raises(GitError):
+        mirror.fetch_pull('owner', 'repo', 1, 'master', '1' * 40)
+
+    # a later push is there already, the payload's head is still checked
+    commit(remote['work'], {'content/post/new.md': b'again'})
+    git(remote['work'], 'push', '--quiet', '--force', str(remote['bare']), 'HEAD:refs/pull/1/head')
+    assert mirror.fetch_pull('owner', 'repo', 1, 'master', remote['head']) == (
+        remote['base'], remote['head'])
+
+
+def test_fetch_unknown_pull(remote, mirror):
+    with pytest.raises(GitError):
+        mirror.fetch_pull('owner', 'repo', 2, 'master')
+
+
+def test_changed_files(remote, mirror):
+    base, head = mirror.fetch_pull('owner', 'repo', 1, 'master')
+
+    files = mirror.changed_files('owner', 'repo', base, head)
+
+    def blob(name):
+        return git(remote['work'], 'rev-parse', '{}:{}'.format(head, name))
+    assert sorted(files) == [
+        ('content/post/gone.md', None, 'D'),
+        ('content/post/new.md', blob('content/post/new.md'), 'A'),
+        ('content/post/old.md', blob('content/post/old.md'), 'M')]
+
+
+def test_read_blobs(remote, mirror):
+    base, head = mirror.fetch_pull('owner', 'repo', 1, 'master')
+    shas = dict((name, sha) for name, sha, _ in mirror.changed_files('owner', 'repo', base, head))
+    new, old = shas['content/post/new.md'], shas['content/post/old.md']
+
+    blobs = mirror.read_blobs('owner', 'repo', [new, old, '0' * 40], max_bytes=8)
+
+    # larger than max_bytes is None, a missing one is left out
+    assert blobs == {new: None, old: b'changed'}
+    assert mirror.read_blobs('owner', 'repo', [new], max_bytes=100) == {
+        new: 'new 文章'.encode('utf-8')}
+    assert mirror.read_blobs('owner', 'repo', [], max_bytes=100) == {}
+
+
+def test_read_blobs_skips_large(remote, mirror, monkeypatch):
+    base, head = mirror.fetch_pull('owner', 'repo', 1, 'master')
+    shas = dict((name, sha) for name, sha, _ in mirror.changed_files('owner', 'repo', base, head))
+    new, old = shas['content/post/new.md'], shas['content/post/old.md']
+    inputs = []
+    run = mirror._git
+
+    def logged(path, *args, **kwargs):
+        inputs.append((args[1], kwargs.get('input')))
+        return run(path, *args, **kwargs)
+    monkeypatch.setattr(mirror, '_git', logged)
+
+    assert mirror.read_blobs('owner', 'repo', [new, old], max_bytes=8) == {new: None, old: b'changed'}
+    # only the small one is read in full
+    assert inputs == [
+        ('--batch-check', '{}\n{}\n'.format(new, old).encode('ascii')),
+        ('--batch', '{}\n'.format(old).encode('ascii'))]
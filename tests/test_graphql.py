@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+
+from .context import housekeeper
+from benchmarks.fake_github import FakeGitHub, blob_sha
+import housekeeper.clients
+from housekeeper import graphql
+
+
+@pytest.fixture
+def fake():
+    fake = FakeGitHub().start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def client(fake):
+    return housekeeper.clients.ClientRegistry(api_url=fake.url).get(u'bot', u'secret')
+
+
+def test_pull_request_files_pages(fake, client):
+    files = dict(('content/post/{}.md'.format(idx), b'post') for idx in range(5))
+    _, head = fake.add_pull_request(
+        'owner', 'repo', 1, 'someone', files,
+        base_files={'README.md': b'readme', 'content/post/0.md': b'old'})
+
+    found = graphql.pull_request_files(client, 'owner', 'repo', 1, page_size=2)
+
+    assert found.head_oid == head
+    assert sorted(found.files) == sorted(
+        [('content/post/0.md', 'MODIFIED')] +
+        [('content/post/{}.md'.format(idx), 'ADDED') for idx in range(1, 5)])
+    # 5 files, 2 per page
+    assert fake.calls[('POST', 'graphql')] == 3
+
+
+def test_pull_request_files_unknown(client):
+    with pytest.raises(graphql.GraphQLError):
+        graphql.pull_request_files(client, 'owner', 'repo', 404)
+
+
+def test_blobs(fake, client):
+    fake.graphql_text_limit = 10
+    head = fake.add_commit({
+        'short.md': u'你好'.encode('utf-8'),
+        'long.md': b'x' * 11,
+        'image.png': b'\xff\xd8\xff'})
+
+    found = graphql.blobs(
+        client, 'owner', 'repo', head,
+        ['short.md', 'long.md', 'image.png', 'missing.md'], batch=3)
+
+    assert found['short.md'] == graphql.Blob(
+        blob_sha(u'你好'.encode('utf-8')), 6, u'你好')
+    # truncated and binary ones come without their text
+    assert found['long.md'] == graphql.Blob(blob_sha(b'x' * 11), 11, None)
+    assert found['image.png'].text is None
+    assert found['missing.md'] is None
+    # 4 paths, 3 per query
+    assert fake.calls[('POST', 'graphql')] == 2
+
+
+def test_blobs_without_text(fake, client):
+    head = fake.add_commit({'post.md': b'text'})
+
+    found = graphql.blobs(client, 'owner', 'repo', head, ['post.md'], text=False)
+
+    assert found['post.md'] == graphql.Blob(blob_sha(b'text'), 4, None)
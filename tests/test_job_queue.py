@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+import time
+
+import pytest
+
+from .context import housekeeper
+from housekeeper.job_queue import Deferred, Failed, JobQueue, QueueFull, WorkerPool
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / 'jobs.sqlite3'), max_depth=3, max_attempts=2, retry_delay=0.0)
+
+
+def status(queue, job):
+    return queue._conn.execute(
+        'SELECT status, attempts, last_error FROM jobs WHERE id = ?', (job.id,)).fetchone()
+
+
+def test_ack(queue):
+    queue.put('pull_request', {'number': 1}, 'd1')
+
+    job = queue.claim()
+
+    assert (job.event, job.delivery, job.payload, job.attempts) == (
+        'pull_request', 'd1', {'number': 1}, 0)
+    # leased, not handed out twice
+    assert queue.claim() is None
+    queue.ack(job)
+    assert queue.depth() == 0
+    assert status(queue, job) is None
+
+
+def test_retry_then_dead(queue):
+    queue.put('pull_request', {}, 'd1')
+
+    job = queue.claim()
+    assert queue.retry(job, 'boom')
+    assert status(queue, job) == ('queued', 1, 'boom')
+
+    job = queue.claim()
+    assert job.attempts == 1
+    assert not queue.retry(job, 'boom again')
+    assert status(queue, job) == ('dead', 2, 'boom again')
+    assert queue.claim() is None
+    assert queue.depth() == 0
+
+
+def test_retry_backoff(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'), retry_delay=60.0)
+    queue.put('pull_request', {})
+
+    assert queue.retry(queue.claim())
+
+    # not before its delay
+    assert queue.claim() is None
+
+
+def test_defer_is_not_an_attempt(queue):
+    queue.put('pull_request', {})
+    job = queue.claim()
+
+    queue.defer(job, time.time() - 1, 'rate limit')
+
+    assert queue.claim().attempts == 0
+
+
+def test_expired_lease(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'), lease_seconds=0.0)
+    queue.put('pull_request', {})
+
+    first = queue.claim()
+    # its worker never came back
+    again = queue.claim()
+
+    assert again.id == first.id
+    assert again.attempts == 1
+
+
+def test_full(queue):
+    for idx in range(3):
+        queue.put('pull_request', {}, 'd{}'.format(idx))
+
+    with pytest.raises(QueueFull):
+        queue.put('pull_request', {}, 'd3')
+    assert queue.depth() == 3
+
+
+def test_dead_jobs_are_pruned(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    queue = JobQueue(path, max_attempts=1)
+    queue.put('pull_request', {})
+    job = queue.claim()
+    queue.retry(job)
+    queue._conn.execute('UPDATE jobs SET available_at = 0')
+
+    JobQueue(path, max_attempts=1)
+
+    assert status(queue, job) is None
+
+
+def test_worker_pool_gives_up(queue):
+    given_up = []
+    results = [Deferred(time.time() - 1), Failed('first'), Failed('second')]
+
+    def handler(job):
+        raise results.pop(0)
+
+    pool = WorkerPool(
+        queue, handler, logging.getLogger(__name__),
+        on_give_up=lambda job, error: given_up.append((job.attempts, error)))
+    queue.put('pull_request', {}, 'd1')
+
+    for _ in range(3):
+        pool.run_job(queue.claim())
+
+    assert given_up == [(2, 'second')]
+    assert queue.claim() is None
+
+
+def test_worker_pool_acks(queue):
+    pool = WorkerPool(queue, lambda job: True, logging.getLogger(__name__))
+    queue.put('pull_request', {}, 'd1')
+
+    pool.run_job(queue.claim())
+
+    assert queue.depth() == 0
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from .context import housekeeper
+from housekeeper import rules
+
+
+POSTS = 'content/post/'
+META = (
+    '---\n'
+    'title: "hello"\n'
+    'author: "someone"\n'
+    'categories: ["R"]\n'
+    'tags: ["R"]\n'
+    'meta_extra: ""\n'
+    'forum_id: 1\n'
+    '---\n'
+)
+
+
+def rule_ids(findings):
+    return [x.rule for x in findings]
+
+
+def test_path():
+    assert rules.check_path(POSTS + '2018-01-01-hello.md', POSTS) == []
+    assert rule_ids(rules.check_path(POSTS + 'hello.docx', POSTS)) == [
+        'file-extension', 'file-name-format']
+    assert rule_ids(rules.check_path(POSTS + '2018/2018-01-01-hello.md', POSTS)) == [
+        'post-location']
+    # the posts directory itself is not an article
+    assert rules.check_path(POSTS, POSTS) is None
+
+
+def test_text_fine():
+    findings, body_start = rules.check_text(META + '\nhello\n')
+
+    assert findings == []
+    assert body_start == 8
+
+
+def test_text_meta_and_lines():
+    findings, body_start = rules.check_text(
+        '---\ntitle: "hello"\n---\n\n![](a.png)\n')
+
+    assert body_start == 3
+    assert rule_ids(findings) == [
+        'meta-extra', 'meta-forum-id',
+        'meta-essential-keys', 'meta-essential-keys', 'meta-essential-keys',
+        'image-alt-text']
+    assert findings[-1].line == 5
+    assert findings[-1].cell is None
+
+
+def test_text_structure():
+    assert rule_ids(rules.check_text('')[0]) == ['content-empty']
+    assert rule_ids(rules.check_text('no meta\n')[0]) == ['yaml-missing']
+
+
+def test_rmarkdown_chunks_are_code():
+    text = META + '```{r}\nplot(1) # ![](a.png)\n```\n![](b.png)\n'
+
+    findings, _ = rules.check_text(text, rmarkdown=True)
+
+    assert [(x.rule, x.line) for x in findings] == [('image-alt-text', 12)]
+
+
+def test_options():
+    options = rules.Options(
+        allowed_extensions=frozenset({'.md'}), required_meta_keys=('author',))
+
+    assert rule_ids(rules.check_path(POSTS + '2018-01-01-hello.txt', POSTS, options)) == [
+        'file-extension']
+    assert rules.check_meta('author: someone\nmeta_extra: ""\nforum_id: 1', options) == []
+    assert rules.options_fingerprint(options) != rules.options_fingerprint(
+        rules.DEFAULT_OPTIONS)